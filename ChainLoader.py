@@ -0,0 +1,121 @@
+from ChainProviders import get_annual_time_to_expiration
+from PyOptionClasses.OptionsClass import option_data
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import inspect
+
+
+# Desc: Concurrent (asyncio) loader of the options chains of many tickers and expirations from a chain provider
+#       (see ChainProviders). Up to max_concurrency provider calls run at once, failed calls are retried with
+#       exponential backoff, and chains are parsed and priced in the executor while other chains are fetched.
+#       The provider (and its connections) and the executor are reused by every call of the loader.
+#       Blocking providers are run in the executor, providers with async methods are awaited directly.
+class AsyncChainLoader:
+    def __init__(self, provider, max_concurrency=8, max_retries=3, retry_backoff=0.5, executor=None):
+        assert max_concurrency > 0
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.executor = executor
+
+    async def call_provider(self, semaphore, method, *args):
+        """ Calls a provider method (at most max_concurrency at once), retrying failed calls after
+            retry_backoff, 2 * retry_backoff, 4 * retry_backoff ... seconds """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    if inspect.iscoroutinefunction(method):
+                        return await method(*args)
+                    return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                            functools.partial(method, *args))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+
+    async def load(self, tickers, curr_int_rate, curr_volatility, expiration_filter=None, grid_policy=None,
+                   as_of=None):
+        """ Async generator of (ticker, option_data) for every expiration of the tickers, yielded as soon as each
+            chain is fetched and parsed (not in ticker or expiration order).
+            expiration_filter(ticker, expiration_date) selects the expirations to load (all by default), as_of is
+            the date the times to expiration are found from (now by default).
+            A chain failing every retry stops the loading and raises its error. """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        loaded_chains = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        async def load_chain(ticker, expiration_date, curr_stock_price):
+            calls, puts = await self.call_provider(semaphore, self.provider.get_chain, ticker, expiration_date)
+            annual_time_to_exp = get_annual_time_to_expiration(expiration_date, as_of)
+            # Parsed and priced in the executor so other chains keep loading
+            ops_data = await loop.run_in_executor(self.executor, functools.partial(
+                option_data, calls, puts, expiration_date, curr_stock_price, annual_time_to_exp, curr_int_rate,
+                curr_volatility, grid_policy))
+            await loaded_chains.put((ticker, ops_data))
+
+        async def load_ticker(ticker):
+            expiration_dates, curr_stock_price = await asyncio.gather(
+                self.call_provider(semaphore, self.provider.get_expiration_dates, ticker),
+                self.call_provider(semaphore, self.provider.get_stock_price, ticker))
+            await asyncio.gather(*(load_chain(ticker, expiration_date, curr_stock_price)
+                                   for expiration_date in expiration_dates
+                                   if expiration_filter is None or expiration_filter(ticker, expiration_date)))
+
+        async def load_tickers():
+            try:
+                await asyncio.gather(*(load_ticker(ticker) for ticker in tickers))
+            except Exception as error:
+                await loaded_chains.put(error)
+            else:
+                await loaded_chains.put(None)
+
+        loading = asyncio.ensure_future(load_tickers())
+        try:
+            while True:
+                loaded_chain = await loaded_chains.get()
+                if loaded_chain is None:
+                    break
+                if isinstance(loaded_chain, Exception):
+                    raise loaded_chain
+                yield loaded_chain
+        finally:
+            loading.cancel()
+            await asyncio.gather(loading, return_exceptions=True)
+
+    def close(self):
+        """ Shuts down the executor of the loader (when the loader created it) """
+        if self.owns_executor:
+            self.executor.shutdown(wait=True)
+        return
+
+
+# Desc: Load the options chains of many tickers concurrently (see AsyncChainLoader) without using asyncio directly
+# Input: Chain provider, tickers, interest rate, volatility (user found), optional expiration filter
+#        (ticker, expiration date -> bool), max concurrent provider calls, seconds before the first retry,
+#        date the time to expiration is found from
+# Output: Dictionary of ticker -> list of option_data (in order of time to expiration)
+def load_all_option_data(provider, tickers, curr_int_rate, curr_volatility, expiration_filter=None,
+                         max_concurrency=8, retry_backoff=0.5, as_of=None):
+    async def collect_option_chains():
+        option_chains = {ticker: [] for ticker in tickers}
+        async for ticker, ops_data in loader.load(tickers, curr_int_rate, curr_volatility, expiration_filter,
+                                                  as_of=as_of):
+            option_chains[ticker].append(ops_data)
+        return option_chains
+
+    loader = AsyncChainLoader(provider, max_concurrency, retry_backoff=retry_backoff)
+    try:
+        option_chains = asyncio.run(collect_option_chains())
+    finally:
+        loader.close()
+
+    for ticker_chains in option_chains.values():
+        ticker_chains.sort(key=lambda ops_data: ops_data.annual_time_to_expiration)
+    return option_chains
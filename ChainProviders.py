@@ -0,0 +1,210 @@
+from PyOptionClasses.OptionsClass import option_data
+from abc import ABC, abstractmethod
+import hashlib
+import json
+import os
+import time
+import pandas as pd
+
+# Columns of the options data used by option_data (the data of every provider is in this format)
+OPTION_DATA_COLUMNS = ['Exercise Price', 'Price', 'Implied Volatility', 'Delta', 'Gamma', 'Theta', 'Vega', 'Rho']
+
+
+# Desc: Put options data into the format of option_data: renames the columns, turns values such as '25.39%' or
+#       '-' into numbers (nan when missing), sorts by strike and keeps only the option_data columns
+# Input: Options data (DataFrame), mapping of the data column names to the option_data column names
+# Output: Options data (DataFrame) ready for option_data
+def normalize_options_data(options_data, column_mapping=None):
+    options_data = options_data.rename(columns=column_mapping or {})
+    normalized_data = pd.DataFrame(index=options_data.index)
+    for column_name in OPTION_DATA_COLUMNS:
+        if column_name not in options_data:
+            continue
+        column = options_data[column_name]
+        if not pd.api.types.is_numeric_dtype(column):
+            column = column.astype(str).str.replace('%', '', regex=False).str.replace(',', '', regex=False)
+        normalized_data[column_name] = pd.to_numeric(column, errors='coerce')
+
+    return normalized_data.sort_values('Exercise Price', kind='stable').reset_index(drop=True)
+
+
+# Desc: Annual time to expiration of an expiration date (i.e. 'May 15, 2026')
+# Input: Expiration date, date to find the time from (defaults to now)
+# Output: Annual time to expiration (days / 365), 0 once expired
+def get_annual_time_to_expiration(expiration_date, as_of=None):
+    if as_of is None:
+        as_of = pd.Timestamp.now()
+    days_to_expiration = (pd.Timestamp(expiration_date) - pd.Timestamp(as_of)).total_seconds() / (24 * 60 * 60)
+    return max(days_to_expiration, 0) / 365
+
+
+# Desc: Interface of the sources of options chains (market data, local fixtures, caches)
+#       Providers implement get_expiration_dates, get_chain and get_stock_price (the bulk fetch and option_data
+#       are built from them)
+#       Options data is returned as DataFrames ready for option_data (see normalize_options_data)
+class ChainProvider(ABC):
+    @abstractmethod
+    def get_expiration_dates(self, ticker):
+        """ Returns the expiration dates of the options of the ticker """
+
+    @abstractmethod
+    def get_chain(self, ticker, expiration_date):
+        """ Returns the call and put options data of the ticker expiring on the expiration date """
+
+    @abstractmethod
+    def get_stock_price(self, ticker):
+        """ Returns the current stock price of the ticker """
+
+    def get_all_chains(self, ticker):
+        """ Bulk fetch: returns the call and put options data of every expiration of the ticker
+            as a dictionary of expiration date -> (calls, puts) """
+        return {expiration_date: self.get_chain(ticker, expiration_date)
+                for expiration_date in self.get_expiration_dates(ticker)}
+
+    def get_option_data(self, ticker, expiration_date, curr_int_rate, curr_volatility, annual_time_to_exp=None,
+                        curr_stock_price=None, grid_policy=None):
+        """ Returns the options of the ticker expiring on the expiration date as an option_data
+            (time to expiration from the expiration date and the current stock price by default) """
+        if annual_time_to_exp is None:
+            annual_time_to_exp = get_annual_time_to_expiration(expiration_date)
+        if curr_stock_price is None:
+            curr_stock_price = self.get_stock_price(ticker)
+        calls, puts = self.get_chain(ticker, expiration_date)
+        return option_data(calls, puts, expiration_date, curr_stock_price, annual_time_to_exp, curr_int_rate,
+                           curr_volatility, grid_policy)
+
+
+# Desc: Options chains from Yahoo Finance (yahoo_fin, only imported when used so everything else runs offline)
+#       Prices are the last trade price by default (i.e. 'Bid' or 'Ask' to use the quotes instead)
+class YahooChainProvider(ChainProvider):
+    def __init__(self, price_column='Last Price'):
+        self.column_mapping = {'Strike': 'Exercise Price', price_column: 'Price'}
+
+    def get_expiration_dates(self, ticker):
+        from yahoo_fin import options
+        return list(options.get_expiration_dates(ticker))
+
+    def get_chain(self, ticker, expiration_date):
+        from yahoo_fin import options
+        chain = options.get_options_chain(ticker, expiration_date)
+        return (normalize_options_data(chain['calls'], self.column_mapping),
+                normalize_options_data(chain['puts'], self.column_mapping))
+
+    def get_stock_price(self, ticker):
+        from yahoo_fin import stock_info
+        return float(stock_info.get_live_price(ticker))
+
+
+# Desc: Options chains from local data (for development, tests and batch jobs without network access)
+#       Chains are given as {ticker: {expiration date: (calls, puts)}} and stock prices as {ticker: price},
+#       or loaded from a fixture directory (see save_fixtures)
+class FixtureChainProvider(ChainProvider):
+    def __init__(self, chains, stock_prices):
+        self.chains = chains
+        self.stock_prices = stock_prices
+
+    def get_expiration_dates(self, ticker):
+        return list(self.get_ticker_chains(ticker))
+
+    def get_chain(self, ticker, expiration_date):
+        ticker_chains = self.get_ticker_chains(ticker)
+        if expiration_date not in ticker_chains:
+            raise KeyError(f'No {ticker} options expiring {expiration_date}')
+        calls, puts = ticker_chains[expiration_date]
+        return calls.copy(), puts.copy()
+
+    def get_stock_price(self, ticker):
+        if ticker not in self.stock_prices:
+            raise KeyError(f'No stock price for {ticker}')
+        return self.stock_prices[ticker]
+
+    def get_ticker_chains(self, ticker):
+        if ticker not in self.chains:
+            raise KeyError(f'No options for {ticker}')
+        return self.chains[ticker]
+
+    @classmethod
+    def from_directory(cls, directory):
+        """ Loads the fixtures of a directory written by save_fixtures """
+        chains, stock_prices = {}, {}
+        for ticker in sorted(os.listdir(directory)):
+            fixture_path = os.path.join(directory, ticker, 'fixture.json')
+            if not os.path.isfile(fixture_path):
+                continue
+            with open(fixture_path) as fixture_file:
+                fixture = json.load(fixture_file)
+
+            stock_prices[ticker] = fixture['stock_price']
+            chains[ticker] = {}
+            for i, expiration_date in enumerate(fixture['expiration_dates']):
+                chains[ticker][expiration_date] = tuple(
+                    pd.read_csv(os.path.join(directory, ticker, f'{i:03d}_{side}.csv')) for side in ('calls', 'puts'))
+        return cls(chains, stock_prices)
+
+    @staticmethod
+    def save_fixtures(provider, tickers, directory):
+        """ Saves every chain of the tickers from a provider (i.e. Yahoo) as fixtures, to be used offline with
+            FixtureChainProvider.from_directory """
+        for ticker in tickers:
+            os.makedirs(os.path.join(directory, ticker), exist_ok=True)
+            ticker_chains = provider.get_all_chains(ticker)
+            for i, (calls, puts) in enumerate(ticker_chains.values()):
+                calls.to_csv(os.path.join(directory, ticker, f'{i:03d}_calls.csv'), index=False)
+                puts.to_csv(os.path.join(directory, ticker, f'{i:03d}_puts.csv'), index=False)
+
+            fixture = {'stock_price': provider.get_stock_price(ticker), 'expiration_dates': list(ticker_chains)}
+            with open(os.path.join(directory, ticker, 'fixture.json'), 'w') as fixture_file:
+                json.dump(fixture, fixture_file)
+        return
+
+
+# Desc: File backed cache of another provider: results are saved in the cache directory and used again until
+#       they are older than their time to live (seconds, None to never expire). Repeated runs only fetch what
+#       is missing or expired. Stock prices are cached for a short time by default, chains for longer.
+class CachedChainProvider(ChainProvider):
+    def __init__(self, provider, cache_directory, expiration_dates_ttl=12 * 60 * 60, chain_ttl=15 * 60,
+                 stock_price_ttl=60):
+        self.provider = provider
+        self.cache_directory = cache_directory
+        self.expiration_dates_ttl = expiration_dates_ttl
+        self.chain_ttl = chain_ttl
+        self.stock_price_ttl = stock_price_ttl
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def get_expiration_dates(self, ticker):
+        return self.get_or_fetch(('expiration_dates', ticker), self.expiration_dates_ttl,
+                                 lambda: self.provider.get_expiration_dates(ticker))
+
+    def get_chain(self, ticker, expiration_date):
+        calls, puts = self.get_or_fetch(('chain', ticker, expiration_date), self.chain_ttl,
+                                        lambda: self.provider.get_chain(ticker, expiration_date))
+        return calls.copy(), puts.copy()
+
+    def get_stock_price(self, ticker):
+        return self.get_or_fetch(('stock_price', ticker), self.stock_price_ttl,
+                                 lambda: self.provider.get_stock_price(ticker))
+
+    def get_cache_path(self, key):
+        """ Returns the file of the cached value of the key """
+        key_hash = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self.cache_directory, f'{key[0]}_{key_hash}.pkl')
+
+    def get_or_fetch(self, key, ttl, fetch):
+        """ Returns the cached value of the key while it is fresh, otherwise fetches (and caches) it """
+        cache_path = self.get_cache_path(key)
+        if os.path.isfile(cache_path) and (ttl is None or time.time() - os.path.getmtime(cache_path) < ttl):
+            return pd.read_pickle(cache_path)
+
+        value = fetch()
+        # Written to a temporary file first so other processes never read a partly written value
+        temporary_path = f'{cache_path}.{os.getpid()}.tmp'
+        pd.to_pickle(value, temporary_path)
+        os.replace(temporary_path, cache_path)
+        return value
+
+    def clear(self):
+        """ Removes every cached value """
+        for file_name in os.listdir(self.cache_directory):
+            if file_name.endswith('.pkl'):
+                os.remove(os.path.join(self.cache_directory, file_name))
+        return
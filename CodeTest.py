@@ -1,14 +1,37 @@
 import unittest
+import operator
+import asyncio
+import tempfile
+import threading
+import numpy as np
 import pandas as pd
 
 from CommoditiesFuturePricing import getConvenienceYield_XMoContract, stockForwardPrice, generateDivPayments, \
     simpleStockForwardPrice, generateCouponMonthPayments, bondForwardPrice
 from PricingModels import call_option_expected_value, get_theoretical_value_of_contract, put_option_expected_value, \
-    get_scaled_volatility, black_scholes_model_option_price, calc_theta_for_atm_option
+    get_scaled_volatility, black_scholes_model_option_price, calc_theta_for_atm_option, \
+    black_scholes_model_option_price_batch, black_scholes_model_greeks_batch, implied_volatility_batch, \
+    standard_normal_cdf, standard_normal_pdf, standard_normal_cdf_batch, standard_normal_pdf_batch, LRUCache, \
+    cached_black_scholes_model_option_price, theoretical_price_cache, expiry_payoff_metrics, \
+    expiry_payoff_metrics_batch
 from DynamicHedging import delta_neutrality_stock
-from PyOptionClasses.OptionsClass import greeks, option, option_data
+from PyOptionClasses.OptionsClass import greeks, option, option_data, PriceGridPolicy, price_range_cache, StrikeIndex
+from PyOptionClasses.OptionChainClass import OptionChain, save_option_chains, load_option_chains
+from PyOptionClasses.VolatilitySurfaceClass import VolatilitySurface
+from PyOptionClasses.SpreadsClass import SpreadBook, SpreadConstraints, SpreadCandidate, Butterfly
+from ChainProviders import (ChainProvider, FixtureChainProvider, CachedChainProvider, normalize_options_data,
+                            get_annual_time_to_expiration)
+from ChainLoader import AsyncChainLoader, load_all_option_data
 from FindingSpreads import (getStraddleSpreads, getStrangleSpreads, getButterflySpreads, getCondorSpreads,
-                            getIronCondorSpreads, getRatioSpreads, getChristmasTreeSpreads, getCalendarStraddle)
+                            getIronCondorSpreads, getRatioSpreads, getChristmasTreeSpreads, getCalendarStraddle,
+                            iterSpreads, iterButterflyCandidates, iterCondorCandidates)
+from SpreadScanner import (scan_spreads_parallel, partition_scans, rank_spreads, rank_candidates,
+                           iter_numbered_candidates, RankingMetric, RANKING_METRICS)
+
+
+# Desc: Candidate filter of the parallel scan tests (module level so it can be sent to worker processes)
+def is_debit_candidate(candidate):
+    return candidate.cost > 0
 
 
 class CommoditiesFuturesTest(unittest.TestCase):
@@ -144,6 +167,19 @@ class PricingModelsTest(unittest.TestCase):
         self.assertEqual(scaled_vol_week, 2.77)
         # print(f'Scaled vol at {annual_volatility} given {gen_time_week} is {scaled_vol_week}% \n')
 
+    def test_standard_normal_distribution(self):
+        # Test the normal distribution functions used by the pricing models
+        self.assertEqual(standard_normal_cdf(0), 0.5)
+        self.assertAlmostEqual(standard_normal_cdf(1.96), 0.9750021048517795, places=12)
+        self.assertAlmostEqual(standard_normal_cdf(-1.96), 1 - 0.9750021048517795, places=12)
+        self.assertAlmostEqual(standard_normal_pdf(0), 0.3989422804014327, places=12)
+
+        values = np.linspace(-8, 8, 33)
+        np.testing.assert_allclose(standard_normal_cdf_batch(values), [standard_normal_cdf(x) for x in values],
+                                   rtol=1e-12)
+        np.testing.assert_allclose(standard_normal_pdf_batch(values), [standard_normal_pdf(x) for x in values],
+                                   rtol=1e-12)
+
     def test_black_scholes_model(self):
         # Test black-scholes model
 
@@ -170,11 +206,140 @@ class PricingModelsTest(unittest.TestCase):
         self.assertEqual(option_price_bsm_call_2, 0.03)
         self.assertEqual(option_price_bsm_put_2, 5.87)
 
+        # Expiry day: options are worth their intrinsic value (the same as the batch model)
+        self.assertEqual(black_scholes_model_option_price(110, 105, 0, 0.05, 20, 'call'), 5)
+        self.assertEqual(black_scholes_model_option_price(110, 105, 0, 0.05, 20, 'put'), 0)
+        self.assertEqual(black_scholes_model_option_price(100, 105, -0.01, 0.05, 20, 'put'), 5)
+        self.assertEqual(black_scholes_model_option_price(105, 105, 0, 0.05, 20, 'call'), 0)
+
+        # A worthless stock: calls are worthless, puts are worth the discounted strike
+        self.assertEqual(black_scholes_model_option_price(0, 105, 0.5, 0.05, 20, 'call'), 0)
+        self.assertEqual(black_scholes_model_option_price(0, 105, 0.5, 0.05, 20, 'put'),
+                         round(black_scholes_model_option_price_batch(0, 105, 0.5, 0.05, 20, False).item(), 2))
+
+        with self.assertRaises(ValueError):
+            black_scholes_model_option_price(100, 105, 0, 0.05, 20, 'straddle')
+
         # assert (option_price_bsm_call == 4.58)
         # assert (option_price_bsm_put == 6.99)
         # print(f"Theoretical option price for call: {option_price_bsm_call:.2f}")
         # print(f"Theoretical option price for call: {option_price_bsm_put:.2f} \n")
 
+    def test_black_scholes_model_batch(self):
+        # Test the batch black-scholes model against the single option model
+        S = [100, 100, 38.16, 38.16]
+        K = [105, 105, 44, 44]
+        T = [0.5, 0.5, 0.1666, 0.1666]
+        r = [0.05, 0.05, 0.0, 0.0]
+        sigma = [0.2, 0.2, 18, 18]
+        is_call = [True, False, True, False]
+
+        option_prices = black_scholes_model_option_price_batch(S, K, T, r, sigma, is_call)
+        self.assertEqual(option_prices.shape, (4,))
+        self.assertEqual([round(price, 2) for price in option_prices], [4.58, 6.99, 0.03, 5.87])
+
+        # Option types can also be given, and a price grid broadcasts against a single strike
+        price_grid = np.array([90, 100, 110])
+        grid_prices = black_scholes_model_option_price_batch(price_grid, 105, 0.5, 0.05, 0.2, 'call')
+        for price, grid_price in zip(price_grid, grid_prices):
+            self.assertEqual(round(grid_price, 2), black_scholes_model_option_price(price, 105, 0.5, 0.05, 0.2, 'call'))
+
+        # Expired options are worth their intrinsic value
+        expired_prices = black_scholes_model_option_price_batch(price_grid, 100, 0, 0.05, 0.2, [[True], [False]])
+        self.assertEqual(expired_prices.tolist(), [[0, 0, 10], [10, 0, 0]])
+
+        with self.assertRaises(ValueError):
+            black_scholes_model_option_price_batch(100, 105, 0.5, 0.05, 0.2, 'straddle')
+
+    def test_black_scholes_greeks_batch(self):
+        # Test the batch greeks against vendor greeks (May 15 chain) and finite differences of the model
+        strikes = np.array([44, 46, 48, 50, 52, 54])
+        delta, gamma, theta, vega, rho = black_scholes_model_greeks_batch(48.40, strikes, 0.1534, 0.0, 18, True)
+
+        np.testing.assert_allclose(delta, [0.92, 0.78, 0.56, 0.33, 0.16, 0.06], atol=0.05)
+        np.testing.assert_allclose(vega, [0.029, 0.057, 0.075, 0.069, 0.047, 0.024], atol=0.006)
+        np.testing.assert_allclose(theta, [-0.0046, -0.0091, -0.0121, -0.0111, -0.0075, -0.0038], atol=0.001)
+
+        # Put delta follows from call-put parity, rho matches a bump of the interest rate
+        put_delta, _, _, _, put_rho = black_scholes_model_greeks_batch(48.40, strikes, 0.1534, 0.0, 18, False)
+        np.testing.assert_allclose(delta - put_delta, 1)
+
+        bumped_prices = black_scholes_model_option_price_batch(48.40, strikes, 0.1534, [[-0.0005], [0.0005]], 18, False)
+        np.testing.assert_allclose((bumped_prices[1] - bumped_prices[0]) * 10, put_rho, rtol=0.001)
+
+        # Only delta is left at expiration
+        expired_greeks = black_scholes_model_greeks_batch(48.40, [44, 54], 0, 0.0, 18, ['call', 'put'])
+        self.assertEqual([greek.tolist() for greek in expired_greeks], [[1, -1], [0, 0], [0, 0], [0, 0], [0, 0]])
+
+    def test_implied_volatility_batch(self):
+        # Test solving the implied volatility of the May 15 chain (from the vendor prices)
+        strikes = [44, 46, 48, 50, 52, 54]
+        call_prices = [4.59, 2.99, 1.75, 0.93, 0.47, 0.23]
+        put_prices = [0.20, 0.58, 1.35, 2.53, 4.06, 5.84]
+
+        implied_vols = implied_volatility_batch([call_prices, put_prices], 48.40, strikes, 0.1534, 0.0,
+                                                [[True], [False]])
+        np.testing.assert_allclose(implied_vols, [[19.83, 20.25, 20.48, 20.88, 21.63, 22.46],
+                                                  [20.12, 20.09, 20.48, 20.88, 21.45, 22.73]], atol=0.01)
+
+        # Solved vols reprice the options
+        np.testing.assert_allclose(black_scholes_model_option_price_batch(48.40, strikes, 0.1534, 0.0,
+                                                                          implied_vols[0], True), call_prices,
+                                   atol=1e-6)
+
+        # Warm starting from a previous snapshot gives the same vols
+        warm_started_vols = implied_volatility_batch(call_prices, 48.40, strikes, 0.1534, 0.0, True,
+                                                     initial_volatility=implied_vols[0] + 1)
+        np.testing.assert_allclose(warm_started_vols, implied_vols[0], atol=1e-4)
+
+        # Vols above 100% and short expiries are solved (and reprice the options)
+        true_vols = [150, 120, 80, 80]
+        expirations = [1, 0.02, 0.01, 0.01]
+        high_vol_strikes = [50, 50, 51.5, 46]
+        high_vol_prices = black_scholes_model_option_price_batch(48.40, high_vol_strikes, expirations, 0.0,
+                                                                 true_vols, [True, True, True, False])
+        high_vols = implied_volatility_batch(high_vol_prices, 48.40, high_vol_strikes, expirations, 0.0,
+                                             [True, True, True, False])
+        np.testing.assert_allclose(high_vols, true_vols, atol=1e-3)
+        np.testing.assert_allclose(black_scholes_model_option_price_batch(48.40, high_vol_strikes, expirations, 0.0,
+                                                                          high_vols, [True, True, True, False]),
+                                   high_vol_prices, atol=1e-6)
+
+        # Prices outside of the no-arbitrage bounds have no implied vol
+        bad_vols = implied_volatility_batch([4.0, 60, 1.0], 48.40, [44, 44, 44], [0.1534, 0.1534, 0], 0.0, True)
+        self.assertTrue(np.all(np.isnan(bad_vols)))
+
+    def test_lru_cache(self):
+        # Test the least recently used cache evicts the oldest values and keeps statistics
+        cache = LRUCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get_or_compute('c', lambda: 30), 3)
+        self.assertEqual(cache.get_or_compute('d', lambda: 4), 4)
+        self.assertEqual(cache.cache_info(), {'hits': 2, 'misses': 2, 'evictions': 2, 'size': 2, 'max_size': 2})
+
+        cache.set_max_size(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('d'), 4)
+
+        cache.set_max_size(0)
+        cache.put('e', 5)
+        self.assertIsNone(cache.get('e'))
+
+    def test_cached_black_scholes_model(self):
+        # Test the cached model gives the same prices and reuses repeated prices
+        theoretical_price_cache.clear()
+        self.assertEqual(cached_black_scholes_model_option_price(100, 105, 0.5, 0.05, 0.2, 'call'), 4.58)
+        self.assertEqual(cached_black_scholes_model_option_price(100.0, 105, 0.5, 0.05, 0.2, 'call'), 4.58)
+        self.assertEqual(cached_black_scholes_model_option_price(100, 105, 0.5, 0.05, 0.2, 'put'), 6.99)
+
+        cache_info = theoretical_price_cache.cache_info()
+        self.assertEqual((cache_info['hits'], cache_info['misses']), (1, 2))
+
     def test_atm_theta_calculation(self):
         # Test atm theta calc function
 
@@ -282,6 +447,329 @@ class FindingSpreadsTest(unittest.TestCase):
 
         # Add test across the different prices
 
+    def test_option_data_implied_volatility(self):
+        # Test the option data solves implied vols when the data has none, and refreshes them from new prices
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data).drop(columns='Implied Volatility')
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18)
+
+        self.assertEqual([op.implied_volatility for op in may_options.options_calls],
+                         [19.83, 20.26, 20.48, 20.88, 21.63, 22.46])
+
+        may_options.options_puts[0].curr_cost = 0.25
+        may_options.refresh_implied_volatility()
+        self.assertEqual(may_options.options_puts[0].implied_volatility, 21.5)
+        self.assertEqual(may_options.options_puts[1].implied_volatility, 20.09)
+
+    def test_option_chain_columns(self):
+        # Test the columnar chain matches the option data and finds spreads over its columns
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18)
+        may_chain = OptionChain(call_may_df, put_may_df, 'May 15', 48.40,
+                                0.1534, 0.0, 18)
+
+        self.assertEqual(len(may_chain), 12)
+        self.assertEqual(may_chain.data_spread, may_options.data_spread)
+        self.assertEqual(may_chain.data_spread, 2)
+
+        # Chains of one side, or a single strike, do not have a strike spacing to read
+        puts_chain = OptionChain(None, put_may_df, 'May 15', 48.40, 0.1534, 0.0, 18)
+        self.assertEqual(puts_chain.num_calls, 0)
+        self.assertEqual(puts_chain.data_spread, 2)
+        single_strike_chain = OptionChain(call_may_df.iloc[:1], None, 'May 15', 48.40, 0.1534, 0.0, 18)
+        self.assertEqual(len(single_strike_chain), 1)
+        self.assertIsNone(single_strike_chain.data_spread)
+        self.assertIsNone(option_data(call_may_df.iloc[:1], None, 'May 15', 48.40, 0.1534, 0.0, 18).data_spread)
+        self.assertEqual(may_chain.strike_prices[:6].tolist(), [op.strike_price for op in may_options.options_calls])
+        self.assertEqual(may_chain.thetas[6:].tolist(), [op.greeks.theta for op in may_options.options_puts])
+        self.assertEqual(may_chain.rhos[:6].tolist(), [op.greeks.rho for op in may_options.options_calls])
+        self.assertEqual(may_chain.theoretical_prices.tolist(),
+                         [op.theoretical_price for op in may_options.options_calls + may_options.options_puts])
+
+        # Option objects are created for the chain, so spreads are found the same way
+        self.assertEqual([spread.cost for spread in getButterflySpreads(may_chain, 2)],
+                         [spread.cost for spread in getButterflySpreads(may_options, 2)])
+
+        # Short put butterflies (44/46/48 first) found over the columns
+        leg_indices = may_chain.enumerate_spread_legs(('put', 'put', 'put'), (0, 1, 2))
+        self.assertEqual(may_chain.strike_prices[leg_indices[0]].tolist(), [44, 46, 48])
+        self.assertEqual(len(leg_indices), 4)
+        spread_costs = may_chain.calculate_spread_costs(leg_indices, ('Sold', 'Bought', 'Sold'), (1, 2, 1))
+        self.assertEqual(round(spread_costs[0], 2), -0.39)
+        spread_greeks = may_chain.calculate_spread_greeks(leg_indices, ('Sold', 'Bought', 'Sold'), (1, 2, 1))
+        self.assertAlmostEqual(spread_greeks[0, 0], -may_chain.deltas[6] + 2 * may_chain.deltas[7] - may_chain.deltas[8])
+
+        # Refreshing the columns updates the option objects
+        may_chain.refresh_greeks()
+        self.assertEqual(may_chain.options_puts[0].greeks.delta, may_chain.deltas[6])
+        np.testing.assert_array_almost_equal(may_chain.calculate_greeks()[0], may_chain.deltas)
+
+    def test_option_chain_snapshots(self):
+        # Test chains of many expirations are saved and loaded (memory mapped) with the same options
+        may_chain = OptionChain(pd.DataFrame(self.call_options_exp_may_15_data),
+                                pd.DataFrame(self.put_options_exp_may_15_data), 'May 15', 48.40, 0.1534, 0.0, 18,
+                                grid_policy=PriceGridPolicy('fixed', num_points=100))
+        july_options = option_data(pd.DataFrame(self.call_options_exp_july_15_data),
+                                   pd.DataFrame(self.put_options_exp_july_15_data), 'July 15', 48.40, 0.3178, 0.0, 18)
+
+        with tempfile.TemporaryDirectory() as snapshot_directory:
+            save_option_chains([may_chain, july_options], snapshot_directory)
+            loaded_may_chain, loaded_july_chain = load_option_chains(snapshot_directory)
+
+            self.assertIsInstance(loaded_may_chain.costs.base, np.memmap)
+            self.assertEqual((loaded_may_chain.expiration_date, loaded_july_chain.expiration_date), ('May 15', 'July 15'))
+            for column_name, column in may_chain.get_columns().items():
+                np.testing.assert_array_equal(loaded_may_chain.get_columns()[column_name], column)
+            self.assertEqual(loaded_july_chain.thetas.tolist(),
+                             [op.greeks.theta for op in july_options.options_calls + july_options.options_puts])
+            self.assertEqual(loaded_may_chain.grid_policy.get_key(), may_chain.grid_policy.get_key())
+
+            # Spreads of a loaded chain are the same, and changes to it are not written to the snapshot
+            self.assertEqual([spread.cost for spread in getButterflySpreads(loaded_may_chain, 2)],
+                             [spread.cost for spread in getButterflySpreads(may_chain, 2)])
+            loaded_may_chain.update_quotes('call', pd.DataFrame({'Exercise Price': [44], 'Price': [5.0]}))
+            self.assertEqual(load_option_chains(snapshot_directory)[0].costs[0], 4.59)
+            del loaded_may_chain, loaded_july_chain
+
+    def test_strike_index(self):
+        # Test strikes are found on a ladder mixing $2.5 and $5 strikes (with calls and puts in any order)
+        strike_index = StrikeIndex([40, 42.5, 45, 47.5, 50, 55, 60], [60, 50, 45, 40])
+
+        self.assertEqual(strike_index.find('call', [47.5, 52.5, 60.0000001]).tolist(), [3, -1, 6])
+        self.assertEqual(strike_index.find('put', [40, 50, 55]).tolist(), [3, 1, -1])
+        self.assertEqual(strike_index.find_legs(('put', 'call'), (0, 5), [40, 45, 50]).tolist(),
+                         [[3, 2], [2, 4], [1, 5]])
+
+    def test_generating_spreads_non_uniform_strikes(self):
+        # Test spreads are found by strike (not by position) on a ladder mixing $2.5 and $5 strikes
+        strikes = [40, 42.5, 45, 47.5, 50, 55, 60]
+        call_df = pd.DataFrame({'Exercise Price': strikes, 'Price': [9.0, 6.8, 4.7, 3.0, 1.7, 0.4, 0.1]})
+        put_df = pd.DataFrame({'Exercise Price': strikes, 'Price': [0.1, 0.3, 0.7, 1.5, 2.7, 6.6, 11.5]})
+
+        options = option_data(call_df, put_df, 'May 15', 48.40, 0.1534, 0.0, 18)
+
+        butterflies = getButterflySpreads(options, 5)
+        self.assertEqual(len(butterflies), 12)
+        self.assertEqual([[op.strike_price for op in spread.options] for spread in butterflies[::4]],
+                         [[40, 45, 45, 50], [45, 50, 50, 55], [50, 55, 55, 60]])
+        self.assertEqual(len(getButterflySpreads(options, 2.5)), 12)
+
+        strangles = getStrangleSpreads(options, 10)
+        self.assertEqual([(spread.options[0].strike_price, spread.options[1].strike_price) for spread in strangles[::2]],
+                         [(40, 50), (45, 55), (50, 60)])
+
+    def test_streaming_spreads(self):
+        # Test spreads are built lazily from candidates, and filtered candidates are never built
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18)
+        butterflies = getButterflySpreads(may_options, 2)
+
+        # Candidates have the cost and greeks of their spreads before they are built
+        candidates = list(iterButterflyCandidates(may_options, 2))
+        self.assertEqual(len(candidates), len(butterflies))
+        for candidate, butterfly in zip(candidates, butterflies):
+            self.assertEqual(candidate.cost, butterfly.cost)
+            self.assertEqual(candidate.greeks.get_greeks(), butterfly.greeks.get_greeks())
+            self.assertEqual(candidate.exact_metrics(), butterfly.exact_metrics())
+
+        # Stopping early only builds the spreads used
+        built = []
+        candidates = iterCondorCandidates(may_options, 2, 2)
+        spreads = iterSpreads(candidates, lambda candidate: built.append(candidate) or True)
+        first_spread = next(spreads)
+        self.assertEqual(len(built), 1)
+        self.assertEqual(first_spread.cost, getCondorSpreads(may_options, 2, 2)[0].cost)
+
+        # Filters are applied to the candidates (in order) before building the spreads
+        debit_butterflies = getButterflySpreads(may_options, 2, lambda candidate: candidate.cost > 0)
+        self.assertEqual([butterfly.cost for butterfly in debit_butterflies],
+                         [butterfly.cost for butterfly in butterflies if butterfly.cost > 0])
+
+    def test_parallel_spread_scan(self):
+        # Test the parallel scan finds the same spreads, in the same order, as the get*Spreads functions
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18)
+        scans = [('butterfly', (2,)), ('condor', (2, 2)), ('ratio', (4,)), ('straddle', ())]
+        expected_spreads = (getButterflySpreads(may_options, 2) + getCondorSpreads(may_options, 2, 2) +
+                            getRatioSpreads(may_options, 4) + getStraddleSpreads(may_options))
+
+        # Split into parts of at most 4 of the 6 strikes (each part only finds the candidates of its strikes)
+        scan_parts = partition_scans(may_options, scans, 4)
+        self.assertEqual(scan_parts[:4], [(0, 'butterfly', (2,), 0, 4), (0, 'butterfly', (2,), 4, 6),
+                                          (1, 'condor', (2, 2), 0, 4), (1, 'condor', (2, 2), 4, 6)])
+        self.assertEqual([spread.cost for spread in getButterflySpreads(may_options, 2)[:16]],
+                         [candidate.build().cost for candidate in iterButterflyCandidates(may_options, 2,
+                                                                                          strike_range=(0, 4))])
+
+        spreads = scan_spreads_parallel(may_options, scans, max_workers=1, part_size=1)
+        self.assertEqual([spread.cost for spread in spreads], [spread.cost for spread in expected_spreads])
+
+        costs = scan_spreads_parallel(may_options, scans, is_debit_candidate, operator.attrgetter('cost'),
+                                      max_workers=2, part_size=2)
+        self.assertEqual(costs, [spread.cost for spread in expected_spreads if spread.cost > 0])
+
+        with self.assertRaises(ValueError):
+            scan_spreads_parallel(may_options, [('calendar', ())], max_workers=1)
+
+    def test_top_spread_ranking(self):
+        # Test the top K spreads by a metric are the best of every spread, found without building every spread
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18)
+        scans = [('butterfly', (2,)), ('condor', (2, 2)), ('iron_condor', (2, 2)), ('strangle', (2,))]
+        spreads = (getButterflySpreads(may_options, 2) + getCondorSpreads(may_options, 2, 2) +
+                   getIronCondorSpreads(may_options, 2, 2) + getStrangleSpreads(may_options, 2))
+
+        # Reward / risk of the spreads with a limited loss
+        reward_risks = []
+        for spread in spreads:
+            max_profit, max_loss, _, _ = spread.exact_metrics()
+            if max_loss > -np.inf:
+                reward_risks.append(max_profit / -max_loss)
+        top_spreads = rank_spreads(may_options, scans, 'reward_risk', top_k=3)
+        self.assertEqual([score for score, _ in top_spreads], sorted(reward_risks, reverse=True)[:3])
+        # Long strangles have an unlimited profit and a limited loss
+        self.assertEqual(top_spreads[0][0], np.inf)
+        self.assertEqual(top_spreads[0][1].name, 'Strangle')
+
+        # Cost per theta of the spreads earning theta
+        costs_per_theta = sorted((-spread.cost / spread.greeks.theta for spread in spreads
+                                  if spread.greeks.theta > 0), reverse=True)
+        top_spreads = rank_spreads(may_options, scans, 'cost_per_theta', top_k=4)
+        self.assertEqual([score for score, _ in top_spreads], costs_per_theta[:4])
+
+        # The same ranking from a process pool
+        self.assertEqual([spread.cost for _, spread in rank_spreads(may_options, scans, 'max_loss', 5, max_workers=2,
+                                                                      part_size=2)],
+                         [spread.cost for _, spread in rank_spreads(may_options, scans, 'max_loss', 5)])
+
+        # Candidates with a bound below the top K are skipped before finding their metrics
+        scored_candidates = []
+        max_loss_metric = RANKING_METRICS['max_loss']
+        counting_metric = RankingMetric('max_loss', lambda candidate, max_profit, max_loss: scored_candidates.append(
+            candidate) or max_loss, max_loss_metric.bound)
+        top_candidates = rank_candidates(iter_numbered_candidates(may_options, scans), counting_metric, 2,
+                                         batch_size=4)
+        self.assertEqual([score for score, _, _ in top_candidates],
+                         [score for score, _ in rank_spreads(may_options, scans, 'max_loss', 2)])
+        self.assertLess(len(scored_candidates), len(spreads))
+
+        # Bounds are rounded like the metrics: a butterfly losing at most 0.004 (a max loss of 0 once rounded) has an
+        # infinite reward / risk, so it is not skipped behind a $25 butterfly scoring 2499
+        butterfly_calls = pd.DataFrame({'Exercise Price': [21, 46, 48, 50, 71],
+                                        'Price': [5.996, 3, 2.002, 1.008, 0.01],
+                                        'Implied Volatility': [20, 20, 20, 20, 20]})
+        butterfly_options = option_data(butterfly_calls, None, 'May 15', 48.40, 0.1534, 0.0, 18)
+        call_21, call_46, call_48, call_50, call_71 = butterfly_options.options_calls
+        butterfly_trades = ['Bought', 'Sold', 'Sold', 'Bought']
+        wide_butterfly = SpreadCandidate(Butterfly, [call_21, call_46, call_46, call_71], butterfly_trades, (25,),
+                                         ('May 15',))
+        narrow_butterfly = SpreadCandidate(Butterfly, [call_46, call_48, call_48, call_50], butterfly_trades, (2,),
+                                           ('May 15',))
+        top_candidates = rank_candidates(enumerate([wide_butterfly, narrow_butterfly]), 'reward_risk', 1,
+                                         batch_size=1)
+        self.assertEqual([(score, number) for score, number, _ in top_candidates], [(np.inf, 1)])
+        self.assertEqual(rank_candidates([(0, wide_butterfly)], 'reward_risk', 1)[0][0], 2499)
+
+        with self.assertRaises(ValueError):
+            rank_spreads(may_options, scans, 'delta')
+
+    def test_spread_constraints(self):
+        # Test spread constraints keep the same spreads as screening the built spreads
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18)
+        condors = getCondorSpreads(may_options, 2, 2)
+
+        constraints = SpreadConstraints(cost_range=(None, 0.5), delta_range=(-0.1, 0.1))
+        self.assertEqual([condor.cost for condor in getCondorSpreads(may_options, 2, 2, constraints)],
+                         [condor.cost for condor in condors
+                          if condor.cost <= 0.5 and -0.1 <= condor.greeks.delta <= 0.1])
+
+        constraints = SpreadConstraints(max_loss=-1, min_max_profit=1)
+        self.assertEqual([condor.cost for condor in getCondorSpreads(may_options, 2, 2, constraints)],
+                         [condor.cost for condor in condors if condor.max_loss >= -1 and condor.max_profit >= 1])
+
+        # Strikes within one standard deviation (48.40 * 18% * sqrt(0.1534) = 3.41) of the stock price
+        strangles = getStrangleSpreads(may_options, 2, SpreadConstraints(max_strike_deviations=1))
+        self.assertEqual([(strangle.options[0].strike_price, strangle.options[1].strike_price)
+                          for strangle in strangles[::2]], [(46, 48), (48, 50)])
+        # The same window with the volatility in decimal format
+        decimal_vol_options = option_data(call_may_df, put_may_df, 'May 15', 48.40, 0.1534, 0.0, 0.18)
+        strangles = getStrangleSpreads(decimal_vol_options, 2, SpreadConstraints(max_strike_deviations=1))
+        self.assertEqual([(strangle.options[0].strike_price, strangle.options[1].strike_price)
+                          for strangle in strangles[::2]], [(46, 48), (48, 50)])
+
+        # Calendar spreads are screened on the metrics of their price range
+        july_options = option_data(pd.DataFrame(self.call_options_exp_july_15_data),
+                                   pd.DataFrame(self.put_options_exp_july_15_data), 'July 15', 48.40, 0.32, 0.0, 18)
+        calendars = getCalendarStraddle(may_options, july_options, SpreadConstraints(max_loss=-0.5))
+        self.assertEqual([(calendar.cost, calendar.max_loss) for calendar in calendars],
+                         [(calendar.cost, calendar.max_loss) for calendar in getCalendarStraddle(may_options, july_options)
+                          if calendar.max_loss >= -0.5])
+        self.assertGreater(len(calendars), 0)
+
+        # Constraints can be sent to the workers of a parallel scan
+        constraints = SpreadConstraints(cost_range=(-1, 1), vega_range=(0, None))
+        self.assertEqual(scan_spreads_parallel(may_options, [('butterfly', (2,)), ('strangle', (2,))], constraints,
+                                               operator.attrgetter('cost'), max_workers=2, part_size=1),
+                         [spread.cost for spread in getButterflySpreads(may_options, 2) +
+                          getStrangleSpreads(may_options, 2) if -1 <= spread.cost <= 1 and spread.greeks.vega >= 0])
+
+    def test_quote_updates(self):
+        # Test a quote change only updates the quoted options and refreshes the spreads using them
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18)
+        spread_book = SpreadBook(getButterflySpreads(may_options, 2))
+        self.assertEqual(len(spread_book), 16)
+
+        untouched_revision = may_options.options_puts[1].revision
+        refreshed_spreads = spread_book.update_quotes(may_options, 'put', pd.DataFrame(
+            {'Exercise Price': [44], 'Price': [0.3], 'Delta': [-0.1]}))
+
+        # Only the 44/46/48 put butterflies (long and short) use the 44 put
+        self.assertEqual(len(refreshed_spreads), 2)
+        self.assertEqual(may_options.options_puts[0].curr_cost, 0.3)
+        self.assertEqual(may_options.options_puts[0].greeks.get_greeks()[:4], (-0.1, 0.045, -0.0046, 0.029))
+        self.assertEqual(may_options.options_puts[1].revision, untouched_revision)
+
+        # Refreshed spreads match spreads found from the new quotes
+        put_may_df.loc[0, ['Price', 'Delta']] = [0.3, -0.1]
+        updated_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                      0.1534, 0.0, 18)
+        for spread, updated_spread in zip(spread_book.spreads, getButterflySpreads(updated_options, 2)):
+            self.assertEqual((spread.cost, spread.max_profit, spread.max_loss, spread.greeks.get_greeks()),
+                             (updated_spread.cost, updated_spread.max_profit, updated_spread.max_loss,
+                              updated_spread.greeks.get_greeks()))
+
+        with self.assertRaises(ValueError):
+            may_options.update_quotes('put', pd.DataFrame({'Exercise Price': [45], 'Price': [0.3]}))
+
+        # Columnar chains update the quoted values of their columns
+        may_chain = OptionChain(call_may_df, put_may_df, 'May 15', 48.40,
+                                0.1534, 0.0, 18)
+        self.assertEqual(may_chain.update_quotes('call', pd.DataFrame({'Exercise Price': [48], 'Price': [1.8]})), [])
+        self.assertEqual(may_chain.costs[:6].tolist(), [4.59, 2.99, 1.8, 0.93, 0.47, 0.23])
+        self.assertEqual(may_chain.options_calls[2].curr_cost, 1.8)
+
     def test_generating_straddles(self):
         # Put the options data into df
         call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
@@ -296,17 +784,17 @@ class FindingSpreadsTest(unittest.TestCase):
 
         straddleTestOne = straddleSpreads[1]
         self.assertEqual(straddleTestOne.cost, -4.79)
-        self.assertEqual(straddleTestOne.greeks.get_greeks(), greeks(-0.84, -0.09, 0.0092, -0.058, 0.01).get_greeks())
+        self.assertEqual(straddleTestOne.greeks.get_greeks(), greeks(-0.84, -0.09, 0.0092, -0.058, -0.0514).get_greeks())
         # print('Print straddle one')
         # print(straddleTestOne.print_straddle())4
 
         straddleTestTwo = straddleSpreads[4]
         self.assertEqual(straddleTestTwo.cost, 3.1)
-        self.assertEqual(straddleTestTwo.greeks.get_greeks(), greeks(0.12, 0.232, -0.0242, 0.15, 0.01).get_greeks())
+        self.assertEqual(straddleTestTwo.greeks.get_greeks(), greeks(0.12, 0.232, -0.0242, 0.15, 0.0037).get_greeks())
 
         straddleTestThree = straddleSpreads[7]
         self.assertEqual(straddleTestThree.cost, -3.46)
-        self.assertEqual(straddleTestThree.greeks.get_greeks(), greeks(0.34, -0.214, 0.0222, -0.138, 0.01).get_greeks())
+        self.assertEqual(straddleTestThree.greeks.get_greeks(), greeks(0.34, -0.214, 0.0222, -0.138, 0.026).get_greeks())
 
     def test_generating_strangles(self):
         # Put the options data into df
@@ -617,6 +1105,191 @@ class FindingSpreadsTest(unittest.TestCase):
         self.assertEqual(testCalendarSpreadTwo.cost, -0.5)
 
 
+class VolatilitySurfaceTest(unittest.TestCase):
+    def setUp(self):
+        strikes = [40, 45, 50, 55, 60]
+        call_df = pd.DataFrame({'Exercise Price': strikes, 'Price': [10.1, 5.6, 2.2, 0.6, 0.1],
+                                'Implied Volatility': [30, 26, 20, 22, 25]})
+        put_df = pd.DataFrame({'Exercise Price': strikes, 'Price': [0.1, 0.6, 2.2, 5.6, 10.1],
+                               'Implied Volatility': [26, 23, 21, 24, 28]})
+        far_df = pd.DataFrame({'Exercise Price': strikes, 'Price': [11.0, 7.0, 4.0, 2.0, 1.0],
+                               'Implied Volatility': [30, 30, 30, 30, 30]})
+
+        self.near_options = option_data(call_df, put_df, 'May 15', 50, 0.25, 0.0, 18)
+        self.far_options = OptionChain(far_df, far_df, 'Feb 15', 50, 1.0, 0.0, 18)
+        self.surface = VolatilitySurface([self.far_options, self.near_options])
+
+    def test_volatility_smile(self):
+        # Test the smile uses the out of the money options (puts below the stock price, calls above)
+        self.assertEqual(self.surface.expiration_dates, ['May 15', 'Feb 15'])
+        self.assertEqual(self.surface.get_volatility([40, 45, 50, 55, 60], 0.25).tolist(), [26, 23, 20, 22, 25])
+        # Interpolated in total variance
+        self.assertAlmostEqual(self.surface.get_volatility(52.5, 0.25), np.sqrt((20 ** 2 + 22 ** 2) / 2))
+        # Flat outside the strikes
+        self.assertAlmostEqual(self.surface.get_volatility(70, 0.25), 25)
+
+    def test_volatility_term_structure(self):
+        # Test vols between expirations are interpolated in total variance (constant vol outside them)
+        expected_volatility = np.sqrt((0.04 * 0.25 + (0.25 / 0.75) * (0.09 - 0.04 * 0.25)) / 0.5) * 100
+        self.assertAlmostEqual(self.surface.get_volatility(50, 0.5), expected_volatility)
+        self.assertEqual(self.surface.get_volatility([50, 50], [0.1, 2]).tolist(), [20, 30])
+
+    def test_volatility_cache(self):
+        # Test asking for the vols of the same strikes and times again uses the cache
+        strikes = np.linspace(40, 60, 81)
+        first_volatilities = self.surface.get_volatility(strikes, 0.5)
+        self.assertIs(self.surface.get_volatility(strikes, 0.5), first_volatilities)
+        self.assertEqual(self.surface.volatility_cache.cache_info()['hits'], 1)
+
+    def test_apply_surface_to_options_data(self):
+        # Test options are priced with the vol of their strike, and calendar spreads can be found with them
+        user_volatility = self.near_options.options_puts[0].current_volatility
+        price_range = self.near_options.options_puts[0].price_range
+        self.surface.apply_to_options_data(self.near_options)
+        self.assertEqual([op.model_volatility for op in self.near_options.options_puts], [26, 23, 20, 22, 25])
+        self.assertEqual(self.near_options.options_puts[0].theoretical_price,
+                         black_scholes_model_option_price(50, 40, 0.25, 0.0, 26, 'put'))
+
+        # The users vol (and the price range shared by the options of the expiration) is unchanged
+        self.assertEqual([op.current_volatility for op in self.near_options.options_puts], [user_volatility] * 5)
+        self.assertIs(self.near_options.options_puts[0].price_range, price_range)
+        self.assertIs(self.near_options.options_puts[4].price_range, price_range)
+
+        # A chain only has its columns updated (no option objects are created), and its options read them
+        self.surface.apply_to_options_data(self.far_options)
+        self.assertIsNone(self.far_options._options_calls)
+        self.assertEqual(self.far_options.model_volatilities.tolist(), [30] * 10)
+        far_prices = self.far_options.theoretical_prices.tolist()
+        self.assertEqual(far_prices[2], black_scholes_model_option_price(50, 50, 1.0, 0.0, 30, 'call'))
+        self.assertEqual([op.theoretical_price for op in self.far_options.options_calls], far_prices[:5])
+        self.assertEqual(self.far_options.options_calls[2].model_volatility, 30)
+        self.assertEqual(self.far_options.options_calls[2].current_volatility, 18)
+
+        # Options already created are updated from the columns
+        self.far_options.model_volatilities[:] = np.nan
+        self.far_options.sync_options()
+        self.assertIsNone(self.far_options.options_calls[2].model_volatility)
+        self.surface.apply_to_options_data(self.far_options)
+        self.assertEqual(self.far_options.options_calls[2].model_volatility, 30)
+        self.assertEqual(self.far_options.options_calls[2].get_pricing_volatility(), 30)
+        self.assertEqual(len(getCalendarStraddle(self.near_options, self.far_options)), 20)
+
+
+class ChainProvidersTest(unittest.TestCase):
+    def setUp(self):
+        calls = pd.DataFrame({'Exercise Price': [44, 46, 48, 50], 'Price': [4.59, 2.99, 1.75, 0.93],
+                              'Implied Volatility': [19.83, 20.25, 20.48, 20.88]})
+        puts = pd.DataFrame({'Exercise Price': [44, 46, 48, 50], 'Price': [0.20, 0.58, 1.35, 2.53],
+                             'Implied Volatility': [20.12, 20.09, 20.48, 20.88]})
+        self.provider = FixtureChainProvider({'XYZ': {'May 15, 2026': (calls, puts), 'July 17, 2026': (calls, puts)}},
+                                             {'XYZ': 48.40})
+
+    def test_normalize_options_data(self):
+        # Test market data columns are put in the option_data format (sorted, numbers, nan when missing)
+        market_data = pd.DataFrame({'Contract Name': ['XYZ50C', 'XYZ45C'], 'Strike': [50.0, 45.0],
+                                    'Last Price': [1.2, '-'], 'Implied Volatility': ['25.39%', '31.00%']})
+        options_data = normalize_options_data(market_data, {'Strike': 'Exercise Price', 'Last Price': 'Price'})
+
+        self.assertEqual(list(options_data.columns), ['Exercise Price', 'Price', 'Implied Volatility'])
+        self.assertEqual(options_data['Exercise Price'].tolist(), [45, 50])
+        self.assertTrue(np.isnan(options_data.loc[0, 'Price']))
+        self.assertEqual(options_data['Implied Volatility'].tolist(), [31, 25.39])
+
+    def test_fixture_provider(self):
+        # Test the fixture provider gives option_data ready chains, and saves / loads fixture directories
+        self.assertEqual(self.provider.get_expiration_dates('XYZ'), ['May 15, 2026', 'July 17, 2026'])
+        may_options = self.provider.get_option_data('XYZ', 'May 15, 2026', 0.0, 18, annual_time_to_exp=0.1534)
+        self.assertEqual([op.strike_price for op in may_options.options_puts], [44, 46, 48, 50])
+        self.assertEqual(may_options.current_stock_price, 48.40)
+
+        with tempfile.TemporaryDirectory() as fixture_directory:
+            FixtureChainProvider.save_fixtures(self.provider, ['XYZ'], fixture_directory)
+            loaded_provider = FixtureChainProvider.from_directory(fixture_directory)
+            self.assertEqual(loaded_provider.get_all_chains('XYZ').keys(), self.provider.get_all_chains('XYZ').keys())
+            pd.testing.assert_frame_equal(loaded_provider.get_chain('XYZ', 'July 17, 2026')[1],
+                                          self.provider.get_chain('XYZ', 'July 17, 2026')[1], check_dtype=False)
+
+        with self.assertRaises(KeyError):
+            self.provider.get_chain('ABC', 'May 15, 2026')
+
+        self.assertAlmostEqual(get_annual_time_to_expiration('May 15, 2026', as_of='March 16, 2026'), 60 / 365)
+
+        # Providers must implement the whole interface
+        class StockPriceProvider(ChainProvider):
+            def get_stock_price(self, ticker):
+                return 48.40
+
+        with self.assertRaises(TypeError):
+            StockPriceProvider()
+
+    def test_cached_provider(self):
+        # Test cached chains are not fetched again until they are older than their time to live
+        fetches = []
+        provider = self.provider
+
+        class CountingProvider(FixtureChainProvider):
+            def get_chain(self, ticker, expiration_date):
+                fetches.append(expiration_date)
+                return provider.get_chain(ticker, expiration_date)
+
+        with tempfile.TemporaryDirectory() as cache_directory:
+            cached_provider = CachedChainProvider(CountingProvider(provider.chains, provider.stock_prices),
+                                                  cache_directory, chain_ttl=None)
+            first_chains = cached_provider.get_all_chains('XYZ')
+            second_chains = cached_provider.get_all_chains('XYZ')
+            self.assertEqual(fetches, ['May 15, 2026', 'July 17, 2026'])
+            pd.testing.assert_frame_equal(first_chains['May 15, 2026'][0], second_chains['May 15, 2026'][0])
+
+            # Expired values are fetched again
+            cached_provider.chain_ttl = 0
+            cached_provider.get_chain('XYZ', 'May 15, 2026')
+            self.assertEqual(len(fetches), 3)
+            self.assertEqual(cached_provider.get_stock_price('XYZ'), 48.40)
+
+    def test_async_chain_loader(self):
+        # Test chains of many tickers are loaded concurrently and failed provider calls are retried
+        failures = []
+        concurrent_calls = [0, 0]
+        lock = threading.Lock()
+        provider = self.provider
+
+        class FlakyProvider(FixtureChainProvider):
+            def get_chain(self, ticker, expiration_date):
+                with lock:
+                    concurrent_calls[0] += 1
+                    concurrent_calls[1] = max(concurrent_calls)
+                try:
+                    if (ticker, expiration_date) not in failures:
+                        failures.append((ticker, expiration_date))
+                        raise ConnectionError('Connection reset')
+                    return provider.get_chain('XYZ', expiration_date)
+                finally:
+                    with lock:
+                        concurrent_calls[0] -= 1
+
+        flaky_provider = FlakyProvider({ticker: provider.chains['XYZ'] for ticker in ('XYZ', 'ABC', 'DEF')},
+                                       {'XYZ': 48.40, 'ABC': 48.40, 'DEF': 48.40})
+        option_chains = load_all_option_data(flaky_provider, ['XYZ', 'ABC', 'DEF'], 0.0, 18, max_concurrency=2,
+                                             retry_backoff=0.01, as_of='March 16, 2026')
+
+        self.assertEqual(len(failures), 6)
+        self.assertLessEqual(concurrent_calls[1], 2)
+        self.assertEqual([ops_data.expiration_date for ops_data in option_chains['ABC']],
+                         ['May 15, 2026', 'July 17, 2026'])
+        self.assertAlmostEqual(option_chains['DEF'][0].annual_time_to_expiration, 60 / 365)
+
+        # Errors are raised once the retries run out
+        async def load_missing_ticker():
+            loader = AsyncChainLoader(self.provider, max_retries=1, retry_backoff=0)
+            try:
+                return [loaded_chain async for loaded_chain in loader.load(['XYZ', 'ABC'], 0.0, 18)]
+            finally:
+                loader.close()
+
+        with self.assertRaises(KeyError):
+            asyncio.run(load_missing_ticker())
+
+
 class RiskProfileTest(unittest.TestCase):
 
     def setUp(self):
@@ -682,6 +1355,176 @@ class RiskProfileTest(unittest.TestCase):
                                            curr_stock_price=100, annual_time_to_exp=0.1643, curr_int_rate=0.05,
                                            curr_volatility=19, trade='Sold')
 
+    def test_lazy_risk_profile(self):
+        # Test the risk profile is only found when used and is found again once invalidated
+        test_option = option(option_type='call', strike_price=105, cost=4, implied_volatility=18,
+                             curr_greeks=greeks(0.1, 0.1, 0.1, 0.1, 0.1),
+                             curr_stock_price=100, annual_time_to_exp=0.1643, curr_int_rate=0.05,
+                             curr_volatility=19, trade='Bought')
+        self.assertIsNone(test_option._payoff_profile)
+        self.assertEqual(test_option.max_loss, -4)
+        self.assertIsNotNone(test_option._payoff_profile)
+
+        # Setting an input clears the risk profile
+        test_option.curr_cost = 3
+        self.assertIsNone(test_option._payoff_profile)
+        self.assertEqual(test_option.max_loss, -3)
+
+        test_option.strike_price = 100
+        self.assertEqual(test_option.break_even_points, [103.0])
+        range_width = test_option.price_range[-1] - test_option.price_range[0]
+        test_option.current_volatility = 38
+        self.assertGreater(test_option.price_range[-1] - test_option.price_range[0], range_width)
+
+        # Updating the time to expiration revalues the option with the time left
+        price_range = test_option.price_range
+        test_option.update_time_to_expiration(0.1, price_range)
+        self.assertIs(test_option.price_range, price_range)
+        self.assertGreater(test_option.max_loss, -3)
+
+    def test_option_payoff_profile(self):
+        # Test the payoff profiles of bought and sold options at expiration
+        price_range = np.array([95, 105, 107.5, 115])
+        np.testing.assert_array_equal(self.test_option_Bought.calculate_payoff_profile(price_range, False),
+                                      [-4, -4, -1.5, 6])
+        np.testing.assert_array_equal(self.test_option_Sold.calculate_payoff_profile(price_range, False),
+                                      [4, 4, 1.5, -6])
+        np.testing.assert_array_equal(self.test_option_Bought_put.calculate_payoff_profile(price_range, False),
+                                      [6, -4, -4, -4])
+        np.testing.assert_array_equal(self.test_option_Sold_put.calculate_payoff_profile(price_range, False),
+                                      [-6, 4, 4, 4])
+
+        # Calendar options are closed out at their theoretical value
+        calendar_payoff = self.test_option_Bought.calculate_payoff_profile(price_range, True)
+        self.assertEqual(calendar_payoff[1], round(black_scholes_model_option_price(105, 105, 0.1643, 0.05, 19,
+                                                                                    'call') - 4, 2))
+        self.assertEqual(self.test_option_Bought_put.break_even_points, [101.0])
+
+    def test_calendar_payoff_profile(self):
+        # Test the calendar payoff profile (priced over the whole range at once) matches pricing each price
+        price_range = self.test_option_Sold_put.price_range
+        self.test_option_Sold_put.update_time_to_expiration(0.1, price_range)
+
+        expected_payoff = [round(-(-4 + black_scholes_model_option_price(price, 105, 0.1, 0.05, 19, 'put')), 2)
+                           for price in price_range]
+        np.testing.assert_array_equal(self.test_option_Sold_put.payoff_profile, expected_payoff)
+
+    def test_price_grid_policies(self):
+        # Test the price range resolution of options and spreads can be set by a grid policy
+        default_range = self.test_option_Bought.price_range
+        self.assertEqual(len(default_range), 1757)
+
+        self.test_option_Bought.grid_policy = PriceGridPolicy('fixed', num_points=50)
+        self.test_option_Bought.invalidate_risk_profile()
+        self.assertEqual(len(self.test_option_Bought.price_range), 50)
+        self.assertEqual((self.test_option_Bought.price_range[0], self.test_option_Bought.price_range[-1]),
+                         (default_range[0], default_range[-1]))
+
+        self.test_option_Bought.grid_policy = PriceGridPolicy('step', step=0.05)
+        self.test_option_Bought.invalidate_risk_profile()
+        self.assertEqual(len(self.test_option_Bought.price_range), 351)
+
+        # Adaptive grids are dense (every cent) near the strike and break even point only
+        adaptive_option = option(option_type='put', strike_price=105, cost=4, implied_volatility=18,
+                                 curr_greeks=greeks(0.1, 0.1, 0.1, 0.1, 0.1), curr_stock_price=100,
+                                 annual_time_to_exp=0.1643, curr_int_rate=0.05, curr_volatility=19, trade='Bought',
+                                 grid_policy=PriceGridPolicy('adaptive', num_points=20, focus_width=0.1))
+        self.assertEqual(len(adaptive_option.price_range), 61)
+        self.assertIn(101.0, adaptive_option.price_range.tolist())
+        self.assertEqual(adaptive_option.break_even_points, [101.0])
+        self.assertEqual(adaptive_option.max_loss, -4)
+
+        # Spreads on an adaptive grid keep the metrics of the full grid with far fewer prices
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18, grid_policy=PriceGridPolicy('adaptive'))
+
+        condorTestOne = getCondorSpreads(may_options, 2, 2)[4]
+        self.assertLess(len(condorTestOne.price_range), 400)
+        self.assertEqual(condorTestOne.max_profit, 1.22)
+        self.assertEqual(condorTestOne.max_loss, -0.78)
+        self.assertEqual(condorTestOne.break_even_points, [46.78, 51.22])
+
+        with self.assertRaises(ValueError):
+            PriceGridPolicy('log')
+
+    def test_shared_price_ranges(self):
+        # Test options and spreads of an expiration share one read only price range
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18)
+
+        price_range = may_options.options_calls[0].price_range
+        for op in may_options.options_calls + may_options.options_puts:
+            self.assertIs(op.price_range, price_range)
+
+        butterfly = getButterflySpreads(may_options, 2)[0]
+        self.assertIs(butterfly.price_range, price_range)
+        self.assertEqual(np.vstack([op.payoff_profile for op in butterfly.options]).shape, (4, len(price_range)))
+
+        with self.assertRaises(ValueError):
+            price_range[0] = 0
+
+        # Different inputs get their own price range
+        price_range_cache.clear()
+        self.assertIsNot(self.test_option_Bought.price_range, may_options.options_calls[0].price_range)
+        self.assertIs(self.test_option_Bought.price_range, self.test_option_Sold_put.price_range)
+        cache_info = price_range_cache.cache_info()
+        self.assertEqual((cache_info['hits'], cache_info['misses']), (1, 1))
+
+    def test_compact_option_objects(self):
+        # Test options and greeks are slot based (no per object dict) with the same attributes
+        self.assertFalse(hasattr(self.test_option_Bought, '__dict__'))
+        self.assertFalse(hasattr(self.test_option_Bought.greeks, '__dict__'))
+        self.assertEqual(self.test_option_Bought.greeks.get_greeks(), (0.1, 0.1, 0.1, 0.1, 0.1))
+
+        with self.assertRaises(AttributeError):
+            self.test_option_Bought.expiration_date = 'May 15'
+
+    def test_option_trades_share_contract(self):
+        # Test trades reference the contract: bought trades view its arrays (read only), sold trades flip the sign
+        contract = option(option_type='call', strike_price=50, cost=2, implied_volatility=18,
+                          curr_greeks=greeks(0.5, 0.1, -0.02, 0.05, 0.01), curr_stock_price=50,
+                          annual_time_to_exp=0.25, curr_int_rate=0.05, curr_volatility=18, trade=None)
+        bought = contract.create_option_trade('Bought')
+        sold = contract.create_option_trade('Sold')
+
+        self.assertTrue(np.shares_memory(bought.payoff_profile, contract.payoff_profile))
+        self.assertEqual(bought.greeks.get_greeks(), contract.greeks.get_greeks())
+        self.assertIs(sold.price_range, contract.price_range)
+        self.assertEqual((bought.curr_cost, sold.curr_cost), (2, -2))
+        np.testing.assert_array_equal(sold.payoff_profile, -contract.payoff_profile)
+        self.assertEqual(sold.greeks.get_greeks(), (-0.5, -0.1, 0.02, -0.05, -0.01))
+        self.assertEqual((sold.max_profit, sold.max_loss), (-bought.max_loss, -bought.max_profit))
+
+        # Editing a trade in place does not change the contract or the other trades of it
+        other_bought = contract.create_option_trade('Bought')
+        for trade in (bought, sold):
+            with self.assertRaises(ValueError):
+                trade.payoff_profile[0] = 100
+            with self.assertRaises(ValueError):
+                trade.payoff_profile *= 2
+        bought.greeks.update_greeks(1, 1, 1, 1, 1)
+        self.assertEqual(contract.greeks.get_greeks(), (0.5, 0.1, -0.02, 0.05, 0.01))
+        self.assertEqual(other_bought.greeks.get_greeks(), (0.5, 0.1, -0.02, 0.05, 0.01))
+        np.testing.assert_array_equal(other_bought.payoff_profile, contract.payoff_profile)
+
+        # Quantities scale the trade, and new greeks on the contract reach the trade
+        self.assertEqual(contract.create_option_trade('Sold', 2).curr_cost, -4)
+        contract.greeks.update_greeks(0.6, 0.1, -0.02, 0.05, 0.01)
+        contract.mark_updated()
+        self.assertEqual(sold.greeks.delta, -0.6)
+
+        # Calendar updates only change the trade
+        sold.update_time_to_expiration(0.1, contract.price_range)
+        self.assertEqual((sold.annual_time_to_expiration, contract.annual_time_to_expiration), (0.1, 0.25))
+        self.assertFalse(contract.is_calendar)
+        expected_payoff = [round(-(-2 + black_scholes_model_option_price(price, 50, 0.1, 0.05, 18, 'call')), 2)
+                           for price in contract.price_range]
+        np.testing.assert_array_almost_equal(sold.payoff_profile, expected_payoff)
+
     def test_generating_risk_profile_spread_straddle(self):
         # Put the options data into df
         call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
@@ -812,19 +1655,74 @@ class RiskProfileTest(unittest.TestCase):
         RatioSpreads_range6 = getRatioSpreads(may_options, 6)
 
         # Test spread RatioSpreads_range2[0]
+        # Each leg is weighted by its ratio: -39 44 calls & +46 46 calls
         ratioSpreadTestOne = RatioSpreads_range2[0]
-        self.assertEqual(ratioSpreadTestOne.max_profit, 63.02)
-        self.assertEqual(ratioSpreadTestOne.max_loss, -18.4)
+        self.assertEqual(ratioSpreadTestOne.cost, -41.47)
+        self.assertEqual(ratioSpreadTestOne.max_profit, 32.5)
+        self.assertEqual(ratioSpreadTestOne.max_loss, -36.53)
 
         # Test spread RatioSpreads_range4[3]
         ratioSpreadTestTwo = RatioSpreads_range4[3]
-        self.assertEqual(ratioSpreadTestTwo.max_profit, 2.3)
-        self.assertEqual(ratioSpreadTestTwo.max_loss, -5.24)
+        self.assertEqual(ratioSpreadTestTwo.max_profit, 0.5)
+        self.assertEqual(ratioSpreadTestTwo.max_loss, -7.04)
 
         # Test spread RatioSpreads_range6[6]
         ratioSpreadTestThree = RatioSpreads_range6[6]
-        self.assertEqual(ratioSpreadTestThree.max_profit, 27.72)
-        self.assertEqual(ratioSpreadTestThree.max_loss, -38.28)
+        self.assertEqual(ratioSpreadTestThree.max_profit, 45.7)
+        self.assertEqual(ratioSpreadTestThree.max_loss, -20.3)
+
+    def test_exact_spread_metrics(self):
+        # Test the exact expiry metrics of spreads (from their legs, without a price range)
+        call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
+        put_may_df = pd.DataFrame(self.put_options_exp_may_15_data)
+
+        may_options = option_data(call_may_df, put_may_df, 'May 15', 48.40,
+                                  0.1534, 0.0, 18)
+
+        # Bounded spreads match the metrics of the price range, and find the break even points it misses
+        for butterfly in getButterflySpreads(may_options, 2) + getCondorSpreads(may_options, 2, 2):
+            max_profit, max_loss, break_even_points, slopes = butterfly.exact_metrics()
+            self.assertEqual((max_profit, max_loss), (butterfly.max_profit, butterfly.max_loss))
+            self.assertTrue(set(butterfly.break_even_points) <= set(break_even_points))
+            self.assertEqual(slopes[-1], 0)
+
+        # The price range ends at 52.57, before the upper break even point
+        butterfly = getButterflySpreads(may_options, 2)[12]
+        self.assertEqual(butterfly.break_even_points, [50.22])
+        self.assertEqual(butterfly.exact_metrics()[2], [50.22, 53.78])
+
+        # Unbounded sides: the ratio spread loses without limit as the stock rises (sold more calls than bought)
+        ratio_spread = getRatioSpreads(may_options, 2)[1]
+        max_profit, max_loss, break_even_points, slopes = ratio_spread.exact_metrics()
+        self.assertEqual(max_loss, -np.inf)
+        self.assertEqual(max_profit, ratio_spread.max_profit)
+        self.assertLess(slopes[-1], 0)
+        self.assertEqual(break_even_points, [45.06, 51.22])
+
+        # Long call: unlimited profit, losing the cost below the strike
+        self.assertEqual(expiry_payoff_metrics([105], [1], [True], 4), (np.inf, -4, [109], [0, 1]))
+        # Short put: keeps the credit above the strike
+        self.assertEqual(expiry_payoff_metrics([105], [-1], ['put'], -4), (4, -101, [101], [1, 0]))
+
+        # Break even points between the prices of a price range are exact (grid prices are every cent)
+        max_profit, max_loss, break_even_points, slopes = expiry_payoff_metrics([45, 50, 55], [1, -2, 1],
+                                                                                [True, True, True], 1.004)
+        self.assertAlmostEqual(max_profit, 3.996)
+        self.assertAlmostEqual(max_loss, -1.004)
+        np.testing.assert_allclose(break_even_points, [46.004, 53.996])
+
+        # Many spreads at once, break even points padded with nan
+        max_profits, max_losses, break_even_points, slopes = expiry_payoff_metrics_batch(
+            [[45, 50, 55], [50, 50, 50]], [[1, -2, 1], [1, 0, 0]], True, [1, 2])
+        np.testing.assert_array_equal(max_profits, [4, np.inf])
+        np.testing.assert_array_equal(max_losses, [-1, -2])
+        np.testing.assert_array_equal(break_even_points[1], [52, np.nan, np.nan, np.nan, np.nan])
+
+        # Calendar spreads are not piecewise linear at expiration
+        july_options = option_data(pd.DataFrame(self.call_options_exp_july_15_data),
+                                   pd.DataFrame(self.put_options_exp_july_15_data), 'July 15', 48.40, 0.32, 0.0, 18)
+        with self.assertRaises(ValueError):
+            getCalendarStraddle(may_options, july_options)[0].exact_metrics()
 
     def test_generating_risk_profile_spread_christmas_tree(self):
         # Put the options data into df
@@ -839,13 +1737,13 @@ class RiskProfileTest(unittest.TestCase):
 
         # Test spread ChristmasTreeSpreads_range2[2]
         christmasTreeSpreadTestOne = ChristmasTreeSpreads_range2[2]
-        self.assertEqual(christmasTreeSpreadTestOne.max_profit, 5.56)
-        self.assertEqual(christmasTreeSpreadTestOne.max_loss, -1.52)
+        self.assertEqual(christmasTreeSpreadTestOne.max_profit, 6.96)
+        self.assertEqual(christmasTreeSpreadTestOne.max_loss, -0.12)
 
         # Test spread ChristmasTreeSpreads_range4[3]
         christmasTreeSpreadTestTwo = ChristmasTreeSpreads_range4[3]
-        self.assertEqual(christmasTreeSpreadTestTwo.max_profit, 2.3)
-        self.assertEqual(christmasTreeSpreadTestTwo.max_loss, -5.24)
+        self.assertEqual(christmasTreeSpreadTestTwo.max_profit, 0.5)
+        self.assertEqual(christmasTreeSpreadTestTwo.max_loss, -7.04)
 
     def test_generating_risk_profile_spread_calendar(self):
         call_may_df = pd.DataFrame(self.call_options_exp_may_15_data)
@@ -1,436 +1,316 @@
 from PyOptionClasses.OptionsClass import option_data
 from PyOptionClasses.SpreadsClass import (Straddle, Strangle, Butterfly, Condor, IronCondor, RatioSpread, ChristmasTree,
-                                          CalenderSpread)
+                                          CalenderSpread, SpreadCandidate)
+import numpy as np
+
+
+# Desc: Keep the spreads with every leg found in the options data (see StrikeIndex.find_legs)
+# Input: Leg positions (one row per spread, -1 for missing legs)
+# Output: List of the rows of leg positions with all legs found
+def get_complete_legs(leg_positions):
+    return leg_positions[np.all(leg_positions >= 0, axis=1)].tolist()
+
+
+# Desc: Build the spreads of spread candidates one at a time (see SpreadCandidate), skipping the candidates the
+#       filter rejects before anything is built. Nothing is built until the spreads are used, so a scan that
+#       stops early (first match, top N) only builds the spreads it used.
+# Input: Spread candidates (i.e. iterButterflyCandidates(ops_data, 2)), filter of the candidates
+#        (candidate -> bool, None to keep every candidate)
+# Output: Generator of spreads (in the order of the candidates)
+def iterSpreads(candidates, candidate_filter=None):
+    for candidate in candidates:
+        if candidate_filter is None or candidate_filter(candidate):
+            yield candidate.build()
 
 
 # Desc: Find Straddle Spreads for a given option data set including calls and puts
 # Input Options data (option_data class format)
 # Output: A list of straddle spreads (straddle class format)
-def getStraddleSpreads(ops_data):
+def getStraddleSpreads(ops_data, candidate_filter=None):
+    return list(iterSpreads(iterStraddleCandidates(ops_data), candidate_filter))
+
+
+# Desc: Straddle spread candidates (legs of the spreads of getStraddleSpreads, in the same order)
+#       Candidates are found in order of their base strike (the strike of the first leg), and every iter*Candidates
+#       function can be limited to the base strikes start to stop (strike_range, see StrikeIndex.find_legs)
+# Input Options data (option_data class format), range of the base strikes (None for every strike)
+# Output: Generator of spread candidates
+def iterStraddleCandidates(ops_data, strike_range=None):
     call_ops = ops_data.options_calls
     put_ops = ops_data.options_puts
 
-    # Assert length and values before generating straddles
-    assert (len(call_ops) == len(put_ops))
-    assert (call_ops[0].strike_price == put_ops[0].strike_price)
+    # Find the call and put at each strike (strikes only one side has are skipped)
+    straddle_legs = ops_data.get_strike_index().find_legs(('call', 'put'), (0, 0),
+                                                                strike_range=strike_range)
 
-    straddles = []
-
-    for i in range(0, len(call_ops)):
+    for call_i, put_i in get_complete_legs(straddle_legs):
         # Get both sides long & short
-        new_call_op_long = call_ops[i].create_option_trade('Bought')
-        new_put_op_long = put_ops[i].create_option_trade('Bought')
-        new_straddle_long = Straddle(call_ops[i].strike_price, new_call_op_long, new_put_op_long,
-                                     ops_data.expiration_date)
-        straddles.append(new_straddle_long)
+        yield SpreadCandidate(Straddle, [call_ops[call_i], put_ops[put_i]], ['Bought', 'Bought'],
+                              (call_ops[call_i].strike_price,), (ops_data.expiration_date,))
+
+        yield SpreadCandidate(Straddle, [call_ops[call_i], put_ops[put_i]], ['Sold', 'Sold'],
+                              (call_ops[call_i].strike_price,), (ops_data.expiration_date,))
 
-        new_call_op_short = call_ops[i].create_option_trade('Sold')
-        new_put_op_short = put_ops[i].create_option_trade('Sold')
-        new_straddle_short = Straddle(call_ops[i].strike_price, new_call_op_short, new_put_op_short,
-                                      ops_data.expiration_date)
-        straddles.append(new_straddle_short)
 
-    return straddles
+def getStrangleSpreads(ops_data, strangle_range, candidate_filter=None):
+    return list(iterSpreads(iterStrangleCandidates(ops_data, strangle_range), candidate_filter))
 
 
-def getStrangleSpreads(ops_data, strangle_range):
+def iterStrangleCandidates(ops_data, strangle_range, strike_range=None):
 
     call_ops = ops_data.options_calls
     put_ops = ops_data.options_puts
 
-    # Assert length and values before generating straddles
-    assert (len(call_ops) == len(put_ops))
-    assert (call_ops[0].strike_price == put_ops[0].strike_price)
+    assert (strangle_range > 0)
 
-    # Assert the range is more than the dollar gap and make sure it can have the spread based on the dollar range
-    # i.e. a spread of $3 is not possible when the $ range is $2: 2, 4, 6, 8 cannot have a $3 spread
-    assert (strangle_range >= ops_data.data_spread)
-    assert (strangle_range % ops_data.data_spread == 0)
-    assert (strangle_range < ops_data.data_spread * len(ops_data.options_calls))
+    # Find the put at each strike and the call strangle range above it (on any strike ladder)
+    # Strikes without both legs are skipped i.e. a $3 strangle is not possible when the strikes are 2, 4, 6, 8
+    strangle_legs = ops_data.get_strike_index().find_legs(('put', 'call'), (0, strangle_range),
+                                                                  strike_range=strike_range)
 
-    strangles = []
-    strike_dollar_gap = ops_data.data_spread
-
-    # Get the number of possible strangles
-    # Iterate through and generate strangles
-    # To get num of strangles:
-    # length of options - range / strike dollar gap
-    option_data_gap = int(strangle_range / strike_dollar_gap)
-    num_iter = int(len(call_ops) - option_data_gap)
-
-    for i in range(0, num_iter):
+    for put_i, call_i in get_complete_legs(strangle_legs):
         # Get long side
         # Get both calls and puts
 
         # Long strangle (put/call) bought
-
-        new_put_op_long = put_ops[i].create_option_trade('Bought')
-        new_long_op_long = call_ops[i + option_data_gap].create_option_trade('Bought')
-        new_strangle_long = Strangle(strangle_range, new_put_op_long, new_long_op_long,
-                                     ops_data.expiration_date)
-
-        strangles.append(new_strangle_long)
+        yield SpreadCandidate(Strangle, [put_ops[put_i], call_ops[call_i]], ['Bought', 'Bought'],
+                              (strangle_range,), (ops_data.expiration_date,))
 
         # Short strangle (put/call) sold
+        yield SpreadCandidate(Strangle, [put_ops[put_i], call_ops[call_i]], ['Sold', 'Sold'],
+                              (strangle_range,), (ops_data.expiration_date,))
 
-        new_put_op_short = put_ops[i].create_option_trade('Sold')
-        new_long_op_short = call_ops[i + option_data_gap].create_option_trade('Sold')
-        new_strangle_short = Strangle(strangle_range, new_put_op_short, new_long_op_short,
-                                      ops_data.expiration_date)
 
-        strangles.append(new_strangle_short)
+def getButterflySpreads(ops_data, butterfly_range, candidate_filter=None):
+    return list(iterSpreads(iterButterflyCandidates(ops_data, butterfly_range), candidate_filter))
 
-    return strangles
 
-
-def getButterflySpreads(ops_data, butterfly_range):
+def iterButterflyCandidates(ops_data, butterfly_range, strike_range=None):
     call_ops = ops_data.options_calls
     put_ops = ops_data.options_puts
 
-    # Assert the range is more than the dollar gap and make sure it can have the spread based on the dollar range
-    # i.e. a spread of $3 is not possible when the $ range is $2: 2, 4, 6, 8 cannot have a $3 spread
-    assert (butterfly_range >= ops_data.data_spread)
-    assert (butterfly_range % ops_data.data_spread == 0)
-    assert (butterfly_range * 2 < ops_data.data_spread * len(ops_data.options_calls))
-
-    butterflies = []
-    strike_dollar_gap = ops_data.data_spread
-
-    # Get the number of possible butterflies
-    # Iterate through and generate call and then put butterflies
-    # To get num of butterflies:
-    # length of options - 2 * range / strike dollar gap
-    option_data_gap = int((2 * butterfly_range) / strike_dollar_gap)
-    num_iter = int(len(call_ops) - option_data_gap)
-    # Test for butterfly
-    option_data_gap = int(option_data_gap / 2)
-
-    for i in range(0, num_iter):
+    assert (butterfly_range > 0)
+
+    # Find the legs of the call and then put butterflies at each strike (on any strike ladder)
+    # Strikes without all the legs are skipped i.e. a $3 butterfly is not possible when the strikes are 2, 4, 6, 8
+    strike_offsets = (0, butterfly_range, 2 * butterfly_range)
+    strike_index = ops_data.get_strike_index()
+    call_legs = strike_index.find_legs(('call', 'call', 'call'), strike_offsets,
+                                       strike_range=strike_range).tolist()
+    put_legs = strike_index.find_legs(('put', 'put', 'put'), strike_offsets,
+                                      strike_range=strike_range).tolist()
+
+    for (call_1, call_2, call_3), (put_1, put_2, put_3) in zip(call_legs, put_legs):
+        has_calls = min(call_1, call_2, call_3) >= 0
+        has_puts = min(put_1, put_2, put_3) >= 0
+        # Inherently has 2 middle options
+        call_contracts = [call_ops[call_1], call_ops[call_2], call_ops[call_2], call_ops[call_3]] if has_calls else None
+        put_contracts = [put_ops[put_1], put_ops[put_2], put_ops[put_2], put_ops[put_3]] if has_puts else None
+
         # Get long side
         # Get both calls & puts
 
         # Butterfly long - Calls
-        new_call_op_1_long = call_ops[i].create_option_trade('Bought')
-        new_call_op_2_1_short = call_ops[i + option_data_gap].create_option_trade('Sold')
-        new_call_op_2_2_short = call_ops[i + option_data_gap].create_option_trade('Sold')
-        new_call_op_3_long = call_ops[i + (option_data_gap * 2)].create_option_trade('Bought')
-
-        new_butterfly_long_calls = Butterfly(butterfly_range, new_call_op_1_long, new_call_op_2_1_short,
-                                             new_call_op_2_2_short, new_call_op_3_long, ops_data.expiration_date)
-
-        butterflies.append(new_butterfly_long_calls)
+        if has_calls:
+            yield SpreadCandidate(Butterfly, call_contracts, ['Bought', 'Sold', 'Sold', 'Bought'],
+                                  (butterfly_range,), (ops_data.expiration_date,))
 
         # Butterfly long - Puts
-        new_put_op_1_long = put_ops[i].create_option_trade('Bought')
-        new_put_op_2_1_short = put_ops[i + option_data_gap].create_option_trade('Sold')
-        new_put_op_2_2_short = put_ops[i + option_data_gap].create_option_trade('Sold')
-        new_put_op_2_long = put_ops[i + (option_data_gap * 2)].create_option_trade('Bought')
-
-        new_butterfly_long_puts = Butterfly(butterfly_range, new_put_op_1_long, new_put_op_2_1_short,
-                                            new_put_op_2_2_short, new_put_op_2_long, ops_data.expiration_date)
-
-        butterflies.append(new_butterfly_long_puts)
+        if has_puts:
+            yield SpreadCandidate(Butterfly, put_contracts, ['Bought', 'Sold', 'Sold', 'Bought'],
+                                  (butterfly_range,), (ops_data.expiration_date,))
 
         # Butterfly short - Calls
-        new_call_op_1_short = call_ops[i].create_option_trade('Sold')
-        new_call_op_2_1_long = call_ops[i + option_data_gap].create_option_trade('Bought')
-        new_call_op_2_2_long = call_ops[i + option_data_gap].create_option_trade('Bought')
-        new_call_op_3_short = call_ops[i + (option_data_gap * 2)].create_option_trade('Sold')
-
-        new_butterfly_short_calls = Butterfly(butterfly_range, new_call_op_1_short, new_call_op_2_1_long,
-                                              new_call_op_2_2_long, new_call_op_3_short, ops_data.expiration_date)
-
-        butterflies.append(new_butterfly_short_calls)
+        if has_calls:
+            yield SpreadCandidate(Butterfly, call_contracts, ['Sold', 'Bought', 'Bought', 'Sold'],
+                                  (butterfly_range,), (ops_data.expiration_date,))
 
         # Butterfly short - Puts
-        new_put_op_1_short = put_ops[i].create_option_trade('Sold')
-        new_put_op_2_1_long = put_ops[i + option_data_gap].create_option_trade('Bought')
-        new_put_op_2_2_long = put_ops[i + option_data_gap].create_option_trade('Bought')
-        new_put_op_2_short = put_ops[i + (option_data_gap * 2)].create_option_trade('Sold')
+        if has_puts:
+            yield SpreadCandidate(Butterfly, put_contracts, ['Sold', 'Bought', 'Bought', 'Sold'],
+                                  (butterfly_range,), (ops_data.expiration_date,))
 
-        new_butterfly_short_puts = Butterfly(butterfly_range, new_put_op_1_short, new_put_op_2_1_long,
-                                             new_put_op_2_2_long, new_put_op_2_short, ops_data.expiration_date)
 
-        butterflies.append(new_butterfly_short_puts)
+def getCondorSpreads(ops_data, inner_range, outer_range, candidate_filter=None):
+    return list(iterSpreads(iterCondorCandidates(ops_data, inner_range, outer_range), candidate_filter))
 
-    return butterflies
 
-
-def getCondorSpreads(ops_data, inner_range, outer_range):
+def iterCondorCandidates(ops_data, inner_range, outer_range, strike_range=None):
     call_ops = ops_data.options_calls
     put_ops = ops_data.options_puts
 
-    total_range = inner_range + (2 * outer_range)
-
-    # Assert the range is more than the dollar gap and make sure it can have the spread based on the dollar range
-    # i.e. a spread of $3 is not possible when the $ range is $2: 2, 4, 6, 8 cannot have a $3 spread
-    assert (total_range >= ops_data.data_spread)
-    assert (total_range % ops_data.data_spread == 0)
-    assert (inner_range % ops_data.data_spread == 0)
-    assert (outer_range % ops_data.data_spread == 0)
-    assert (total_range < ops_data.data_spread * len(ops_data.options_calls))
+    assert (inner_range > 0)
+    assert (outer_range > 0)
 
-    condors = []
-    strike_dollar_gap = ops_data.data_spread
+    # Find the legs of the call and then put condors at each strike (on any strike ladder)
+    # Strikes without all the legs are skipped
+    strike_offsets = (0, outer_range, outer_range + inner_range, (2 * outer_range) + inner_range)
+    strike_index = ops_data.get_strike_index()
+    call_legs = strike_index.find_legs(('call', 'call', 'call', 'call'), strike_offsets,
+                                       strike_range=strike_range).tolist()
+    put_legs = strike_index.find_legs(('put', 'put', 'put', 'put'), strike_offsets,
+                                      strike_range=strike_range).tolist()
 
-    # Get the number of possible condors
-    # Iterate through and generate condors
-    # To get num of condors:
-    # length of options - (total_range / strike dollar gap)
-    option_data_gap = int(total_range / strike_dollar_gap)
-    num_iter = int(len(call_ops) - option_data_gap)
+    for call_positions, put_positions in zip(call_legs, put_legs):
+        has_calls = min(call_positions) >= 0
+        has_puts = min(put_positions) >= 0
+        call_contracts = [call_ops[call_i] for call_i in call_positions] if has_calls else None
+        put_contracts = [put_ops[put_i] for put_i in put_positions] if has_puts else None
 
-    option_2_gap = int(outer_range / strike_dollar_gap)
-    option_3_gap = int((outer_range + inner_range) / strike_dollar_gap)
-    option_4_gap = int(((2 * outer_range) + inner_range) / strike_dollar_gap)
-
-    for i in range(0, num_iter):
         # Get long side
         # Get both calls & puts
 
         # Condor long - Calls
-        new_call_op_1_long = call_ops[i].create_option_trade('Bought')
-        new_call_op_2_short = call_ops[i + option_2_gap].create_option_trade('Sold')
-        new_call_op_3_short = call_ops[i + option_3_gap].create_option_trade('Sold')
-        new_call_op_4_long = call_ops[i + option_4_gap].create_option_trade('Bought')
-
-        new_condor_long_calls = Condor(outer_range, inner_range, new_call_op_1_long, new_call_op_2_short,
-                                       new_call_op_3_short, new_call_op_4_long, ops_data.expiration_date)
-
-        condors.append(new_condor_long_calls)
+        if has_calls:
+            yield SpreadCandidate(Condor, call_contracts, ['Bought', 'Sold', 'Sold', 'Bought'],
+                                  (outer_range, inner_range), (ops_data.expiration_date,))
 
         # Condor long - Puts
-        new_put_op_1_long = put_ops[i].create_option_trade('Bought')
-        new_put_op_2_short = put_ops[i + option_2_gap].create_option_trade('Sold')
-        new_put_op_3_short = put_ops[i + option_3_gap].create_option_trade('Sold')
-        new_put_op_4_long = put_ops[i + option_4_gap].create_option_trade('Bought')
-
-        new_condor_long_puts = Condor(outer_range, inner_range, new_put_op_1_long, new_put_op_2_short,
-                                      new_put_op_3_short, new_put_op_4_long, ops_data.expiration_date)
-
-        condors.append(new_condor_long_puts)
+        if has_puts:
+            yield SpreadCandidate(Condor, put_contracts, ['Bought', 'Sold', 'Sold', 'Bought'],
+                                  (outer_range, inner_range), (ops_data.expiration_date,))
 
         # Condor short - Calls
-        new_call_op_1_short = call_ops[i].create_option_trade('Sold')
-        new_call_op_2_long = call_ops[i + option_2_gap].create_option_trade('Bought')
-        new_call_op_3_long = call_ops[i + option_3_gap].create_option_trade('Bought')
-        new_call_op_4_short = call_ops[i + option_4_gap].create_option_trade('Sold')
-
-        new_condor_short_calls = Condor(outer_range, inner_range, new_call_op_1_short, new_call_op_2_long,
-                                        new_call_op_3_long, new_call_op_4_short, ops_data.expiration_date)
-
-        condors.append(new_condor_short_calls)
+        if has_calls:
+            yield SpreadCandidate(Condor, call_contracts, ['Sold', 'Bought', 'Bought', 'Sold'],
+                                  (outer_range, inner_range), (ops_data.expiration_date,))
 
         # Condor short - Puts
-        new_put_op_1_short = put_ops[i].create_option_trade('Sold')
-        new_put_op_2_long = put_ops[i + option_2_gap].create_option_trade('Bought')
-        new_put_op_3_long = put_ops[i + option_3_gap].create_option_trade('Bought')
-        new_put_op_4_short = put_ops[i + option_4_gap].create_option_trade('Sold')
-
-        new_condor_short_puts = Condor(outer_range, inner_range, new_put_op_1_short, new_put_op_2_long,
-                                       new_put_op_3_long, new_put_op_4_short, ops_data.expiration_date)
+        if has_puts:
+            yield SpreadCandidate(Condor, put_contracts, ['Sold', 'Bought', 'Bought', 'Sold'],
+                                  (outer_range, inner_range), (ops_data.expiration_date,))
 
-        condors.append(new_condor_short_puts)
 
-    return condors
+def getIronCondorSpreads(ops_data, inner_range, outer_range, candidate_filter=None):
+    return list(iterSpreads(iterIronCondorCandidates(ops_data, inner_range, outer_range), candidate_filter))
 
 
-def getIronCondorSpreads(ops_data, inner_range, outer_range):
+def iterIronCondorCandidates(ops_data, inner_range, outer_range, strike_range=None):
     call_ops = ops_data.options_calls
     put_ops = ops_data.options_puts
 
-    total_range = inner_range + (2 * outer_range)
+    assert (inner_range > 0)
+    assert (outer_range > 0)
 
-    # Assert the range is more than the dollar gap and make sure it can have the spread based on the dollar range
-    # i.e. a spread of $3 is not possible when the $ range is $2: 2, 4, 6, 8 cannot have a $3 spread
-    assert (total_range >= ops_data.data_spread)
-    assert (total_range % ops_data.data_spread == 0)
-    assert (inner_range % ops_data.data_spread == 0)
-    assert (outer_range % ops_data.data_spread == 0)
-    assert (total_range < ops_data.data_spread * len(ops_data.options_calls))
+    # Find the two puts and two calls of the iron condors at each strike (on any strike ladder)
+    # Strikes without all the legs are skipped
+    strike_offsets = (0, outer_range, outer_range + inner_range, (2 * outer_range) + inner_range)
+    iron_condor_legs = ops_data.get_strike_index().find_legs(('put', 'put', 'call', 'call'), strike_offsets,
+                                                                     strike_range=strike_range)
 
-    iron_condors = []
-    strike_dollar_gap = ops_data.data_spread
+    for put_1, put_2, call_3, call_4 in get_complete_legs(iron_condor_legs):
+        contracts = [put_ops[put_1], put_ops[put_2], call_ops[call_3], call_ops[call_4]]
 
-    # Get the number of possible condors
-    # Iterate through and generate condors
-    # To get num of condors:
-    # length of options - (total_range / strike dollar gap)
-    option_data_gap = int(total_range / strike_dollar_gap)
-    num_iter = int(len(call_ops) - option_data_gap)
-
-    option_2_gap = int(outer_range / strike_dollar_gap)
-    option_3_gap = int((outer_range + inner_range) / strike_dollar_gap)
-    option_4_gap = int(((2 * outer_range) + inner_range) / strike_dollar_gap)
-
-    for i in range(0, num_iter):
         # Get long side
         # Get both calls & puts
 
         # Iron Condor long
-        new_put_op_1_short = put_ops[i].create_option_trade('Sold')
-        new_put_op_2_long = put_ops[i + option_2_gap].create_option_trade('Bought')
-        new_call_op_3_long = call_ops[i + option_3_gap].create_option_trade('Bought')
-        new_call_op_4_short = call_ops[i + option_4_gap].create_option_trade('Sold')
-
-        new_iron_condor_long = IronCondor(outer_range, inner_range, new_put_op_1_short, new_put_op_2_long,
-                                          new_call_op_3_long, new_call_op_4_short, ops_data.expiration_date)
-
-        iron_condors.append(new_iron_condor_long)
+        yield SpreadCandidate(IronCondor, contracts, ['Sold', 'Bought', 'Bought', 'Sold'],
+                              (outer_range, inner_range), (ops_data.expiration_date,))
 
         # Iron Condor short
-        new_put_op_1_long = put_ops[i].create_option_trade('Bought')
-        new_put_op_2_short = put_ops[i + option_2_gap].create_option_trade('Sold')
-        new_call_op_3_short = call_ops[i + option_3_gap].create_option_trade('Sold')
-        new_call_op_4_long = call_ops[i + option_4_gap].create_option_trade('Bought')
+        yield SpreadCandidate(IronCondor, contracts, ['Bought', 'Sold', 'Sold', 'Bought'],
+                              (outer_range, inner_range), (ops_data.expiration_date,))
 
-        new_iron_condor_short = IronCondor(outer_range, inner_range, new_put_op_1_long, new_put_op_2_short,
-                                           new_call_op_3_short, new_call_op_4_long, ops_data.expiration_date)
 
-        iron_condors.append(new_iron_condor_short)
+def getRatioSpreads(ops_data, ratio_range, candidate_filter=None):
+    return list(iterSpreads(iterRatioCandidates(ops_data, ratio_range), candidate_filter))
 
-    return iron_condors
 
-
-def getRatioSpreads(ops_data, ratio_range):
+def iterRatioCandidates(ops_data, ratio_range, strike_range=None):
     call_ops = ops_data.options_calls
     put_ops = ops_data.options_puts
 
-    ratios = []
-
-    assert (ratio_range >= ops_data.data_spread)
-    assert (ratio_range % ops_data.data_spread == 0)
+    assert (ratio_range > 0)
 
-    # Get the number of possible ratio spreads
-    # Iterate through and generate ratio spreads
-    # To get num of ratio spreads:
-    # length of options - (total_range / strike dollar gap)
-    strike_dollar_gap = ops_data.data_spread
-    option_data_gap = int(ratio_range / strike_dollar_gap)
-    num_iter = int(len(call_ops) - option_data_gap)
+    # Find the legs of the call and put ratio spreads at each strike (on any strike ladder)
+    # Strikes without both legs are skipped
+    strike_index = ops_data.get_strike_index()
+    call_legs = strike_index.find_legs(('call', 'call'), (0, ratio_range), strike_range=strike_range).tolist()
+    put_legs = strike_index.find_legs(('put', 'put'), (0, ratio_range), strike_range=strike_range).tolist()
 
     # 4 types all types are call/call | put/put
 
-    for i in range(0, num_iter):
-
-        # Call ratio spread (sell less lower, buy more higher)
-        # Ex: +3 105 c, -1 95 c
-
-        new_call_op_1_short = call_ops[i].create_option_trade('Sold')
-        new_call_op_2_long = call_ops[i + option_data_gap].create_option_trade('Bought')
+    for (call_1, call_2), (put_1, put_2) in zip(call_legs, put_legs):
 
-        # option_1, option_2, expiration, ratio_range):
-        new_call_ratio_spread_bm = RatioSpread(new_call_op_1_short, new_call_op_2_long, ops_data.expiration_date, ratio_range)
+        if min(call_1, call_2) >= 0:
+            # Call ratio spread (sell less lower, buy more higher)
+            # Ex: +3 105 c, -1 95 c
+            yield SpreadCandidate(RatioSpread, [call_ops[call_1], call_ops[call_2]], ['Sold', 'Bought'],
+                                  (), (ops_data.expiration_date, ratio_range))
 
-        ratios.append(new_call_ratio_spread_bm)
+            # Call ratio spread (buy less lower, sell more higher)
+            # Ex: +1 95 c, -3 105 c
+            yield SpreadCandidate(RatioSpread, [call_ops[call_1], call_ops[call_2]], ['Bought', 'Sold'],
+                                  (), (ops_data.expiration_date, ratio_range))
 
-        # Call ratio spread (buy less lower, sell more higher)
-        # Ex: +1 95 c, -3 105 c
-        new_call_op_1_long = call_ops[i].create_option_trade('Bought')
-        new_call_op_2_short = call_ops[i + option_data_gap].create_option_trade('Sold')
+        if min(put_1, put_2) >= 0:
+            # Put ratio spread (buy more lower, sell less higher)
+            # Ex: +4 90 p, -1 100 p
+            yield SpreadCandidate(RatioSpread, [put_ops[put_1], put_ops[put_2]], ['Sold', 'Bought'],
+                                  (), (ops_data.expiration_date, ratio_range))
 
-        # option_1, option_2, expiration, ratio_range):
-        new_call_ratio_spread_bl = RatioSpread(new_call_op_1_long, new_call_op_2_short, ops_data.expiration_date,
-                                               ratio_range)
+            # Put ratio spread (sell more lower, buy less higher)
+            # Ex: +1 100 p, -4 90 p
+            yield SpreadCandidate(RatioSpread, [put_ops[put_1], put_ops[put_2]], ['Bought', 'Sold'],
+                                  (), (ops_data.expiration_date, ratio_range))
 
-        ratios.append(new_call_ratio_spread_bl)
 
-        # Put ratio spread (buy more lower, sell less higher)
-        # Ex: +4 90 p, -1 100 p
+def getChristmasTreeSpreads(ops_data, christmas_range, candidate_filter=None):
+    return list(iterSpreads(iterChristmasTreeCandidates(ops_data, christmas_range), candidate_filter))
 
-        new_put_op_1_short = put_ops[i].create_option_trade('Sold')
-        new_put_op_2_long = put_ops[i + option_data_gap].create_option_trade('Bought')
 
-        # option_1, option_2, expiration, ratio_range):
-        new_put_ratio_spread_bm = RatioSpread(new_put_op_1_short, new_put_op_2_long, ops_data.expiration_date,
-                                               ratio_range)
-
-        ratios.append(new_put_ratio_spread_bm)
-
-        # Put ratio spread (sell more lower, buy less higher)
-        # Ex: +1 100 p, -4 90 p
-        new_put_op_1_long = put_ops[i].create_option_trade('Bought')
-        new_put_op_2_short = put_ops[i + option_data_gap].create_option_trade('Sold')
-
-        # option_1, option_2, expiration, ratio_range):
-        new_put_ratio_spread_bl = RatioSpread(new_put_op_1_long, new_put_op_2_short, ops_data.expiration_date,
-                                               ratio_range)
-
-        ratios.append(new_put_ratio_spread_bl)
+def iterChristmasTreeCandidates(ops_data, christmas_range, strike_range=None):
+    call_ops = ops_data.options_calls
+    put_ops = ops_data.options_puts
 
-    return ratios
+    assert (christmas_range > 0)
 
+    # Find the legs of the call and then put christmas trees at each strike (on any strike ladder)
+    # Strikes without all the legs are skipped i.e. a $3 tree is not possible when the strikes are 2, 4, 6, 8
+    strike_offsets = (0, christmas_range, 2 * christmas_range)
+    strike_index = ops_data.get_strike_index()
+    call_legs = strike_index.find_legs(('call', 'call', 'call'), strike_offsets,
+                                       strike_range=strike_range).tolist()
+    put_legs = strike_index.find_legs(('put', 'put', 'put'), strike_offsets,
+                                      strike_range=strike_range).tolist()
 
-def getChristmasTreeSpreads(ops_data, christmas_range):
-    call_ops = ops_data.options_calls
-    put_ops = ops_data.options_puts
+    for call_positions, put_positions in zip(call_legs, put_legs):
+        has_calls = min(call_positions) >= 0
+        has_puts = min(put_positions) >= 0
+        call_contracts = [call_ops[call_i] for call_i in call_positions] if has_calls else None
+        put_contracts = [put_ops[put_i] for put_i in put_positions] if has_puts else None
 
-    # Assert the range is more than the dollar gap and make sure it can have the spread based on the dollar range
-    # i.e. a spread of $3 is not possible when the $ range is $2: 2, 4, 6, 8 cannot have a $3 spread
-    assert (christmas_range >= ops_data.data_spread)
-    assert (christmas_range % ops_data.data_spread == 0)
-    assert (christmas_range * 2 < ops_data.data_spread * len(ops_data.options_calls))
-
-    christmas_trees = []
-    strike_dollar_gap = ops_data.data_spread
-
-    # Get the number of possible butterflies
-    # Iterate through and generate call and then put butterflies
-    # To get num of butterflies:
-    # length of options - 2 * range / strike dollar gap
-    option_data_gap = int((2 * christmas_range) / strike_dollar_gap)
-    num_iter = int(len(call_ops) - option_data_gap)
-    # Test for butterfly
-    option_data_gap = int(option_data_gap / 2)
-
-    for i in range(0, num_iter):
         # Get long side
         # Get both calls & puts
 
         # Christmas long - Calls
-        new_call_op_1_long = call_ops[i].create_option_trade('Bought')
-        new_call_op_2_short = call_ops[i + option_data_gap].create_option_trade('Sold')
-        new_call_op_3_short = call_ops[i + (option_data_gap * 2)].create_option_trade('Sold')
-
-        new_christmas_tree_long_calls = ChristmasTree(new_call_op_1_long, new_call_op_2_short, new_call_op_3_short,
-                                                      ops_data.expiration_date, christmas_range)
-
-        christmas_trees.append(new_christmas_tree_long_calls)
+        if has_calls:
+            yield SpreadCandidate(ChristmasTree, call_contracts, ['Bought', 'Sold', 'Sold'],
+                                  (), (ops_data.expiration_date, christmas_range))
 
         # Christmas long - Puts
-        new_put_op_1_short = put_ops[i].create_option_trade('Sold')
-        new_put_op_2_short = put_ops[i + option_data_gap].create_option_trade('Sold')
-        new_put_op_3_long = put_ops[i + (option_data_gap * 2)].create_option_trade('Bought')
-
-        new_christmas_tree_long_puts = ChristmasTree(new_put_op_1_short, new_put_op_2_short, new_put_op_3_long,
-                                                     ops_data.expiration_date, christmas_range)
-
-        christmas_trees.append(new_christmas_tree_long_puts)
+        if has_puts:
+            yield SpreadCandidate(ChristmasTree, put_contracts, ['Sold', 'Sold', 'Bought'],
+                                  (), (ops_data.expiration_date, christmas_range))
 
         # Christmas short - Calls
-        new_call_op_1_short = call_ops[i].create_option_trade('Sold')
-        new_call_op_2_long = call_ops[i + option_data_gap].create_option_trade('Bought')
-        new_call_op_3_long = call_ops[i + (option_data_gap * 2)].create_option_trade('Bought')
-
-        new_christmas_tree_short_calls = ChristmasTree(new_call_op_1_short, new_call_op_2_long, new_call_op_3_long,
-                                                       ops_data.expiration_date, christmas_range)
-
-        christmas_trees.append(new_christmas_tree_short_calls)
+        if has_calls:
+            yield SpreadCandidate(ChristmasTree, call_contracts, ['Sold', 'Bought', 'Bought'],
+                                  (), (ops_data.expiration_date, christmas_range))
 
         # Christmas short - Puts
-        new_put_op_1_long = put_ops[i].create_option_trade('Bought')
-        new_put_op_2_long = put_ops[i + option_data_gap].create_option_trade('Bought')
-        new_put_op_3_short = put_ops[i + (option_data_gap * 2)].create_option_trade('Sold')
+        if has_puts:
+            yield SpreadCandidate(ChristmasTree, put_contracts, ['Bought', 'Bought', 'Sold'],
+                                  (), (ops_data.expiration_date, christmas_range))
 
-        new_christmas_tree_short_puts = ChristmasTree(new_put_op_1_long, new_put_op_2_long, new_put_op_3_short,
-                                                      ops_data.expiration_date, christmas_range)
 
-        christmas_trees.append(new_christmas_tree_short_puts)
+def getCalendarStraddle(ops_data_closer_expiration, ops_data_further_expiration, candidate_filter=None):
+    return list(iterSpreads(iterCalendarStraddleCandidates(ops_data_closer_expiration, ops_data_further_expiration),
+                            candidate_filter))
 
-    return christmas_trees
 
-
-def getCalendarStraddle(ops_data_closer_expiration, ops_data_further_expiration):
+def iterCalendarStraddleCandidates(ops_data_closer_expiration, ops_data_further_expiration, strike_range=None):
 
     # Get options for the closer expiration
     call_ops_closer = ops_data_closer_expiration.options_calls
@@ -440,52 +320,28 @@ def getCalendarStraddle(ops_data_closer_expiration, ops_data_further_expiration)
     call_ops_further = ops_data_further_expiration.options_calls
     put_ops_further = ops_data_further_expiration.options_puts
 
-    closer_expiration = ops_data_closer_expiration.expiration_date
-    further_expiration = ops_data_further_expiration.expiration_date
+    expirations = (ops_data_closer_expiration.expiration_date, ops_data_further_expiration.expiration_date)
 
-    # Assert length and values before generating straddles
-    assert (len(call_ops_closer) == len(call_ops_further))
-    assert (len(put_ops_closer) == len(put_ops_further))
+    # Match the calls and puts of both expirations by strike (strikes missing from either expiration are skipped)
+    closer_strike_index = ops_data_closer_expiration.get_strike_index()
+    further_strike_index = ops_data_further_expiration.get_strike_index()
+    calendar_legs = np.column_stack([closer_strike_index.find_legs(('call', 'put'), (0, 0),
+                                                                   strike_range=strike_range),
+                                     further_strike_index.find_legs(('call', 'put'), (0, 0),
+                                                                    closer_strike_index.strikes, strike_range)])
 
-    assert (call_ops_closer[0].strike_price == call_ops_further[0].strike_price)
-    assert (put_ops_closer[0].strike_price == put_ops_further[0].strike_price)
+    for call_closer_i, put_closer_i, call_further_i, put_further_i in get_complete_legs(calendar_legs):
+        call_contracts = [call_ops_closer[call_closer_i], call_ops_further[call_further_i]]
+        put_contracts = [put_ops_closer[put_closer_i], put_ops_further[put_further_i]]
 
-    calendar_straddles = []
-    for i in range(0, len(call_ops_closer)):
         # Long calendar spreads
         # sell closer call buy further call
-        new_call_op_closer_short = call_ops_closer[i].create_option_trade('Sold')
-        new_call_op_further_long = call_ops_further[i].create_option_trade('Bought')
-
-        new_calendar_straddle_calls_long = CalenderSpread(new_call_op_closer_short, new_call_op_further_long,
-                                                          closer_expiration, further_expiration)
-
-        calendar_straddles.append(new_calendar_straddle_calls_long)
+        yield SpreadCandidate(CalenderSpread, call_contracts, ['Sold', 'Bought'], (), expirations)
         # sell closer put buy further put
-        new_put_op_closer_short = put_ops_closer[i].create_option_trade('Sold')
-        new_put_op_further_long = put_ops_further[i].create_option_trade('Bought')
-        new_calendar_straddle_puts_long = CalenderSpread(new_put_op_closer_short, new_put_op_further_long,
-                                                         closer_expiration, further_expiration)
-
-        calendar_straddles.append(new_calendar_straddle_puts_long)
+        yield SpreadCandidate(CalenderSpread, put_contracts, ['Sold', 'Bought'], (), expirations)
 
         # Short Calendar Straddles
         # buy closer call sell further call
-
-        new_call_op_closer_long = call_ops_closer[i].create_option_trade('Bought')
-        new_call_op_further_short = call_ops_further[i].create_option_trade('Sold')
-
-        new_calendar_straddle_calls_short = CalenderSpread(new_call_op_closer_long, new_call_op_further_short,
-                                                           closer_expiration, further_expiration)
-
-        calendar_straddles.append(new_calendar_straddle_calls_short)
-
+        yield SpreadCandidate(CalenderSpread, call_contracts, ['Bought', 'Sold'], (), expirations)
         # buy closer put sell further put
-        new_put_op_closer_long = put_ops_closer[i].create_option_trade('Sold')
-        new_put_op_further_short = put_ops_further[i].create_option_trade('Bought')
-        new_calendar_straddle_puts_short = CalenderSpread(new_put_op_closer_long, new_put_op_further_short,
-                                                          closer_expiration, further_expiration)
-
-        calendar_straddles.append(new_calendar_straddle_puts_short)
-
-    return calendar_straddles
+        yield SpreadCandidate(CalenderSpread, put_contracts, ['Sold', 'Bought'], (), expirations)
@@ -1,6 +1,11 @@
 import math
+import threading
+from collections import OrderedDict
+
 import numpy as np
-from scipy.stats import norm
+
+# scipy is only imported the first time an array of normal probabilities is needed (see standard_normal_cdf_batch)
+_ndtr = None
 
 
 # Expected value for a call (simple approach)
@@ -83,6 +88,137 @@ def get_scaled_volatility(annual_volatility, generic_time_frame):
     return round(scaled_vol, 2)
 
 
+# Desc: Bounded, thread safe least recently used (LRU) cache with hit/miss statistics. Used to memoize pricing work
+#       that gets repeated within and across scans (the same option priced for many spreads).
+#       max_size of 0 turns the cache off (values are computed every time), None makes it unbounded.
+class LRUCache:
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Returns the cached value for the key (marking it as most recently used) or the default. """
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                self.hits += 1
+                return self._values[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """ Caches the value, evicting the least recently used values when over the max size. """
+        with self._lock:
+            if self.max_size == 0:
+                return
+            self._values[key] = value
+            self._values.move_to_end(key)
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        """ Returns the cached value for the key, or computes, caches and returns it.
+            The compute is run outside the lock so other threads are not blocked by it. """
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                self.hits += 1
+                return self._values[key]
+            self.misses += 1
+
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def set_max_size(self, max_size):
+        """ Changes the max number of cached values, evicting values if the cache is now over it. """
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self):
+        """ Removes every cached value and resets the statistics. """
+        with self._lock:
+            self._values.clear()
+            self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def cache_info(self):
+        """ Returns the hit/miss/eviction statistics and the current size of the cache. """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._values), 'max_size': self.max_size}
+
+    def __len__(self):
+        return len(self._values)
+
+    def _evict(self):
+        if self.max_size is None:
+            return
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+            self.evictions += 1
+
+
+# Theoretical prices already found by cached_black_scholes_model_option_price
+theoretical_price_cache = LRUCache(max_size=65536)
+
+
+# Normal distribution functions
+
+# Desc: Cumulative probability of the standard normal distribution for a single value (uses math, no scipy)
+# Input: Value x
+# Output: P(Z <= x)
+def standard_normal_cdf(x):
+    return 0.5 * math.erfc(-x / math.sqrt(2))
+
+
+# Desc: Probability density of the standard normal distribution for a single value
+# Input: Value x
+# Output: Density at x
+def standard_normal_pdf(x):
+    return math.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+# Desc: Cumulative probability of the standard normal distribution for an array of values
+#       Uses scipy.special.ndtr (imported on first use), or math.erfc element by element if scipy is not installed
+# Input: Array like of values
+# Output: Array of P(Z <= x)
+def standard_normal_cdf_batch(x):
+    global _ndtr
+    if _ndtr is None:
+        try:
+            from scipy.special import ndtr
+        except ImportError:
+            erfc = np.frompyfunc(math.erfc, 1, 1)
+
+            def ndtr(values):
+                return (0.5 * erfc(-np.asarray(values, dtype=float) / math.sqrt(2))).astype(float)
+        _ndtr = ndtr
+
+    return _ndtr(x)
+
+
+# Desc: Probability density of the standard normal distribution for an array of values
+# Input: Array like of values
+# Output: Array of densities
+def standard_normal_pdf_batch(x):
+    x = np.asarray(x, dtype=float)
+    return np.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+# Desc: Volatility in decimal format: vols above 1 are taken to be in % format (20 -> 0.2, 0.2 stays 0.2)
+# Input: Volatility (float or array, decimal or % format)
+# Output: Volatility in decimal format (an array for array input)
+def to_decimal_volatility(sigma):
+    if np.ndim(sigma) == 0:
+        return sigma / 100 if sigma > 1 else sigma
+    sigma = np.asarray(sigma, dtype=float)
+    return np.where(sigma > 1, sigma / 100, sigma)
+
+
 # Desc: Get the black-scholes theoretical value for an option
 # Input:
 #         S (float): Current stock price
@@ -94,23 +230,322 @@ def get_scaled_volatility(annual_volatility, generic_time_frame):
 # Output: The theoretical option price based on black-scholes model
 
 def black_scholes_model_option_price(S, K, T, r, sigma, option_type):
+    if option_type not in ('call', 'put'):
+        raise ValueError("Invalid option type. Use 'call' or 'put'.")
+
+    # Options with no time to expiration are only worth their intrinsic value (same as the batch model)
+    if T <= 0:
+        intrinsic_value = max(S - K, 0) if option_type == 'call' else max(K - S, 0)
+        return round(intrinsic_value, 2)
+
+    # A worthless stock: calls are worthless, puts are worth the discounted strike (the limit of the model)
+    if S <= 0:
+        return 0.0 if option_type == 'call' else round(K * math.exp(-r * T), 2)
+
     # Incase input for vol is not in decimal format
-    if sigma > 1:
-        sigma = sigma / 100
+    sigma = to_decimal_volatility(sigma)
 
-    d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
-    d2 = d1 - sigma * np.sqrt(T)
+    d1 = (math.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * math.sqrt(T))
+    d2 = d1 - sigma * math.sqrt(T)
 
     if option_type == 'call':
-        option_price = S * norm.cdf(d1) - K * np.exp(-r * T) * norm.cdf(d2)
+        option_price = S * standard_normal_cdf(d1) - K * math.exp(-r * T) * standard_normal_cdf(d2)
     elif option_type == 'put':
-        option_price = K * np.exp(-r * T) * norm.cdf(-d2) - S * norm.cdf(-d1)
+        option_price = K * math.exp(-r * T) * standard_normal_cdf(-d2) - S * standard_normal_cdf(-d1)
     else:
         raise ValueError("Invalid option type. Use 'call' or 'put'.")
 
     return round(option_price, 2)
 
 
+# Desc: Get the black-scholes theoretical value for an option, reusing the value if the same inputs were already
+#       priced. Same inputs and output as black_scholes_model_option_price (see theoretical_price_cache for the
+#       size and statistics of the cache).
+def cached_black_scholes_model_option_price(S, K, T, r, sigma, option_type):
+    key = (float(S), float(K), float(T), float(r), float(sigma), option_type)
+    return theoretical_price_cache.get_or_compute(
+        key, lambda: black_scholes_model_option_price(S, K, T, r, sigma, option_type))
+
+
+# Desc: Convert option types into a call mask for the batch black-scholes functions
+# Input: A single option type or array like of option types ('call' or 'put')
+# Output: Boolean array that is True where the option is a call
+def option_type_to_call_mask(option_types):
+    option_types = np.asarray(option_types)
+    is_call = option_types == 'call'
+
+    if not np.all(is_call | (option_types == 'put')):
+        raise ValueError("Invalid option type. Use 'call' or 'put'.")
+
+    return is_call
+
+
+# Desc: Broadcast the black-scholes inputs together and find d1 and d2 for each element
+# Input: S, K, T, r, sigma (scalars or array like, sigma in decimal or % format)
+# Output: The broadcast S, K, T, r, sigma (decimal) and the d1, d2 arrays
+def _black_scholes_d1_d2_batch(S, K, T, r, sigma):
+    S, K, T, r, sigma = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (S, K, T, r, sigma)))
+
+    # Incase input for vol is not in decimal format
+    sigma = to_decimal_volatility(sigma)
+    d1, d2 = _black_scholes_decimal_d1_d2(S, K, T, r, sigma)
+
+    return S, K, T, r, sigma, d1, d2
+
+
+# Desc: d1 and d2 of the black-scholes model for a volatility that is always in decimal format (no % heuristic,
+#       so a vol of 1.5 is 150%, i.e. for the implied volatility solver)
+# Input: S, K, T, r, sigma (broadcast arrays, sigma in decimal format)
+# Output: The d1, d2 arrays
+def _black_scholes_decimal_d1_d2(S, K, T, r, sigma):
+    # Expired contracts (T = 0) give inf/nan here and are handled by the callers
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_sqrt_T = sigma * np.sqrt(T)
+        d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / sigma_sqrt_T
+        d2 = d1 - sigma_sqrt_T
+
+    return d1, d2
+
+
+# Desc: Get the black-scholes theoretical value for many options in one pass
+# Input:
+#         S (float or array): Current stock price(s)
+#         K (float or array): Option strike price(s)
+#         T (float or array): Time(s) to expiration (in years)
+#         r (float or array): Risk-free interest rate(s) (annualized)
+#         sigma (float or array): Volatility of the underlying asset (annualized, decimal or % format)
+#         is_call (bool or array): True for calls, False for puts ('call'/'put' strings are also accepted)
+#         All inputs are broadcast together
+# Output: Array of unrounded theoretical option prices, expired options (T <= 0) are worth their intrinsic value
+def black_scholes_model_option_price_batch(S, K, T, r, sigma, is_call):
+    is_call = np.asarray(is_call)
+    if is_call.dtype.kind in 'UO':
+        is_call = option_type_to_call_mask(is_call)
+
+    S, K, T, r, sigma, d1, d2 = _black_scholes_d1_d2_batch(S, K, T, r, sigma)
+    S, K, T, r, d1, d2, is_call = np.broadcast_arrays(S, K, T, r, d1, d2, is_call.astype(bool))
+
+    discounted_strike = K * np.exp(-r * T)
+
+    with np.errstate(invalid='ignore'):
+        call_prices = S * standard_normal_cdf_batch(d1) - discounted_strike * standard_normal_cdf_batch(d2)
+        put_prices = discounted_strike * standard_normal_cdf_batch(-d2) - S * standard_normal_cdf_batch(-d1)
+    option_prices = np.where(is_call, call_prices, put_prices)
+
+    # Options with no time to expiration are only worth their intrinsic value
+    expired = T <= 0
+    if np.any(expired):
+        intrinsic_value = np.where(is_call, np.maximum(S - K, 0), np.maximum(K - S, 0))
+        option_prices = np.where(expired, intrinsic_value, option_prices)
+
+    return option_prices
+
+
+# Desc: Get the black-scholes greeks for many options in one pass (d1, d2 and the pdf are shared by all greeks)
+# Input:
+#         S, K, T, r, sigma, is_call: Same as black_scholes_model_option_price_batch (broadcast together)
+# Output: delta, gamma, theta (per calendar day), vega (per 1% of vol) and rho (per 1% of rate) arrays
+#         Expired options (T <= 0) only keep their delta (1 / -1 if in the money, otherwise 0)
+def black_scholes_model_greeks_batch(S, K, T, r, sigma, is_call):
+    is_call = np.asarray(is_call)
+    if is_call.dtype.kind in 'UO':
+        is_call = option_type_to_call_mask(is_call)
+
+    S, K, T, r, sigma, d1, d2 = _black_scholes_d1_d2_batch(S, K, T, r, sigma)
+    S, K, T, r, sigma, d1, d2, is_call = np.broadcast_arrays(S, K, T, r, sigma, d1, d2, is_call.astype(bool))
+
+    sqrt_T = np.sqrt(np.maximum(T, 0))
+    discounted_strike = K * np.exp(-r * T)
+    pdf_d1 = standard_normal_pdf_batch(d1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cdf_d1 = standard_normal_cdf_batch(d1)
+        cdf_d2 = standard_normal_cdf_batch(d2)
+
+        # Call-put parity: N(-x) = 1 - N(x)
+        delta = np.where(is_call, cdf_d1, cdf_d1 - 1)
+        gamma = pdf_d1 / (S * sigma * sqrt_T)
+        time_decay = -(S * pdf_d1 * sigma) / (2 * sqrt_T)
+        theta = np.where(is_call, time_decay - r * discounted_strike * cdf_d2,
+                         time_decay + r * discounted_strike * (1 - cdf_d2)) / 365
+        vega = S * pdf_d1 * sqrt_T / 100
+        rho = np.where(is_call, K * T * np.exp(-r * T) * cdf_d2, -K * T * np.exp(-r * T) * (1 - cdf_d2)) / 100
+
+    # Options with no time to expiration only have delta left
+    expired = T <= 0
+    if np.any(expired):
+        expired_delta = np.where(is_call, (S > K).astype(float), -(S < K).astype(float))
+        delta = np.where(expired, expired_delta, delta)
+        gamma, theta, vega, rho = (np.where(expired, 0.0, greek) for greek in (gamma, theta, vega, rho))
+
+    return delta, gamma, theta, vega, rho
+
+
+# Desc: Find the implied volatility for many option prices in one pass (i.e. a whole chain)
+#       Uses a Newton iteration on vega that falls back to bisection whenever a step leaves the bracket of the
+#       root, so every element converges. Only the elements that have not converged are repriced each iteration.
+# Input:
+#         option_prices (float or array): Market prices of the options
+#         S, K, T, r, is_call: Same as black_scholes_model_option_price_batch (broadcast together)
+#         initial_volatility (float or array): Optional warm start (i.e. the vols of a previous snapshot), any nan
+#                                              elements use the Corrado-Miller approximation instead
+#         tolerance (float): Max price error of a converged volatility
+#         max_iterations (int): Max number of iterations
+# Output: Array of implied volatilities (in % format, 20% = 20), nan where the price is outside the no-arbitrage
+#         bounds of the option or the option is expired
+def implied_volatility_batch(option_prices, S, K, T, r, is_call, initial_volatility=None, tolerance=1e-6,
+                             max_iterations=100):
+    is_call = np.asarray(is_call)
+    if is_call.dtype.kind in 'UO':
+        is_call = option_type_to_call_mask(is_call)
+
+    option_prices, S, K, T, r, is_call = np.broadcast_arrays(
+        *(np.asarray(value, dtype=float) for value in (option_prices, S, K, T, r)), is_call.astype(bool))
+    shape = option_prices.shape
+    option_prices, S, K, T, r, is_call = (value.ravel() for value in (option_prices, S, K, T, r, is_call))
+
+    # Solve every option as a call: a put price is turned into its call price through call-put parity
+    discounted_strike = K * np.exp(-r * T)
+    call_prices = np.where(is_call, option_prices, option_prices + S - discounted_strike)
+
+    # A call is worth between max(S - Ke^-rt, 0) and S
+    solvable = (T > 0) & (call_prices > np.maximum(S - discounted_strike, 0)) & (call_prices < S)
+
+    # Corrado-Miller approximation for the first guess
+    with np.errstate(invalid='ignore', divide='ignore'):
+        moneyness = call_prices - (S - discounted_strike) / 2
+        root = np.sqrt(np.maximum(moneyness ** 2 - (S - discounted_strike) ** 2 / math.pi, 0))
+        sigma = math.sqrt(2 * math.pi) / np.sqrt(T) / (S + discounted_strike) * (moneyness + root)
+
+    if initial_volatility is not None:
+        initial_volatility = np.broadcast_to(np.asarray(initial_volatility, dtype=float), shape).ravel()
+        # Incase input for vol is not in decimal format
+        initial_volatility = to_decimal_volatility(initial_volatility)
+        sigma = np.where(np.isfinite(initial_volatility) & (initial_volatility > 0), initial_volatility, sigma)
+
+    lower_bound = np.full(sigma.shape, 1e-6)
+    upper_bound = np.full(sigma.shape, 10.0)
+    sigma = np.where(np.isfinite(sigma) & (sigma > lower_bound) & (sigma < upper_bound), sigma, 0.2)
+
+    implied_volatilities = np.full(sigma.shape, np.nan)
+    active = np.flatnonzero(solvable)
+
+    for _ in range(max_iterations):
+        if active.size == 0:
+            break
+
+        # Priced with the decimal vol directly: the % heuristic of the pricing functions would turn any
+        # iterate above 1 (100%) into a vol under 1%, breaking the bracket of the root
+        S_a, K_a, T_a, r_a, sigma_a = S[active], K[active], T[active], r[active], sigma[active]
+        d1, d2 = _black_scholes_decimal_d1_d2(S_a, K_a, T_a, r_a, sigma_a)
+        price_error = (S_a * standard_normal_cdf_batch(d1) - discounted_strike[active] * standard_normal_cdf_batch(d2)
+                       - call_prices[active])
+
+        converged = np.abs(price_error) < tolerance
+        implied_volatilities[active[converged]] = sigma_a[converged]
+
+        # Keep the root bracketed: the call price increases with volatility
+        upper_bound[active] = np.where(price_error > 0, sigma_a, upper_bound[active])
+        lower_bound[active] = np.where(price_error < 0, sigma_a, lower_bound[active])
+
+        vega = S_a * standard_normal_pdf_batch(d1) * np.sqrt(T_a)
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            newton_sigma = sigma_a - price_error / vega
+        lower_a, upper_a = lower_bound[active], upper_bound[active]
+        in_bracket = np.isfinite(newton_sigma) & (newton_sigma > lower_a) & (newton_sigma < upper_a)
+        sigma[active] = np.where(in_bracket, newton_sigma, (lower_a + upper_a) / 2)
+
+        active = active[~converged]
+
+    return (implied_volatilities * 100).reshape(shape)
+
+
+# Desc: Exact expiry metrics of many option spreads (legs of calls and puts with one expiration) without a price
+#       grid: at expiration a spread is piecewise linear in the stock price with kinks only at its strikes, so its
+#       payoff at 0 and at each strike (and the slope above the highest strike) give the max profit, max loss,
+#       break even points and slopes exactly, in O(legs) per spread.
+# Input:
+#         strike_prices (array): Strike of each leg, (spreads x legs) or (legs) for one spread
+#         quantities (array): Signed quantity of each leg (negative for sold legs i.e. ratio * -1)
+#         is_call (array): True for call legs, False for put legs ('call'/'put' strings are also accepted)
+#         net_costs (float or array): Net cost of each spread (sum of quantity * cost, negative for a credit)
+#         All leg inputs are broadcast together
+# Output: Tuple of arrays (one value / row per spread):
+#         max_profit: +inf when the profit is unbounded (the payoff rises above the highest strike)
+#         max_loss: -inf when the loss is unbounded
+#         break_even_points: (spreads x legs + 2) stock prices with a payoff of 0 in order, padded with nan
+#         slopes: (spreads x legs + 1) slope of the payoff from 0 to the lowest strike, between each strike
+#                 (in order) and above the highest strike
+def expiry_payoff_metrics_batch(strike_prices, quantities, is_call, net_costs, tolerance=1e-9):
+    is_call = np.asarray(is_call)
+    if is_call.dtype.kind in 'UO':
+        is_call = option_type_to_call_mask(is_call)
+    strike_prices, quantities, is_call = np.broadcast_arrays(np.asarray(strike_prices, dtype=float),
+                                                             np.asarray(quantities, dtype=float),
+                                                             is_call.astype(bool))
+    strike_prices, quantities, is_call = (np.atleast_2d(strike_prices), np.atleast_2d(quantities),
+                                          np.atleast_2d(is_call))
+    num_spreads = strike_prices.shape[0]
+    net_costs = np.broadcast_to(np.asarray(net_costs, dtype=float), (num_spreads,))
+
+    # Kinks of the payoff: 0 and the strikes in order (spreads x nodes)
+    nodes = np.concatenate([np.zeros((num_spreads, 1)), np.sort(strike_prices, axis=1)], axis=1)
+
+    # Payoff at each node: sum of quantity * intrinsic value of each leg, less the net cost
+    stock_prices = nodes[:, :, np.newaxis]
+    leg_strikes, leg_quantities, leg_is_call = (strike_prices[:, np.newaxis, :], quantities[:, np.newaxis, :],
+                                                is_call[:, np.newaxis, :])
+    intrinsic_values = np.where(leg_is_call, np.maximum(stock_prices - leg_strikes, 0),
+                                np.maximum(leg_strikes - stock_prices, 0))
+    node_payoffs = (leg_quantities * intrinsic_values).sum(axis=2) - net_costs[:, np.newaxis]
+    node_payoffs = np.where(np.abs(node_payoffs) < tolerance, 0, node_payoffs)
+
+    # Above the highest strike only the calls change value
+    upper_slope = (quantities * is_call).sum(axis=1)
+    upper_slope = np.where(np.abs(upper_slope) < tolerance, 0, upper_slope)
+    node_gaps = np.diff(nodes, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        segment_slopes = np.where(node_gaps > 0, np.diff(node_payoffs, axis=1) / node_gaps, 0)
+    slopes = np.concatenate([segment_slopes, upper_slope[:, np.newaxis]], axis=1)
+
+    # The payoff is bounded below the lowest strike (stock prices are not negative)
+    max_profit = np.where(upper_slope > 0, np.inf, node_payoffs.max(axis=1))
+    max_loss = np.where(upper_slope < 0, -np.inf, node_payoffs.min(axis=1))
+
+    # Break even points: nodes with a payoff of 0, and where the payoff crosses 0 between nodes / above the
+    # highest strike
+    lower_payoffs, upper_payoffs = node_payoffs[:, :-1], node_payoffs[:, 1:]
+    lower_nodes, upper_nodes = nodes[:, :-1], nodes[:, 1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        crossings = np.where(lower_payoffs * upper_payoffs < 0,
+                             lower_nodes - lower_payoffs * (upper_nodes - lower_nodes) / (upper_payoffs - lower_payoffs),
+                             np.nan)
+        last_payoffs, last_nodes = node_payoffs[:, -1], nodes[:, -1]
+        upper_crossing = np.where(last_payoffs * upper_slope < 0, last_nodes - last_payoffs / upper_slope, np.nan)
+    zero_nodes = np.where(node_payoffs == 0, nodes, np.nan)
+
+    break_even_points = np.sort(np.concatenate([zero_nodes, crossings, upper_crossing[:, np.newaxis]], axis=1), axis=1)
+    # Repeated strikes give repeated break even points
+    repeated = np.concatenate([np.zeros((num_spreads, 1), dtype=bool),
+                               np.abs(np.diff(break_even_points, axis=1)) < tolerance], axis=1)
+    break_even_points = np.sort(np.where(repeated, np.nan, break_even_points), axis=1)
+    break_even_points = break_even_points[:, :strike_prices.shape[1] + 2]
+
+    return max_profit, max_loss, break_even_points, slopes
+
+
+# Desc: Exact expiry metrics of one option spread (see expiry_payoff_metrics_batch)
+# Input: Strike, signed quantity and call / put flag of each leg, net cost of the spread
+# Output: Max profit (inf when unbounded), max loss (-inf when unbounded), list of break even points,
+#         list of slopes (from 0 to the lowest strike, between the strikes, above the highest strike)
+def expiry_payoff_metrics(strike_prices, quantities, is_call, net_cost):
+    max_profit, max_loss, break_even_points, slopes = expiry_payoff_metrics_batch(strike_prices, quantities, is_call,
+                                                                                  net_cost)
+    break_even_points = break_even_points[0]
+    return (float(max_profit[0]), float(max_loss[0]), break_even_points[~np.isnan(break_even_points)].tolist(),
+            slopes[0].tolist())
+
+
 # Desc: Get theta for atm option
 # Input: Theoretical value, time to expiration (days)
 # Output: Theta value
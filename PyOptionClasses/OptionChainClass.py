@@ -0,0 +1,386 @@
+from PyOptionClasses.OptionsClass import (option_data, StrikeIndex, PriceGridPolicy, generate_option_columns,
+                                          generate_options_from_columns, get_data_spread, OPTION_COLUMN_NAMES,
+                                          QUOTE_COLUMN_NAMES)
+from PricingModels import (black_scholes_model_option_price_batch, black_scholes_model_greeks_batch,
+                           implied_volatility_batch)
+import json
+import os
+import numpy as np
+
+# Version of the snapshot format written by OptionChain.save / save_option_chains
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+# Desc: Columnar (struct of arrays) options chain for a specific expiration date.
+#       Holds the strikes, costs, implied vols, theoretical prices, greeks and call/put flags of every option of
+#       the chain as contiguous arrays (calls first, then puts), built straight from the data columns.
+#       Pricing, greeks, implied vols and spread enumeration work over the whole chain at once.
+#       Works like option_data: option objects (options_calls, options_puts, get_options) are only created
+#       from the columns when they are first used, so spreads can still be found with FindingSpreads.
+class OptionChain:
+    def __init__(self, options_data_calls, options_data_puts, expiration_date, curr_stock_price, annual_time_to_exp,
+                 curr_int_rate, curr_volatility, grid_policy=None):
+        self.expiration_date = expiration_date
+        self.current_stock_price = curr_stock_price
+        self.annual_time_to_expiration = annual_time_to_exp
+        self.current_interest_rate = curr_int_rate
+        self.current_volatility = curr_volatility
+        # Price range resolution for the options (and their spreads)
+        self.grid_policy = grid_policy
+
+        # Columns of each side of the chain
+        side_columns = []
+        for options_data, options_type in ((options_data_calls, 'call'), (options_data_puts, 'put')):
+            if options_data is None:
+                side_columns.append({column_name: np.empty(0) for column_name in OPTION_COLUMN_NAMES})
+            else:
+                side_columns.append(generate_option_columns(options_data, options_type, curr_stock_price,
+                                                            annual_time_to_exp, curr_int_rate, curr_volatility))
+
+        self.num_calls = len(side_columns[0]['strike_price'])
+        self.num_puts = len(side_columns[1]['strike_price'])
+        self.set_columns({column_name: np.concatenate([side_columns[0][column_name], side_columns[1][column_name]])
+                          for column_name in OPTION_COLUMN_NAMES},
+                         np.concatenate([np.ones(self.num_calls, dtype=bool), np.zeros(self.num_puts, dtype=bool)]))
+        self.data_spread = get_data_spread(self.strike_prices[self.call_indices],
+                                           self.strike_prices[self.put_indices])
+
+    @classmethod
+    def from_columns(cls, option_columns, is_call, expiration_date, curr_stock_price, annual_time_to_exp,
+                     curr_int_rate, curr_volatility, grid_policy=None, data_spread=None):
+        """ Creates a chain from its columns (calls first, then puts) i.e. a loaded snapshot """
+        chain = cls.__new__(cls)
+        chain.expiration_date = expiration_date
+        chain.current_stock_price = curr_stock_price
+        chain.annual_time_to_expiration = annual_time_to_exp
+        chain.current_interest_rate = curr_int_rate
+        chain.current_volatility = curr_volatility
+        chain.grid_policy = grid_policy
+        chain.data_spread = data_spread
+
+        is_call = np.asarray(is_call, dtype=bool)
+        chain.num_calls = int(np.count_nonzero(is_call))
+        chain.num_puts = len(is_call) - chain.num_calls
+        chain.set_columns(option_columns, is_call)
+        return chain
+
+    @classmethod
+    def from_option_data(cls, ops_data):
+        """ Creates a chain from the options of an option_data (i.e. to save it as a snapshot) """
+        options = ops_data.options_calls + ops_data.options_puts
+        option_columns = {
+            'strike_price': [op.strike_price for op in options], 'cost': [op.curr_cost for op in options],
+            'implied_volatility': [op.implied_volatility for op in options],
+            'theoretical_price': [op.theoretical_price for op in options],
+            'delta': [op.greeks.delta for op in options], 'gamma': [op.greeks.gamma for op in options],
+            'theta': [op.greeks.theta for op in options], 'vega': [op.greeks.vega for op in options],
+            'rho': [op.greeks.rho for op in options]}
+        return cls.from_columns(option_columns, [op.option_type == 'call' for op in options],
+                                ops_data.expiration_date, ops_data.current_stock_price,
+                                ops_data.annual_time_to_expiration, ops_data.current_interest_rate,
+                                ops_data.current_volatility, ops_data.grid_policy, ops_data.data_spread)
+
+    def set_columns(self, option_columns, is_call):
+        """ Sets the columns of the chain (contiguous float arrays, one value per option) """
+        self.strike_prices = np.ascontiguousarray(option_columns['strike_price'], dtype=float)
+        self.costs = np.ascontiguousarray(option_columns['cost'], dtype=float)
+        self.implied_volatilities = np.ascontiguousarray(option_columns['implied_volatility'], dtype=float)
+        self.theoretical_prices = np.ascontiguousarray(option_columns['theoretical_price'], dtype=float)
+        self.deltas = np.ascontiguousarray(option_columns['delta'], dtype=float)
+        self.gammas = np.ascontiguousarray(option_columns['gamma'], dtype=float)
+        self.thetas = np.ascontiguousarray(option_columns['theta'], dtype=float)
+        self.vegas = np.ascontiguousarray(option_columns['vega'], dtype=float)
+        self.rhos = np.ascontiguousarray(option_columns['rho'], dtype=float)
+        self.is_call = np.ascontiguousarray(is_call, dtype=bool)
+        # Model vol of each option (i.e. from a volatility surface), nan for options priced with the users vol
+        self.model_volatilities = np.full(len(self.strike_prices), np.nan)
+
+        # Option objects are created from the columns on first use
+        self._options_calls = None
+        self._options_puts = None
+        self._strike_index = None
+
+    def get_columns(self):
+        """ Returns the columns of the chain by name (see OPTION_COLUMN_NAMES) """
+        return {'strike_price': self.strike_prices, 'cost': self.costs,
+                'implied_volatility': self.implied_volatilities, 'theoretical_price': self.theoretical_prices,
+                'delta': self.deltas, 'gamma': self.gammas, 'theta': self.thetas, 'vega': self.vegas,
+                'rho': self.rhos}
+
+    def __len__(self):
+        return len(self.strike_prices)
+
+    @property
+    def call_indices(self):
+        return np.arange(self.num_calls)
+
+    @property
+    def put_indices(self):
+        return np.arange(self.num_calls, self.num_calls + self.num_puts)
+
+    def get_side_indices(self, options_type):
+        """ Returns the chain indices of the calls or puts (in strike order of the data) """
+        if options_type == 'call':
+            return self.call_indices
+        elif options_type == 'put':
+            return self.put_indices
+        raise ValueError("Invalid option type. Use 'call' or 'put'.")
+
+    # Option objects (option_data interface)
+    @property
+    def options_calls(self):
+        if self._options_calls is None:
+            self._options_calls = self.generate_option_list(self.call_indices, 'call')
+        return self._options_calls
+
+    @property
+    def options_puts(self):
+        if self._options_puts is None:
+            self._options_puts = self.generate_option_list(self.put_indices, 'put')
+        return self._options_puts
+
+    def generate_option_list(self, indices, options_type):
+        """ Creates the option objects for the options at the chain indices """
+        option_columns = {column_name: column[indices] for column_name, column in self.get_columns().items()}
+        options = generate_options_from_columns(option_columns, options_type, self.current_stock_price,
+                                                self.annual_time_to_expiration, self.current_interest_rate,
+                                                self.current_volatility, self.grid_policy)
+        model_volatilities = self.model_volatilities[indices]
+        for position in np.flatnonzero(~np.isnan(model_volatilities)).tolist():
+            options[position].model_volatility = float(model_volatilities[position])
+        return options
+
+    def get_options(self):
+        """ Return the list of call and put options within the options chain """
+        return self.options_calls, self.options_puts
+
+    def get_strike_index(self):
+        """ Returns the strike index of the calls and puts, building it on first use """
+        if self._strike_index is None:
+            self._strike_index = StrikeIndex(self.strike_prices[self.call_indices],
+                                             self.strike_prices[self.put_indices])
+        return self._strike_index
+
+    def get_option(self, index):
+        """ Returns the option object of the option at a chain index """
+        if index < self.num_calls:
+            return self.options_calls[index]
+        return self.options_puts[index - self.num_calls]
+
+    def sync_options(self):
+        """ Copies the columns into the option objects already created (i.e. after refreshing the columns) """
+        for options, indices in ((self._options_calls, self.call_indices), (self._options_puts, self.put_indices)):
+            if options is None:
+                continue
+            for op, implied_volatility, theoretical_price, model_volatility, delta, gamma, theta, vega, rho in zip(
+                    options, self.implied_volatilities[indices].tolist(), self.theoretical_prices[indices].tolist(),
+                    self.model_volatilities[indices].tolist(), self.deltas[indices].tolist(),
+                    self.gammas[indices].tolist(), self.thetas[indices].tolist(), self.vegas[indices].tolist(),
+                    self.rhos[indices].tolist()):
+                op.implied_volatility = implied_volatility
+                op.theoretical_price = theoretical_price
+                model_volatility = None if np.isnan(model_volatility) else model_volatility
+                if op.model_volatility != model_volatility:
+                    op.model_volatility = model_volatility
+                op.greeks.update_greeks(delta, gamma, theta, vega, rho)
+                op.mark_updated()
+        return
+
+    def update_quotes(self, options_type, quote_updates):
+        """ Applies a batch of quote changes (a data frame of 'Exercise Price' and any of the 'Price',
+            'Implied Volatility' and greek columns of the options data, blank for unchanged values) to the options
+            of the type at those strikes: only those values of the columns (and their option objects) change.
+            Returns the updated option objects (only the ones already created, i.e. used by spreads). """
+        strike_prices = quote_updates['Exercise Price'].to_numpy(dtype=float)
+        positions = self.get_strike_index().find(options_type, strike_prices)
+        if np.any(positions < 0):
+            raise ValueError(f'No {options_type} option at strike(s) {strike_prices[positions < 0].tolist()}')
+        indices = self.get_side_indices(options_type)[positions]
+
+        quote_columns = [option_data.get_data_column(quote_updates, column_name) for column_name in QUOTE_COLUMN_NAMES]
+        for column, quote_column in zip((self.costs, self.implied_volatilities, self.deltas, self.gammas,
+                                         self.thetas, self.vegas, self.rhos), quote_columns):
+            quoted = ~np.isnan(quote_column)
+            column[indices[quoted]] = quote_column[quoted]
+
+        options = self._options_calls if options_type == 'call' else self._options_puts
+        if options is None:
+            return []
+
+        updated_options = []
+        for position, quote in zip(positions.tolist(), zip(*(quote_column.tolist() for quote_column in quote_columns))):
+            options[position].update_quote(*quote)
+            updated_options.append(options[position])
+        return updated_options
+
+    # Batch pricing, greeks and implied vols over the columns
+    def price_options(self, volatility=None):
+        """ Returns the black-scholes price of every option of the chain (user vol by default, or per option vols
+            i.e. the implied vols) """
+        if volatility is None:
+            volatility = self.current_volatility
+        return black_scholes_model_option_price_batch(self.current_stock_price, self.strike_prices,
+                                                      self.annual_time_to_expiration, self.current_interest_rate,
+                                                      volatility, self.is_call)
+
+    def calculate_greeks(self, volatility=None):
+        """ Returns the black-scholes greeks (delta, gamma, theta, vega, rho arrays) of every option of the chain
+            using the implied vols (or the user vol where there is none) by default """
+        if volatility is None:
+            volatility = np.where(np.isnan(self.implied_volatilities), self.current_volatility,
+                                  self.implied_volatilities)
+        return black_scholes_model_greeks_batch(self.current_stock_price, self.strike_prices,
+                                                self.annual_time_to_expiration, self.current_interest_rate,
+                                                volatility, self.is_call)
+
+    def refresh_theoretical_prices(self):
+        """ Prices the whole chain again (i.e. after a new stock price or user vol) """
+        self.theoretical_prices = np.round(self.price_options(), 2)
+        self.sync_options()
+        return
+
+    def refresh_implied_volatility(self, warm_start=True):
+        """ Solves for the implied volatility of every option from its current cost in one call.
+            The current implied volatilities are the starting point when warm_start is set.
+            Options with no solution get nan. """
+        initial_volatility = self.implied_volatilities if warm_start else None
+        implied_volatilities = implied_volatility_batch(self.costs, self.current_stock_price, self.strike_prices,
+                                                        self.annual_time_to_expiration, self.current_interest_rate,
+                                                        self.is_call, initial_volatility=initial_volatility)
+        self.implied_volatilities = np.round(implied_volatilities, 2)
+        self.sync_options()
+        return
+
+    def refresh_greeks(self, use_implied_volatility=True):
+        """ Replaces the greeks of every option (i.e. stale vendor greeks) with the black-scholes greeks """
+        volatility = None if use_implied_volatility else self.current_volatility
+        self.deltas, self.gammas, self.thetas, self.vegas, self.rhos = self.calculate_greeks(volatility)
+        self.sync_options()
+        return
+
+    # Spread enumeration over the columns
+    def enumerate_spread_legs(self, leg_types, strike_gaps):
+        """ Finds the legs of every spread with the given shape: leg i is of type leg_types[i] ('call' or 'put')
+            and strike_gaps[i] strikes above the first leg (i.e. ('call', 'call', 'call'), (0, 1, 2) for butterflies).
+            Returns an array of chain indices (one row per spread, one column per leg) in order of the first strike """
+        assert len(leg_types) == len(strike_gaps)
+
+        side_indices = [self.get_side_indices(leg_type) for leg_type in leg_types]
+        num_spreads = min(len(indices) - gap for indices, gap in zip(side_indices, strike_gaps))
+        if num_spreads <= 0:
+            return np.empty((0, len(leg_types)), dtype=int)
+
+        first_strike = np.arange(num_spreads)
+        return np.column_stack([indices[first_strike + gap] for indices, gap in zip(side_indices, strike_gaps)])
+
+    def find_spread_legs(self, leg_types, strike_offsets):
+        """ Finds the legs of every spread with the given shape by strike on any strike ladder: leg i is of type
+            leg_types[i] ('call' or 'put') at strike_offsets[i] dollars above the first leg
+            (i.e. ('call', 'call', 'call'), (0, 2.5, 5) for $2.5 butterflies).
+            Returns an array of chain indices (one row per spread, one column per leg) in order of the first strike """
+        leg_positions = self.get_strike_index().find_legs(leg_types, strike_offsets)
+        leg_positions = leg_positions[np.all(leg_positions >= 0, axis=1)]
+        put_legs = np.array([leg_type == 'put' for leg_type in leg_types])
+        return leg_positions + np.where(put_legs, self.num_calls, 0)
+
+    @staticmethod
+    def get_leg_quantities(trades, ratio=None):
+        """ Returns the signed quantity of each leg (negative for 'Sold' legs) """
+        if ratio is None:
+            ratio = [1] * len(trades)
+        return np.array([-quantity if trade == 'Sold' else quantity for trade, quantity in zip(trades, ratio)],
+                        dtype=float)
+
+    def calculate_spread_costs(self, leg_indices, trades, ratio=None):
+        """ Returns the net cost of each spread (row of leg indices): a credit is negative """
+        return self.costs[leg_indices] @ self.get_leg_quantities(trades, ratio)
+
+    def calculate_spread_greeks(self, leg_indices, trades, ratio=None):
+        """ Returns the net greeks of each spread (row of leg indices) as a (spreads x 5) array
+            of delta, gamma, theta, vega, rho """
+        leg_quantities = self.get_leg_quantities(trades, ratio)
+        return np.column_stack([greek_column[leg_indices] @ leg_quantities for greek_column in
+                                (self.deltas, self.gammas, self.thetas, self.vegas, self.rhos)])
+
+    # Snapshots: one .npy file per column and the chain details (json) in a directory
+    def save(self, directory):
+        """ Saves the chain as a snapshot directory (see OptionChain.load) """
+        os.makedirs(directory, exist_ok=True)
+        for column_name, column in self.get_columns().items():
+            np.save(os.path.join(directory, column_name + '.npy'), np.ascontiguousarray(column))
+        np.save(os.path.join(directory, 'is_call.npy'), np.ascontiguousarray(self.is_call))
+
+        grid_policy = None
+        if self.grid_policy is not None:
+            grid_policy = list(self.grid_policy.get_key())
+        chain_details = {'format_version': SNAPSHOT_FORMAT_VERSION, 'expiration_date': self.expiration_date,
+                         'current_stock_price': float(self.current_stock_price),
+                         'annual_time_to_expiration': float(self.annual_time_to_expiration),
+                         'current_interest_rate': float(self.current_interest_rate),
+                         'current_volatility': float(self.current_volatility),
+                         'data_spread': None if self.data_spread is None else float(self.data_spread),
+                         'grid_policy': grid_policy}
+        with open(os.path.join(directory, 'chain.json'), 'w') as chain_file:
+            json.dump(chain_details, chain_file)
+        return
+
+    @classmethod
+    def load(cls, directory, mmap_mode='c'):
+        """ Loads a chain snapshot directory. The columns are memory mapped (not read or copied) so loading is
+            near instant and processes loading the same snapshot share its memory. The default copy on write mode
+            keeps changes (i.e. quote updates) to the chain loading them, 'r' makes the columns read only and
+            None reads the columns into memory. """
+        with open(os.path.join(directory, 'chain.json')) as chain_file:
+            chain_details = json.load(chain_file)
+        if chain_details['format_version'] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version {chain_details['format_version']}")
+
+        option_columns = {column_name: np.load(os.path.join(directory, column_name + '.npy'), mmap_mode=mmap_mode)
+                          for column_name in OPTION_COLUMN_NAMES}
+        is_call = np.load(os.path.join(directory, 'is_call.npy'), mmap_mode=mmap_mode)
+
+        grid_policy = None
+        if chain_details['grid_policy'] is not None:
+            grid_policy = PriceGridPolicy(*chain_details['grid_policy'])
+        return cls.from_columns(option_columns, is_call, chain_details['expiration_date'],
+                                chain_details['current_stock_price'], chain_details['annual_time_to_expiration'],
+                                chain_details['current_interest_rate'], chain_details['current_volatility'],
+                                grid_policy, chain_details['data_spread'])
+
+    def print_options(self):
+        """ Mainly for testing: Used to view the options added to the options chain"""
+        option_data.print_options(self)
+        return
+
+
+# Desc: Save the chains of many expirations (i.e. a days snapshots) in one snapshot directory:
+#       one chain snapshot (see OptionChain.save) per expiration and a list of them (snapshot.json)
+# Input: Option chains (OptionChain or option_data class format), directory
+# Output: None
+def save_option_chains(option_chains, directory):
+    os.makedirs(directory, exist_ok=True)
+
+    chain_directories = []
+    for i, chain in enumerate(option_chains):
+        if not isinstance(chain, OptionChain):
+            chain = OptionChain.from_option_data(chain)
+        chain_directory = f'chain_{i:03d}'
+        chain.save(os.path.join(directory, chain_directory))
+        chain_directories.append(chain_directory)
+
+    with open(os.path.join(directory, 'snapshot.json'), 'w') as snapshot_file:
+        json.dump({'format_version': SNAPSHOT_FORMAT_VERSION, 'chains': chain_directories}, snapshot_file)
+    return
+
+
+# Desc: Load the chains of a snapshot directory written by save_option_chains (memory mapped, see OptionChain.load)
+# Input: Directory, memory map mode
+# Output: List of option chains (OptionChain class format) in the order they were saved
+def load_option_chains(directory, mmap_mode='c'):
+    with open(os.path.join(directory, 'snapshot.json')) as snapshot_file:
+        snapshot_details = json.load(snapshot_file)
+    if snapshot_details['format_version'] != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format version {snapshot_details['format_version']}")
+
+    return [OptionChain.load(os.path.join(directory, chain_directory), mmap_mode)
+            for chain_directory in snapshot_details['chains']]
@@ -1,9 +1,13 @@
-from PricingModels import black_scholes_model_option_price
+from PricingModels import (cached_black_scholes_model_option_price, black_scholes_model_option_price_batch,
+                           black_scholes_model_greeks_batch, implied_volatility_batch, LRUCache)
 import math
 import numpy as np
 
 # Desc: Option greeks for individual contracts and spreads
+#       Uses __slots__ to keep the memory of each greeks object small (a chain expands into many spreads)
 class greeks:
+    __slots__ = ('delta', 'gamma', 'theta', 'vega', 'rho')
+
     def __init__(self, delta, gamma, theta, vega, rho):
         self.delta = delta
         self.gamma = gamma
@@ -27,157 +31,601 @@ class greeks:
             new_greek.update_greeks(-1 * self.delta, -1 * self.gamma, -1 * self.theta, -1 * self.vega, -1 * self.rho)
         return new_greek
 
+    def scale_greeks(self, multiplier):
+        """ Returns new greeks for a position of multiplier contracts (negative for sold contracts) """
+        return greeks(multiplier * self.delta, multiplier * self.gamma, multiplier * self.theta,
+                      multiplier * self.vega, multiplier * self.rho)
+
+
+# Desc: Resolution of the price range used for payoff profiles (how many prices the range is split into)
+#       'step':     One price every step dollars across the range (default: every cent, 100 prices per dollar)
+#       'fixed':    num_points prices across the range, no matter the price of the underlying
+#       'adaptive': num_points prices across the range plus a price every step dollars within focus_width dollars
+#                   of the focus prices (the strikes and break even points), where the payoff changes shape
+class PriceGridPolicy:
+    def __init__(self, mode='step', step=0.01, num_points=None, focus_width=None):
+        if mode not in ('step', 'fixed', 'adaptive'):
+            raise ValueError("Invalid grid mode. Use 'step', 'fixed' or 'adaptive'.")
+        if mode in ('fixed', 'adaptive') and num_points is None:
+            num_points = 200 if mode == 'adaptive' else 1000
+
+        self.mode = mode
+        self.step = step
+        self.num_points = num_points
+        self.focus_width = focus_width
+
+    def generate_price_range(self, lower_bound, upper_bound, focus_prices=()):
+        """ Splits the price range between the bounds into prices (rounded to the cent) """
+        if self.mode == 'step':
+            num_points = int(round((upper_bound - lower_bound), 2) * (1 / self.step))
+        else:
+            num_points = self.num_points
+        price_range = np.linspace(lower_bound, upper_bound, num_points)
+
+        if self.mode == 'adaptive':
+            focus_width = self.focus_width
+            if focus_width is None:
+                focus_width = (upper_bound - lower_bound) / 50
+
+            focus_ranges = [price_range]
+            for focus_price in focus_prices:
+                focus_lower_bound = max(focus_price - focus_width, lower_bound)
+                focus_upper_bound = min(focus_price + focus_width, upper_bound)
+                if focus_lower_bound <= focus_upper_bound:
+                    focus_ranges.append(np.arange(focus_lower_bound, focus_upper_bound + self.step / 2, self.step))
+            return np.unique(np.round(np.concatenate(focus_ranges), 2))
+
+        return np.round(price_range, 2)
+
+    def get_key(self):
+        """ Key of the policy settings (grids built with equal keys are equal) """
+        return self.mode, self.step, self.num_points, self.focus_width
+
+
+DEFAULT_PRICE_GRID_POLICY = PriceGridPolicy()
+
+# Price ranges shared (read only) by every option and spread with the same stock price, volatility,
+# time to expiration and grid policy: keyed by (stock price, volatility, time, policy key, focus prices)
+price_range_cache = LRUCache(max_size=1024)
+
+# Columns of the options data a quote change can update (in the order of option.update_quote)
+QUOTE_COLUMN_NAMES = ('Price', 'Implied Volatility', 'Delta', 'Gamma', 'Theta', 'Vega', 'Rho')
+
+# Columns of an options chain (the options of a chain are built from these, in this order)
+OPTION_COLUMN_NAMES = ('strike_price', 'cost', 'implied_volatility', 'theoretical_price', 'delta', 'gamma', 'theta',
+                       'vega', 'rho')
+
 
 # Desc: Option contract: Includes information such as the type, strike price, current cost (@time of data input)
 #       the implied volatility, the greeks, the current underlying stock price, annual time to expiration,
-#       the current interest rate, and the current_volatility (the users found volatility)
+#       the current interest rate, and the current_volatility (the users found volatility, also the width of the
+#       price range). The model volatility (i.e. the vol of a volatility surface at the strike) replaces the users
+#       volatility when pricing the option (calendar payoff profiles), None to use the users volatility.
+#       The theoretical price can be passed in when it was already found (i.e. batch priced for a whole chain)
+#       The risk profile (price range, payoff profile, max profit/loss and break even points) is only found the
+#       first time it is used and is then kept until an input it is found from (strike, cost, stock price, time to
+#       expiration or volatility) is set, or invalidate_risk_profile is called
+#       The grid policy sets the resolution of the price range (see PriceGridPolicy, default is every cent)
+#       Uses __slots__ to keep the memory of each option small and attribute access fast
 class option:
+    __slots__ = ('option_type', '_strike_price', '_curr_cost', 'implied_volatility', 'greeks', '_curr_stock_price',
+                 '_annual_time_to_expiration', 'current_interest_rate', '_current_volatility', 'theoretical_price',
+                 '_model_volatility', 'trade', 'grid_policy', 'is_calendar', 'revision', '_price_range',
+                 '_payoff_profile', '_metrics')
 
     def __init__(self, option_type, strike_price, cost, implied_volatility, curr_greeks, curr_stock_price,
-                 annual_time_to_exp, curr_int_rate, curr_volatility, trade):
+                 annual_time_to_exp, curr_int_rate, curr_volatility, trade, theoretical_price=None,
+                 grid_policy=None):
         # Call or put
         self.option_type = option_type
-        self.strike_price = strike_price
-        self.curr_cost = cost
+        # Inputs of the risk profile (setting them later clears the risk profile)
+        self._strike_price = strike_price
+        self._curr_cost = cost
         self.implied_volatility = implied_volatility
         self.greeks = curr_greeks
-        self.curr_stock_price = curr_stock_price
-        self.annual_time_to_expiration = annual_time_to_exp
+        self._curr_stock_price = curr_stock_price
+        self._annual_time_to_expiration = annual_time_to_exp
         self.current_interest_rate = curr_int_rate
-        self.current_volatility = curr_volatility
-
-        self.theoretical_price = black_scholes_model_option_price(curr_stock_price, strike_price, annual_time_to_exp,
-                                                                  curr_int_rate, curr_volatility, option_type)
+        self._current_volatility = curr_volatility
+        self._model_volatility = None
+
+        if theoretical_price is None:
+            theoretical_price = cached_black_scholes_model_option_price(curr_stock_price, strike_price,
+                                                                        annual_time_to_exp, curr_int_rate,
+                                                                        curr_volatility, option_type)
+        self.theoretical_price = theoretical_price
         # Bought or Sold
         self.trade = trade
 
-        self.price_range = self.get_standard_deviation_price_move_range()
-        self.payoff_profile = self.calculate_payoff_profile(self.price_range, isCalendar=False)
-        self.max_profit, self.max_loss, self.break_even_points = self.calculate_metrics(self.price_range)
+        if grid_policy is None:
+            grid_policy = DEFAULT_PRICE_GRID_POLICY
+        self.grid_policy = grid_policy
+
+        # Calendar options value the time left to expiration in their payoff profile
+        self.is_calendar = False
+        # Counts the changes to the option, so trades of the option know when to update
+        self.revision = 0
+        self.invalidate_risk_profile()
+
+    # Inputs of the risk profile: setting one clears the risk profile so it is found again from the new value
+    @property
+    def strike_price(self):
+        return self._strike_price
+
+    @strike_price.setter
+    def strike_price(self, strike_price):
+        self._strike_price = strike_price
+        self.invalidate_risk_profile()
+
+    @property
+    def curr_cost(self):
+        return self._curr_cost
+
+    @curr_cost.setter
+    def curr_cost(self, cost):
+        self._curr_cost = cost
+        self.invalidate_risk_profile()
+
+    @property
+    def curr_stock_price(self):
+        return self._curr_stock_price
+
+    @curr_stock_price.setter
+    def curr_stock_price(self, curr_stock_price):
+        self._curr_stock_price = curr_stock_price
+        self.invalidate_risk_profile()
+
+    @property
+    def annual_time_to_expiration(self):
+        return self._annual_time_to_expiration
+
+    @annual_time_to_expiration.setter
+    def annual_time_to_expiration(self, annual_time_to_exp):
+        self._annual_time_to_expiration = annual_time_to_exp
+        self.invalidate_risk_profile()
+
+    @property
+    def current_volatility(self):
+        return self._current_volatility
+
+    @current_volatility.setter
+    def current_volatility(self, curr_volatility):
+        self._current_volatility = curr_volatility
+        self.invalidate_risk_profile()
+
+    @property
+    def model_volatility(self):
+        return self._model_volatility
+
+    @model_volatility.setter
+    def model_volatility(self, model_volatility):
+        self._model_volatility = model_volatility
+        self.invalidate_risk_profile()
+
+    def get_pricing_volatility(self):
+        """ Returns the volatility the option is priced with: the model volatility when set, otherwise the users """
+        return self.current_volatility if self._model_volatility is None else self._model_volatility
+
+    @property
+    def price_range(self):
+        if self._price_range is None:
+            self._price_range = self.get_standard_deviation_price_move_range()
+        return self._price_range
+
+    @price_range.setter
+    def price_range(self, price_range):
+        self.invalidate_risk_profile()
+        self._price_range = price_range
+
+    @property
+    def payoff_profile(self):
+        if self._payoff_profile is None:
+            self._payoff_profile = self.calculate_payoff_profile(self.price_range, isCalendar=self.is_calendar)
+        return self._payoff_profile
+
+    @property
+    def max_profit(self):
+        return self.get_metrics()[0]
+
+    @property
+    def max_loss(self):
+        return self.get_metrics()[1]
+
+    @property
+    def break_even_points(self):
+        return self.get_metrics()[2]
+
+    def get_metrics(self):
+        """ Returns the max profit, max loss and break even points, finding them on first use """
+        if self._metrics is None:
+            self._metrics = self.calculate_metrics(self.price_range)
+        return self._metrics
+
+    def invalidate_risk_profile(self):
+        """ Clears the price range, payoff profile and metrics so they are found again (from the
+            current inputs) the next time they are used """
+        self._price_range = None
+        self._payoff_profile = None
+        self._metrics = None
+        self.mark_updated()
+
+    def mark_updated(self):
+        """ Marks the option as changed (i.e. new greeks) so trades of the option update from it """
+        self.revision += 1
+
+    def update_quote(self, cost=None, implied_volatility=None, delta=None, gamma=None, theta=None, vega=None,
+                     rho=None):
+        """ Applies a quote change (i.e. a new price or implied vol from the market): values left as None (or nan)
+            are unchanged. Clears the risk profile so it (and the trades of the option) are found again. """
+        if cost is not None and not math.isnan(cost):
+            self._curr_cost = cost
+        if implied_volatility is not None and not math.isnan(implied_volatility):
+            self.implied_volatility = implied_volatility
+
+        updated_greeks = [self.greeks.delta, self.greeks.gamma, self.greeks.theta, self.greeks.vega, self.greeks.rho]
+        for i, greek in enumerate([delta, gamma, theta, vega, rho]):
+            if greek is not None and not math.isnan(greek):
+                updated_greeks[i] = greek
+        self.greeks.update_greeks(*updated_greeks)
+
+        self.invalidate_risk_profile()
+        return
 
     def update_time_to_expiration(self, time_to_exp, price_range):
         """ Used to update the time to expiration and corresponding information
             Used primarily to update calendar spreads & finding the new theoretical
             value for an option given the updated time to expiration. """
 
-        self.annual_time_to_expiration = time_to_exp
+        # The risk profile is cleared once by setting the price range
+        self._annual_time_to_expiration = time_to_exp
+        self.is_calendar = True
         self.price_range = price_range
-        self.payoff_profile = self.calculate_payoff_profile(self.price_range, isCalendar=True)
-        self.max_profit, self.max_loss, self.break_even_points = self.calculate_metrics(self.price_range)
-
-    def create_option_trade(self, trade):
-        """ Creates an option trade: either buying ('Bought') or selling ('Sold'). """
-        trade_cost = self.curr_cost
-        if trade == 'Sold':
-            # Trade gives a credit
-            trade_cost *= -1
 
-        option_with_trade = option(self.option_type, self.strike_price, trade_cost, self.implied_volatility,
-                                   self.greeks.greeks_from_trade(trade), self.curr_stock_price,
-                                   self.annual_time_to_expiration, self.current_interest_rate,
-                                   self.current_volatility, trade)
-        return option_with_trade
+    def create_option_trade(self, trade, quantity=1):
+        """ Creates an option trade: either buying ('Bought') or selling ('Sold') a quantity of the option.
+            The trade references this option (see option_trade) so nothing is priced or built again. """
+        return option_trade(self, trade, quantity)
 
-    def get_standard_deviation_price_move_range(self):
+    def get_standard_deviation_price_move_range(self, grid_policy=None, focus_prices=None):
         """ Given the volatility for a given stock, it finds the standard deviation
-            and thus the price range (within 3 std dev) for the stock. """
+            and thus the price range (within 3 std dev) for the stock.
+            The range is split into prices by the grid policy (the options policy by default), adaptive
+            grids focus on the given prices or the strike and break even point of the option. """
+        if grid_policy is None:
+            grid_policy = self.grid_policy
+
+        # Only adaptive grids depend on the focus prices
+        if grid_policy.mode != 'adaptive':
+            focus_prices = ()
+        elif focus_prices is None:
+            focus_prices = self.get_focus_prices()
+        focus_prices = tuple(sorted(set(float(price) for price in focus_prices)))
+
+        key = (float(self.curr_stock_price), float(self.current_volatility), float(self.annual_time_to_expiration),
+               grid_policy.get_key(), focus_prices)
+        return price_range_cache.get_or_compute(key, lambda: self.generate_price_range(grid_policy, focus_prices))
+
+    def generate_price_range(self, grid_policy, focus_prices):
+        """ Builds the price range of the option (read only, as it is shared through the price range cache) """
         # STD dev based on Vol,time = volatility,annual * sqrt(time)
         standard_deviation = self.curr_stock_price * ((self.current_volatility/100) *
                                                       math.sqrt(1 / (256 * self.annual_time_to_expiration)))
 
         price_range_lower_bound = round(self.curr_stock_price - (3 * standard_deviation), 2)
         price_range_upper_bound = round(self.curr_stock_price + (3 * standard_deviation), 2)
-        num_points = int(round((price_range_upper_bound - price_range_lower_bound), 2) * 100)
-
-        price_range_list = np.linspace(price_range_lower_bound, price_range_upper_bound, num_points)
-        rounded_price_range_list = np.round(price_range_list, 2)
-        return rounded_price_range_list
-
-    def calculate_payoff_profile(self, price_range, isCalendar):
-        """ Finds the payoff profile @ a specific expiration date for an option. """
-
-        # Find at expiration for non-calendar spreads
-        if not isCalendar:
-            payoff_profile = [0] * len(price_range)
-            for i, price in enumerate(price_range):
-                if self.option_type == 'call':
-                    payoff = max(price - self.strike_price, 0)
-                elif self.option_type == 'put':
-                    payoff = max(self.strike_price - price, 0)
-                else:
-                    raise ValueError("Invalid option type")
-
-                if self.trade == 'Sold':
-                    payoff *= -1
-                    payoff -= self.curr_cost
-                    # Sold options have inverse payoff
-                else:
-                    payoff -= self.curr_cost
-
-                payoff_profile[i] += round(payoff, 2)
+        price_range = grid_policy.generate_price_range(price_range_lower_bound, price_range_upper_bound,
+                                                       focus_prices)
+        price_range.flags.writeable = False
+        return price_range
+
+    def get_focus_prices(self):
+        """ Prices where the payoff of the option changes at expiration: the strike and the break even point """
+        if self.option_type == 'call':
+            return [self.strike_price, self.strike_price + abs(self.curr_cost)]
+        return [self.strike_price, self.strike_price - abs(self.curr_cost)]
+
+    def calculate_payoff_profile(self, price_range, isCalendar, annual_time_to_exp=None):
+        """ Finds the payoff profile @ a specific expiration date for an option.
+            Returns an array with the payoff at each price of the price range.
+            Calendar options are valued with annual_time_to_exp left (defaults to the options time). """
+        price_range = np.asarray(price_range, dtype=float)
+        if annual_time_to_exp is None:
+            annual_time_to_exp = self.annual_time_to_expiration
+
+        if isCalendar and annual_time_to_exp != 0:
+            # For calendar options with still time to expiration: value is the theoretical value when closed out
+            # The whole price range is priced in one call of the model (rounded like the single option model)
+            if self.option_type not in ('call', 'put'):
+                raise ValueError("Invalid option type")
+            option_value = np.round(black_scholes_model_option_price_batch(price_range, self.strike_price,
+                                                                           annual_time_to_exp,
+                                                                           self.current_interest_rate,
+                                                                           self.get_pricing_volatility(),
+                                                                           self.option_type == 'call'), 2)
         else:
-            # Price range for a calendar spread
-            payoff_profile = [0] * len(price_range)
-
-            if self.annual_time_to_expiration != 0:
-                # For options with still time to expiration
-                for i, price in enumerate(price_range):
-                    theoretical_value = black_scholes_model_option_price(price, self.strike_price,
-                                                                         self.annual_time_to_expiration,
-                                                                         self.current_interest_rate,
-                                                                         self.current_volatility, self.option_type)
-                    if self.trade == 'Sold':
-                        # Need to buy back and difference is profit or loss
-                        payoff = -1 * (self.curr_cost + theoretical_value)
-                    else:
-                        # Need to sell back and difference is loss or profit
-                        payoff = -1 * (self.curr_cost - theoretical_value)
-                    payoff_profile[i] += round(payoff, 2)
+            # Find at expiration for non-calendar spreads (and calendar options with no time to expiration)
+            if self.option_type == 'call':
+                option_value = np.maximum(price_range - self.strike_price, 0)
+            elif self.option_type == 'put':
+                option_value = np.maximum(self.strike_price - price_range, 0)
             else:
-                # For options with no time to expiration
-                for i, price in enumerate(price_range):
-                    if self.option_type == 'call':
-                        payoff = max(price - self.strike_price, 0)
-                    elif self.option_type == 'put':
-                        payoff = max(self.strike_price - price, 0)
-                    else:
-                        raise ValueError("Invalid option type")
-
-                    if self.trade == 'Sold':
-                        payoff *= -1
-                        payoff -= self.curr_cost
-                        # Sold options have inverse payoff
-                    else:
-                        payoff -= self.curr_cost
-
-                    payoff_profile[i] += round(payoff, 2)
-
-        return payoff_profile
+                raise ValueError("Invalid option type")
+
+        if self.trade == 'Sold':
+            # Sold options have inverse payoff (need to buy back and difference is profit or loss)
+            payoff_profile = -option_value - self.curr_cost
+        else:
+            payoff_profile = option_value - self.curr_cost
+
+        return np.round(payoff_profile, 2)
 
     def calculate_metrics(self, price_range):
         """ Given the price range and the value for an option at difference prices:
             It finds the max profit, max loss and break even points for the price range """
-        max_profit = round(max(self.payoff_profile), 2)
-        max_loss = round(min(self.payoff_profile), 2)
+        return calculate_payoff_metrics(price_range, self.payoff_profile)
 
-        break_even_point = [price_range[i] for i, payoff in enumerate(self.payoff_profile) if payoff == 0]
 
-        # risk_reward_ratio = -max_loss / max_profit if max_profit != 0 else None
+# Desc: Option trade: Buying ('Bought') or selling ('Sold') a quantity of an option contract
+#       The trade references the contract instead of copying it, so nothing is priced or built again: the price
+#       range is the contracts, and the cost, greeks and payoff profile are the contracts times the multiplier
+#       of the trade (quantity, negative when sold). Bought trades of one contract share the contracts arrays.
+#       Has the same attributes as an option so it can be used as the leg of a spread. Updating the time to
+#       expiration (calendar spreads) only changes the trade, never the contract.
+class option_trade:
+    __slots__ = ('contract', 'trade', 'quantity', 'multiplier', 'is_calendar', '_annual_time_to_expiration',
+                 '_price_range', '_payoff_profile', '_metrics', '_greeks', '_revision')
+
+    def __init__(self, contract, trade, quantity=1):
+        self.contract = contract
+        self.trade = trade
+        self.quantity = quantity
+        self.multiplier = -quantity if trade == 'Sold' else quantity
+
+        self.is_calendar = False
+        self._annual_time_to_expiration = None
+        self._price_range = None
+        self.invalidate_risk_profile()
+
+    # Contract information
+    @property
+    def option_type(self):
+        return self.contract.option_type
+
+    @property
+    def strike_price(self):
+        return self.contract.strike_price
+
+    @property
+    def implied_volatility(self):
+        return self.contract.implied_volatility
+
+    @property
+    def curr_stock_price(self):
+        return self.contract.curr_stock_price
+
+    @property
+    def current_interest_rate(self):
+        return self.contract.current_interest_rate
+
+    @property
+    def current_volatility(self):
+        return self.contract.current_volatility
+
+    @property
+    def model_volatility(self):
+        return self.contract.model_volatility
+
+    def get_pricing_volatility(self):
+        return self.contract.get_pricing_volatility()
+
+    @property
+    def theoretical_price(self):
+        return self.contract.theoretical_price
+
+    @property
+    def grid_policy(self):
+        return self.contract.grid_policy
+
+    @property
+    def annual_time_to_expiration(self):
+        if self._annual_time_to_expiration is None:
+            return self.contract.annual_time_to_expiration
+        return self._annual_time_to_expiration
+
+    # Trade information (contract times the multiplier of the trade)
+    @property
+    def curr_cost(self):
+        return self.contract.curr_cost * self.multiplier
+
+    @property
+    def greeks(self):
+        self.check_contract_revision()
+        if self._greeks is None:
+            # Always new greeks (even for 1 contract), so changing the greeks of a trade does not change the contract
+            self._greeks = self.contract.greeks.scale_greeks(self.multiplier)
+        return self._greeks
+
+    @property
+    def price_range(self):
+        if self._price_range is None:
+            return self.contract.price_range
+        return self._price_range
+
+    @property
+    def payoff_profile(self):
+        self.check_contract_revision()
+        if self._payoff_profile is None:
+            if self.is_calendar:
+                payoff_profile = self.calculate_payoff_profile(self.price_range, isCalendar=True)
+            elif self.multiplier == 1:
+                # View of the payoff of the contract (no copy)
+                payoff_profile = self.contract.payoff_profile.view()
+            else:
+                payoff_profile = self.contract.payoff_profile * self.multiplier
+            # Read only (like the price grids), as the payoff may be the contract's and shared by every trade of it
+            payoff_profile.flags.writeable = False
+            self._payoff_profile = payoff_profile
+        return self._payoff_profile
+
+    @property
+    def max_profit(self):
+        return self.get_metrics()[0]
+
+    @property
+    def max_loss(self):
+        return self.get_metrics()[1]
+
+    @property
+    def break_even_points(self):
+        return self.get_metrics()[2]
+
+    def get_metrics(self):
+        """ Returns the max profit, max loss and break even points, finding them on first use """
+        self.check_contract_revision()
+        if self._metrics is None:
+            self._metrics = calculate_payoff_metrics(self.price_range, self.payoff_profile)
+        return self._metrics
+
+    def check_contract_revision(self):
+        """ Clears what the trade found from the contract if the contract changed since """
+        if self._revision != self.contract.revision:
+            self.invalidate_risk_profile()
+
+    def invalidate_risk_profile(self):
+        """ Clears the payoff profile, metrics and greeks so they are found again the next time they are used """
+        self._payoff_profile = None
+        self._metrics = None
+        self._greeks = None
+        self._revision = self.contract.revision
+
+    def update_time_to_expiration(self, time_to_exp, price_range):
+        """ Used to update the time to expiration of the trade (the contract is unchanged)
+            Used primarily to update calendar spreads & finding the new theoretical
+            value for an option given the updated time to expiration. """
+        self._annual_time_to_expiration = time_to_exp
+        self._price_range = price_range
+        self.is_calendar = True
+        self.invalidate_risk_profile()
+
+    def create_option_trade(self, trade, quantity=None):
+        """ Creates another trade of the same contract (same quantity by default) """
+        if quantity is None:
+            quantity = self.quantity
+        return option_trade(self.contract, trade, quantity)
+
+    def get_standard_deviation_price_move_range(self, grid_policy=None, focus_prices=None):
+        """ Returns the price range of the contract (see option.get_standard_deviation_price_move_range) """
+        return self.contract.get_standard_deviation_price_move_range(grid_policy, focus_prices)
+
+    def calculate_payoff_profile(self, price_range, isCalendar):
+        """ Finds the payoff profile of the trade: the contracts payoff profile times the multiplier """
+        contract_payoff_profile = self.contract.calculate_payoff_profile(price_range, isCalendar,
+                                                                         self.annual_time_to_expiration)
+        return contract_payoff_profile * self.multiplier
+
+    def calculate_metrics(self, price_range):
+        """ Given the price range and the value for the trade at difference prices:
+            It finds the max profit, max loss and break even points for the price range """
+        return calculate_payoff_metrics(price_range, self.payoff_profile)
+
+
+# Desc: Find the max profit, max loss and break even points of a payoff profile
+# Input: Price range, payoff at each price of the range
+# Output: Max profit, max loss, list of break even points (prices with a payoff of 0)
+def calculate_payoff_metrics(price_range, payoff_profile):
+    max_profit = round(payoff_profile.max(), 2)
+    max_loss = round(payoff_profile.min(), 2)
+
+    break_even_point = np.asarray(price_range)[payoff_profile == 0].tolist()
+
+    # risk_reward_ratio = -max_loss / max_profit if max_profit != 0 else None
+
+    return max_profit, max_loss, break_even_point  # risk_reward_ratio
+
+
+# Desc: Sorted index of the strikes of the calls and puts of an options chain
+#       Finds options by strike (i.e. "strike K + width") with a binary search, so spreads can be found on any
+#       strike ladder (mixed $1, $2.5 and $5 strikes) without assuming a uniform gap between strikes.
+#       Positions are the positions of the options in the options_calls / options_puts lists.
+class StrikeIndex:
+    def __init__(self, call_strikes, put_strikes, tolerance=1e-6):
+        self.tolerance = tolerance
+        self.sorted_strikes = {}
+        self.sorted_positions = {}
+        for options_type, strikes in (('call', call_strikes), ('put', put_strikes)):
+            strikes = np.asarray(strikes, dtype=float)
+            order = np.argsort(strikes, kind='stable')
+            self.sorted_strikes[options_type] = strikes[order]
+            self.sorted_positions[options_type] = order
+
+        # Every strike of the chain (either side) in order
+        self.strikes = np.unique(np.concatenate([self.sorted_strikes['call'], self.sorted_strikes['put']]))
+
+    @classmethod
+    def from_options(cls, options_calls, options_puts, tolerance=1e-6):
+        """ Builds the index of lists of call and put options """
+        return cls([op.strike_price for op in options_calls], [op.strike_price for op in options_puts], tolerance)
+
+    def find(self, options_type, strike_prices):
+        """ Returns the position of the option of the type at each strike price, or -1 when the chain has no
+            option at the strike (within the tolerance) """
+        if options_type not in self.sorted_strikes:
+            raise ValueError("Invalid option type. Use 'call' or 'put'.")
+        sorted_strikes = self.sorted_strikes[options_type]
+        strike_prices = np.asarray(strike_prices, dtype=float)
+        if len(sorted_strikes) == 0:
+            return np.full(strike_prices.shape, -1, dtype=int)
+
+        location = np.minimum(np.searchsorted(sorted_strikes, strike_prices - self.tolerance), len(sorted_strikes) - 1)
+        found = np.abs(sorted_strikes[location] - strike_prices) <= self.tolerance
+        return np.where(found, self.sorted_positions[options_type][location], -1)
+
+    def find_legs(self, leg_types, strike_offsets, base_strikes=None, strike_range=None):
+        """ Finds the legs of a spread at each base strike (every strike of the chain by default): leg i is the
+            option of type leg_types[i] ('call' or 'put') at the base strike + strike_offsets[i].
+            Only the base strikes start to stop (excluded) are used when a strike_range (start, stop) is given,
+            i.e. to split a scan of the chain by strikes.
+            Returns an array of positions (one row per base strike, one column per leg), -1 for missing legs """
+        assert len(leg_types) == len(strike_offsets)
+        if base_strikes is None:
+            base_strikes = self.strikes
+        base_strikes = np.asarray(base_strikes, dtype=float)
+        if strike_range is not None:
+            base_strikes = base_strikes[strike_range[0]:strike_range[1]]
+        return np.column_stack([self.find(leg_type, base_strikes + strike_offset)
+                                for leg_type, strike_offset in zip(leg_types, strike_offsets)]).reshape(
+            len(base_strikes), len(leg_types))
+
+
+# Desc: Finds the spacing between the strikes of an options chain, i.e. the gap between its two lowest strikes.
+#       The strikes of each side are tried in order (calls first) until one has at least 2 distinct strikes.
+# Input: The strike prices of each side of the chain
+# Output: The gap between the two lowest strikes, None if no side has 2 distinct strikes
+def get_data_spread(*side_strike_prices):
+    for strike_prices in side_strike_prices:
+        strike_prices = np.unique(np.asarray(strike_prices, dtype=float))
+        if len(strike_prices) >= 2:
+            return float(strike_prices[1] - strike_prices[0])
+    return None
 
-        return max_profit, max_loss, break_even_point  # risk_reward_ratio
 
 # Desc: Database type of way of storing options data. Includes the list of calls, puts, # a specific expiration date
 #       including the time to expiration, the interest rate and the user found volatility.
 class option_data:
     def __init__(self, options_data_calls, options_data_puts, expiration_date, curr_stock_price, annual_time_to_exp,
-                 curr_int_rate, curr_volatility):
+                 curr_int_rate, curr_volatility, grid_policy=None):
         self.expiration_date = expiration_date
         self.current_stock_price = curr_stock_price
         self.annual_time_to_expiration = annual_time_to_exp
         self.current_interest_rate = curr_int_rate
         self.current_volatility = curr_volatility
-        self.data_spread = abs(
-            options_data_calls.loc[0, 'Exercise Price'] - options_data_calls.loc[1, 'Exercise Price'])
+        # Price range resolution for the options (and their spreads)
+        self.grid_policy = grid_policy
+        # Built on first use (see get_strike_index)
+        self._strike_index = None
+        self.data_spread = get_data_spread(*(options_data['Exercise Price']
+                                             for options_data in (options_data_calls, options_data_puts)
+                                             if options_data is not None))
 
         # Only generate if there is data to parse
         if options_data_calls is not None:
@@ -187,28 +635,104 @@ class option_data:
             self.options_puts = self.generate_option_list(options_data_puts, 'put')
 
     def generate_option_list(self, options_data, options_type):
-        """ Given the list of options, add their greeks and return the set of options"""
-        # TODO: Fix in future once data contains Rho : Just adds rho 0.01 for now
-        options = []
-        for idx, op in options_data.iterrows():
-            # Set Greeks and Option into Class
-            option_greeks = greeks(delta=op['Delta'], gamma=op['Gamma'], theta=op['Theta'], vega=op['Vega'], rho=0.01)
+        """ Given the list of options, add their greeks and return the set of options.
+            Greeks missing from the data (or left blank) are filled in from the black-scholes model. """
+        option_columns = generate_option_columns(options_data, options_type, self.current_stock_price,
+                                                 self.annual_time_to_expiration, self.current_interest_rate,
+                                                 self.current_volatility)
+        return generate_options_from_columns(option_columns, options_type, self.current_stock_price,
+                                             self.annual_time_to_expiration, self.current_interest_rate,
+                                             self.current_volatility, self.grid_policy)
+
+    @staticmethod
+    def get_data_column(options_data, column_name):
+        """ Returns a column of the options data as floats, or all nan if the data does not include it """
+        if column_name not in options_data:
+            return np.full(len(options_data), np.nan)
+        return options_data[column_name].to_numpy(dtype=float)
+
+    def refresh_implied_volatility(self, warm_start=True):
+        """ Solves for the implied volatility of every option from its current cost, solving each side of the
+            chain in one call. The current implied volatilities are used as the starting point when warm_start
+            is set (i.e. refreshing a chain after a new snapshot). Options with no solution get nan. """
+        for options in (self.options_calls, self.options_puts):
+            if not options:
+                continue
+
+            strike_prices = np.array([op.strike_price for op in options], dtype=float)
+            costs = np.array([op.curr_cost for op in options], dtype=float)
+            previous_volatilities = None
+            if warm_start:
+                previous_volatilities = np.array([op.implied_volatility for op in options], dtype=float)
+
+            implied_volatilities = implied_volatility_batch(costs, self.current_stock_price, strike_prices,
+                                                            self.annual_time_to_expiration,
+                                                            self.current_interest_rate,
+                                                            options[0].option_type == 'call',
+                                                            initial_volatility=previous_volatilities)
+
+            for op, implied_volatility in zip(options, np.round(implied_volatilities, 2).tolist()):
+                op.implied_volatility = implied_volatility
+        return
 
-            new_option = option(option_type=options_type, strike_price=op['Exercise Price'], cost=op['Price'],
-                                implied_volatility=op['Implied Volatility'], curr_greeks=option_greeks,
-                                curr_stock_price=self.current_stock_price,
-                                annual_time_to_exp=self.annual_time_to_expiration,
-                                curr_int_rate=self.current_interest_rate, curr_volatility=self.current_volatility,
-                                trade=None)
+    def refresh_greeks(self, use_implied_volatility=True):
+        """ Replaces the greeks of every option (i.e. stale vendor greeks) with the black-scholes greeks,
+            finding all the greeks for each side of the chain with one call of the model. """
+        for options in (self.options_calls, self.options_puts):
+            if not options:
+                continue
+
+            strike_prices = np.array([op.strike_price for op in options], dtype=float)
+            if use_implied_volatility:
+                volatilities = np.array([op.implied_volatility for op in options], dtype=float)
+                volatilities = np.where(np.isnan(volatilities), self.current_volatility, volatilities)
+            else:
+                volatilities = self.current_volatility
 
-            options.append(new_option)
+            model_greeks = black_scholes_model_greeks_batch(self.current_stock_price, strike_prices,
+                                                            self.annual_time_to_expiration,
+                                                            self.current_interest_rate, volatilities,
+                                                            options[0].option_type == 'call')
 
-        return options
+            for op, (delta, gamma, theta, vega, rho) in zip(options, zip(*(greek.tolist() for greek in model_greeks))):
+                op.greeks.update_greeks(delta, gamma, theta, vega, rho)
+                op.mark_updated()
+        return
 
     def get_options(self):
         """ Return the list of call and put options within the options data set"""
         return self.options_calls, self.options_puts
 
+    def get_strike_index(self):
+        """ Returns the strike index of the calls and puts, building it on first use """
+        if self._strike_index is None:
+            self._strike_index = StrikeIndex.from_options(self.options_calls, self.options_puts)
+        return self._strike_index
+
+    def update_quotes(self, options_type, quote_updates):
+        """ Applies a batch of quote changes (a data frame of 'Exercise Price' and any of the 'Price',
+            'Implied Volatility' and greek columns of the options data, blank for unchanged values) to the options
+            of the type at those strikes. Only the options quoted are changed (and marked as updated).
+            Returns the updated options, i.e. to refresh the spreads using them (see SpreadBook). """
+        if options_type == 'call':
+            options = self.options_calls
+        elif options_type == 'put':
+            options = self.options_puts
+        else:
+            raise ValueError("Invalid option type. Use 'call' or 'put'.")
+
+        strike_prices = quote_updates['Exercise Price'].to_numpy(dtype=float)
+        positions = self.get_strike_index().find(options_type, strike_prices)
+        if np.any(positions < 0):
+            raise ValueError(f'No {options_type} option at strike(s) {strike_prices[positions < 0].tolist()}')
+
+        quote_columns = [self.get_data_column(quote_updates, column_name).tolist() for column_name in QUOTE_COLUMN_NAMES]
+        updated_options = []
+        for position, quote in zip(positions.tolist(), zip(*quote_columns)):
+            options[position].update_quote(*quote)
+            updated_options.append(options[position])
+        return updated_options
+
     def print_options(self):
         """ Mainly for testing: Used to view the options added to the options data set"""
         print(f'Call options expiring {self.expiration_date} \n')
@@ -223,3 +747,70 @@ class option_data:
             print(f'| {op.strike_price} | {op.curr_cost} | {op.theoretical_price} | {op.greeks.delta} |'
                   f' {op.greeks.gamma} | {op.greeks.theta} | {op.greeks.vega} | {op.implied_volatility} |')
         return
+
+
+# Desc: Columns of an options data set (one side of the chain): strikes, costs, implied vols, theoretical prices
+#       and greeks as arrays. Found for the whole side at once (no row by row parsing):
+#       Implied vols missing from the data are solved for, greeks missing from the data come from the model
+#       (using the implied vol, or the user vol when there is none) and theoretical prices use the user vol.
+# Input: Options data (DataFrame), option type ('call' or 'put'), stock price, annual time to expiration,
+#        interest rate, volatility (user found)
+# Output: Dictionary of arrays: strike_price, cost, implied_volatility, theoretical_price, delta, gamma, theta,
+#         vega, rho
+def generate_option_columns(options_data, options_type, curr_stock_price, annual_time_to_exp, curr_int_rate,
+                            curr_volatility):
+    strike_prices = options_data['Exercise Price'].to_numpy(dtype=float)
+    costs = options_data['Price'].to_numpy(dtype=float)
+    implied_volatilities = option_data.get_data_column(options_data, 'Implied Volatility')
+
+    # Solve for the implied vol of any option the data does not give one for
+    missing_implied_volatility = np.isnan(implied_volatilities)
+    if np.any(missing_implied_volatility):
+        solved_implied_volatilities = implied_volatility_batch(costs, curr_stock_price, strike_prices,
+                                                               annual_time_to_exp, curr_int_rate,
+                                                               options_type == 'call')
+        implied_volatilities = np.where(missing_implied_volatility, np.round(solved_implied_volatilities, 2),
+                                        implied_volatilities)
+
+    # Price the whole chain in one pass of the model instead of once per option
+    theoretical_prices = black_scholes_model_option_price_batch(curr_stock_price, strike_prices, annual_time_to_exp,
+                                                                curr_int_rate, curr_volatility,
+                                                                options_type == 'call')
+
+    # Model greeks use the market (implied) vol like the vendor greeks, or the user vol when there is none
+    greek_volatilities = np.where(np.isnan(implied_volatilities), curr_volatility, implied_volatilities)
+    model_greeks = black_scholes_model_greeks_batch(curr_stock_price, strike_prices, annual_time_to_exp,
+                                                    curr_int_rate, greek_volatilities, options_type == 'call')
+
+    option_columns = {'strike_price': strike_prices, 'cost': costs, 'implied_volatility': implied_volatilities,
+                      'theoretical_price': np.round(theoretical_prices, 2)}
+
+    # Vendor greeks are kept wherever they are given
+    for column_name, model_greek in zip(['Delta', 'Gamma', 'Theta', 'Vega', 'Rho'], model_greeks):
+        vendor_greek = option_data.get_data_column(options_data, column_name)
+        option_columns[column_name.lower()] = np.where(np.isnan(vendor_greek), model_greek, vendor_greek)
+
+    return option_columns
+
+
+# Desc: Create the option objects for the columns of one side of an options chain
+# Input: Option columns (see generate_option_columns), option type, stock price, annual time to expiration,
+#        interest rate, volatility (user found), price range grid policy
+# Output: List of options (option class format)
+def generate_options_from_columns(option_columns, options_type, curr_stock_price, annual_time_to_exp, curr_int_rate,
+                                  curr_volatility, grid_policy=None):
+    options = []
+    for strike_price, cost, implied_volatility, theoretical_price, delta, gamma, theta, vega, rho in zip(
+            *(option_columns[column_name].tolist() for column_name in OPTION_COLUMN_NAMES)):
+        # Set Greeks and Option into Class
+        option_greeks = greeks(delta=delta, gamma=gamma, theta=theta, vega=vega, rho=rho)
+
+        new_option = option(option_type=options_type, strike_price=strike_price, cost=cost,
+                            implied_volatility=implied_volatility, curr_greeks=option_greeks,
+                            curr_stock_price=curr_stock_price, annual_time_to_exp=annual_time_to_exp,
+                            curr_int_rate=curr_int_rate, curr_volatility=curr_volatility, trade=None,
+                            theoretical_price=theoretical_price, grid_policy=grid_policy)
+
+        options.append(new_option)
+
+    return options
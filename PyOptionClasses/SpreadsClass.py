@@ -1,24 +1,49 @@
 from PyOptionClasses.OptionsClass import option, option_data, greeks
+from PricingModels import expiry_payoff_metrics, to_decimal_volatility
 import numpy as np
 import math
 
 
 # Desc: Spread Class to handle different type of option spreads used within trading
+#       The grid policy sets the resolution of the price range (defaults to the policy of the first option)
 class Spread:
-    def __init__(self, options, ratio):
+    def __init__(self, options, ratio, grid_policy=None):
         self.options = options
 
         # Included for ratio spreads
         self.ratio = ratio
 
+        if grid_policy is None:
+            grid_policy = options[0].grid_policy
+        self.grid_policy = grid_policy
+
+        self.refresh()
+
+    def refresh(self):
+        """ Finds the greeks, cost and risk profile of the spread from its options
+            (again after the quotes of its options change, see SpreadBook) """
+        options = self.options
+        grid_policy = self.grid_policy
+
         self.greeks = self.generate_spread_greeks()
-        self.cost = round(sum(op.curr_cost for op in options), 2)
+        # Each leg is weighted by its ratio (quantity)
+        self.cost = round(sum(quantity * op.curr_cost for quantity, op in zip(self.ratio, options)), 2)
 
         # Risk profile of spread
         self.underlying_price = options[0].curr_stock_price
         # Should be the shorter to expiration option
-        self.price_range = options[0].get_standard_deviation_price_move_range()
+        self.price_range = options[0].get_standard_deviation_price_move_range(
+            grid_policy, focus_prices=[op.strike_price for op in options])
         self.payoff_profile = self.calc_spread_profit_payout()
+
+        if grid_policy.mode == 'adaptive':
+            # Break even points are only known once the payoff is found: add them to the focus of the grid
+            break_even_estimates = self.estimate_break_even_points()
+            if break_even_estimates:
+                self.price_range = options[0].get_standard_deviation_price_move_range(
+                    grid_policy, focus_prices=[op.strike_price for op in options] + break_even_estimates)
+                self.payoff_profile = self.calc_spread_profit_payout()
+
         self.max_profit, self.max_loss, self.break_even_points = self.calc_spread_metrics()
 
     def calc_spread_profit_payout(self):
@@ -50,47 +75,64 @@ class Spread:
                 updatedOption.update_time_to_expiration(option.annual_time_to_expiration-min_time_to_exp, self.price_range)
                 updated_option_list.append(updatedOption)
 
-            # Find the total payoff after updating the time to expiration
-            total_payoff_profile = updated_option_list[0].payoff_profile
-            for i in range(1, len(updated_option_list)):
-                total_payoff_profile = [round(x + y, 2) for x, y in
-                                        zip(total_payoff_profile, updated_option_list[i].payoff_profile)]
-                # Used primarily for ratio spreads and if there is a specific ratio for a spread
-                pre_value = total_payoff_profile[0]
-                multiplier = self.ratio[i]
-                total_payoff_profile = [element * multiplier for element in total_payoff_profile]
-
-                # To make sure it worked
-                assert (pre_value * multiplier == total_payoff_profile[0])
+            leg_payoff_profiles = [option.payoff_profile for option in updated_option_list]
 
         else:
-            total_payoff_profile = self.options[0].payoff_profile
-            for i in range(1, len(self.options)):
-                total_payoff_profile = [round(x + y, 2) for x, y in
-                                        zip(total_payoff_profile, self.options[i].payoff_profile)]
-                # Used primarily for ratio spreads and if there is a specific ratio for a spread
-                pre_value = total_payoff_profile[0]
-                multiplier = self.ratio[i]
-                total_payoff_profile = [element * multiplier for element in total_payoff_profile]
-
-                # To make sure it worked
-                assert(pre_value * multiplier == total_payoff_profile[0])
+            leg_payoff_profiles = [self.get_option_payoff_profile(option) for option in self.options]
+
+        # Stack the legs (legs x price range) and weight each leg by its ratio (quantity):
+        # the total payoff is a single matrix-vector product, rounded once
+        total_payoff_profile = np.round(self.get_leg_quantities() @ np.vstack(leg_payoff_profiles), 2)
 
         return total_payoff_profile
 
+    def get_leg_quantities(self):
+        """ Returns the quantity (ratio) of each leg of the spread """
+        return np.asarray(self.ratio, dtype=float)
+
     def calc_spread_metrics(self):
         """ Given the price range and the value for a spread at difference prices:
             It finds the max profit, max loss and break even points for the price range """
-        max_profit = round(max(self.payoff_profile), 2)
-        max_loss = round(min(self.payoff_profile), 2)
+        max_profit = round(self.payoff_profile.max(), 2)
+        max_loss = round(self.payoff_profile.min(), 2)
 
-        break_even_point = [self.price_range[i] for i, payoff in enumerate(self.payoff_profile) if payoff == 0]
+        break_even_point = np.asarray(self.price_range)[self.payoff_profile == 0].tolist()
 
         # risk_reward_ratio = -max_loss / max_profit if max_profit != 0 else None
         # risk_reward_ratio
 
         return max_profit, max_loss, break_even_point
 
+    def get_leg_directions(self):
+        """ Returns the signed quantity of each leg at expiration: the ratio, negative for sold legs """
+        directions = []
+        for quantity, op in zip(self.ratio, self.options):
+            # Trades (see option_trade) carry the sign of the trade in their multiplier
+            contract = getattr(op, 'contract', op)
+            direction = -1 if contract.trade == 'Sold' else 1
+            directions.append(quantity * getattr(op, 'multiplier', 1) * direction)
+        return np.asarray(directions, dtype=float)
+
+    def exact_metrics(self):
+        """ Finds the max profit, max loss, break even points and slopes of the spread at expiration from its
+            legs (see expiry_payoff_metrics): exact, not limited to the price range, and unbounded sides are
+            +inf / -inf. Only for spreads with one expiration (calendar spreads are not piecewise linear). """
+        net_cost = float(self.get_leg_quantities() @ np.asarray([op.curr_cost for op in self.options], dtype=float))
+        return calculate_exact_spread_metrics(self.options, self.get_leg_directions(), net_cost)
+
+    def get_option_payoff_profile(self, option):
+        """ Returns the payoff profile of an option over the price range of the spread, reusing the
+            options own payoff profile when it is over the same price range """
+        if option.price_range is self.price_range or np.array_equal(option.price_range, self.price_range):
+            return option.payoff_profile
+        return option.calculate_payoff_profile(self.price_range, isCalendar=False)
+
+    def estimate_break_even_points(self):
+        """ Finds the prices where the payoff profile crosses zero (between two prices of the price range) """
+        payoff_profile = np.asarray(self.payoff_profile)
+        crossings = np.flatnonzero(np.sign(payoff_profile[:-1]) * np.sign(payoff_profile[1:]) < 0)
+        return [(self.price_range[i] + self.price_range[i + 1]) / 2 for i in crossings.tolist()]
+
     def print_risk_profile(self):
         """ Used for testing: To print out the different price range, payoff profile,
             max profit, max loss and break even points. """
@@ -102,22 +144,83 @@ class Spread:
         return
 
     def generate_spread_greeks(self):
-        """ Used to get the greeks for a spread: Summing the greeks
-            of each option together and storing in a spread greek profile"""
+        """ Used to get the greeks for a spread: Summing the greeks of each option
+            (times its ratio) together and storing in a spread greek profile"""
 
         # Delta, Gamma, Theta, Vega, Rho
         delta, gamma, theta, vega, rho = 0, 0, 0, 0, 0
 
-        for op in self.options:
-            delta += op.greeks.delta
-            gamma += op.greeks.gamma
-            theta += op.greeks.theta
-            vega += op.greeks.vega
-            rho += op.greeks.rho
+        for quantity, op in zip(self.ratio, self.options):
+            delta += quantity * op.greeks.delta
+            gamma += quantity * op.greeks.gamma
+            theta += quantity * op.greeks.theta
+            vega += quantity * op.greeks.vega
+            rho += quantity * op.greeks.rho
 
         return greeks(round(delta, 4), round(gamma, 4), round(theta, 4), round(vega, 4), round(rho, 4))
 
 
+# Desc: Exact expiry metrics of the legs of a spread (see expiry_payoff_metrics)
+# Input: Legs (options or option trades), signed quantity of each leg, net cost of the legs
+# Output: Max profit, max loss (+inf / -inf when unbounded), break even points (rounded to 2) and slopes
+def calculate_exact_spread_metrics(legs, quantities, net_cost):
+    if any(op.annual_time_to_expiration != legs[0].annual_time_to_expiration for op in legs):
+        raise ValueError("Exact metrics need every leg to expire together (not a calendar spread).")
+
+    max_profit, max_loss, break_even_points, slopes = expiry_payoff_metrics([op.strike_price for op in legs],
+                                                                            quantities,
+                                                                            [op.option_type == 'call' for op in legs],
+                                                                            net_cost)
+    return round(max_profit, 2), round(max_loss, 2), [round(price, 2) for price in break_even_points], slopes
+
+
+# Desc: Book of spreads kept up to date with quote changes of their options
+#       Keeps a reverse index of the spreads using each option (contract), so a quote change only refreshes
+#       the spreads with the updated options as legs instead of finding every spread again.
+class SpreadBook:
+    def __init__(self, spreads=()):
+        self.spreads = []
+        # id of option contract -> positions of the spreads using it
+        self.spreads_by_option = {}
+        self.add_spreads(spreads)
+
+    def add_spreads(self, spreads):
+        """ Adds spreads to the book (and their options to the reverse index) """
+        for spread in spreads:
+            position = len(self.spreads)
+            self.spreads.append(spread)
+            for op in spread.options:
+                self.spreads_by_option.setdefault(id(self.get_contract(op)), set()).add(position)
+        return
+
+    @staticmethod
+    def get_contract(op):
+        """ Returns the option contract of a leg (option trades reference their contract) """
+        return getattr(op, 'contract', op)
+
+    def get_affected_spreads(self, updated_options):
+        """ Returns the spreads using any of the updated options (in the order they were added) """
+        positions = set()
+        for op in updated_options:
+            positions.update(self.spreads_by_option.get(id(self.get_contract(op)), ()))
+        return [self.spreads[position] for position in sorted(positions)]
+
+    def refresh_spreads(self, updated_options):
+        """ Refreshes only the spreads using the updated options, returns the refreshed spreads """
+        affected_spreads = self.get_affected_spreads(updated_options)
+        for spread in affected_spreads:
+            spread.refresh()
+        return affected_spreads
+
+    def update_quotes(self, ops_data, options_type, quote_updates):
+        """ Applies a batch of quote changes to the options data (see option_data.update_quotes) and refreshes the
+            spreads using the updated options. Returns the refreshed spreads. """
+        return self.refresh_spreads(ops_data.update_quotes(options_type, quote_updates))
+
+    def __len__(self):
+        return len(self.spreads)
+
+
 class Straddle(Spread):
     """ Straddle spread: Consist of a call and put @ same exercise price and same expiration date.
         Characteristics:
@@ -319,7 +422,8 @@ class RatioSpread(Spread):
         self.ratio_range = ratio_range
         self.expiration = expiration
 
-    def get_whole_num_ratio(self, option_1, option_2):
+    @staticmethod
+    def get_whole_num_ratio(option_1, option_2):
         numerator = int(abs(option_1.greeks.delta * 100))
         denominator = int(abs(option_2.greeks.delta * 100))
 
@@ -390,3 +494,151 @@ class CalenderSpread(Spread):
             f'{self.option_2.strike_price}, Cost: {self.option_2.curr_cost}, Greeks '
             f'{self.option_2.greeks.get_greeks()}, at expiration {self.expiration_2} {self.option_2.annual_time_to_expiration}')
         print(f'Calender Spread, Cost: {self.cost}, Greeks {self.greeks.get_greeks()} \n')
+
+
+# Desc: Spread candidate: the legs (option contracts and trades) of a spread before the spread is built
+#       The cost, greeks and exact expiry metrics are found from the quotes of the legs only, so candidates can be
+#       screened before building their spread (option trades, price range and payoff profile) with build().
+#       build() calls spread_class(*leading_args, *legs, *trailing_args) i.e. Butterfly(range, o1, o2, o2, o3, exp)
+class SpreadCandidate:
+    __slots__ = ('spread_class', 'contracts', 'trades', 'leading_args', 'trailing_args', '_ratio', '_spread')
+
+    def __init__(self, spread_class, contracts, trades, leading_args=(), trailing_args=()):
+        self.spread_class = spread_class
+        self.contracts = contracts
+        self.trades = trades
+        self.leading_args = leading_args
+        self.trailing_args = trailing_args
+        self._ratio = None
+        self._spread = None
+
+    @property
+    def ratio(self):
+        """ Quantity of each leg of the spread (ratio spreads weight their legs by delta) """
+        if self._ratio is None:
+            if issubclass(self.spread_class, RatioSpread):
+                self._ratio = list(RatioSpread.get_whole_num_ratio(*self.contracts))
+            else:
+                self._ratio = [1] * len(self.contracts)
+        return self._ratio
+
+    @property
+    def strike_prices(self):
+        return [op.strike_price for op in self.contracts]
+
+    def get_leg_quantities(self):
+        """ Returns the signed quantity of each leg: the ratio, negative for sold legs """
+        return np.asarray([-quantity if trade == 'Sold' else quantity
+                           for quantity, trade in zip(self.ratio, self.trades)], dtype=float)
+
+    @property
+    def cost(self):
+        """ Cost of the spread (same as the cost of the built spread) """
+        return round(float(self.get_leg_quantities() @ np.asarray([op.curr_cost for op in self.contracts],
+                                                                  dtype=float)), 2)
+
+    @property
+    def greeks(self):
+        """ Greeks of the spread (same as the greeks of the built spread) """
+        delta, gamma, theta, vega, rho = 0, 0, 0, 0, 0
+        for quantity, op in zip(self.get_leg_quantities().tolist(), self.contracts):
+            delta += quantity * op.greeks.delta
+            gamma += quantity * op.greeks.gamma
+            theta += quantity * op.greeks.theta
+            vega += quantity * op.greeks.vega
+            rho += quantity * op.greeks.rho
+
+        return greeks(round(delta, 4), round(gamma, 4), round(theta, 4), round(vega, 4), round(rho, 4))
+
+    def exact_metrics(self):
+        """ Exact expiry metrics of the spread (see Spread.exact_metrics) without building it """
+        quantities = self.get_leg_quantities()
+        net_cost = float(quantities @ np.asarray([op.curr_cost for op in self.contracts], dtype=float))
+        return calculate_exact_spread_metrics(self.contracts, quantities, net_cost)
+
+    @property
+    def is_calendar(self):
+        """ True when the legs expire at different times (no exact expiry metrics) """
+        return any(op.annual_time_to_expiration != self.contracts[0].annual_time_to_expiration
+                   for op in self.contracts)
+
+    def build(self):
+        """ Builds the spread: trades of the contracts and the spreads risk profile
+            (once, a spread built to screen the candidate is used again) """
+        if self._spread is None:
+            legs = [op.create_option_trade(trade) for op, trade in zip(self.contracts, self.trades)]
+            self._spread = self.spread_class(*self.leading_args, *legs, *self.trailing_args)
+        return self._spread
+
+
+# Desc: Constraints to screen spread candidates with (a candidate filter, see FindingSpreads.iterSpreads)
+#       i.e. getButterflySpreads(ops_data, 2, SpreadConstraints(cost_range=(0, 1), delta_range=(-0.1, 0.1)))
+#       cost_range:             (lowest, highest) cost of the spread (negative for a credit), None for no limit
+#       max_loss:               worst max loss allowed at expiration (i.e. -2 for losing at most 2)
+#       min_max_profit:         least max profit at expiration
+#       delta_range/vega_range: (lowest, highest) delta / vega of the spread
+#       max_strike_deviations:  every strike within k standard deviations of the stock price
+#                               (stock price * vol * sqrt(time to expiration))
+#       Checks are done cheapest first, and the first failing check rejects the candidate: the cost and strikes,
+#       then the greeks (from the quotes of the legs), then the exact expiry metrics (only when the max loss or
+#       max profit is limited). Nothing of the spread is built for a candidate rejected by these checks.
+#       Calendar spreads have no exact expiry metrics: their max loss / max profit are checked on the price range of
+#       the built spread (which is then used as the spread of the candidate, see SpreadCandidate.build).
+class SpreadConstraints:
+    def __init__(self, cost_range=None, max_loss=None, min_max_profit=None, delta_range=None, vega_range=None,
+                 max_strike_deviations=None):
+        for value_range in (cost_range, delta_range, vega_range):
+            assert value_range is None or len(value_range) == 2
+        assert max_strike_deviations is None or max_strike_deviations >= 0
+
+        self.cost_range = cost_range
+        self.max_loss = max_loss
+        self.min_max_profit = min_max_profit
+        self.delta_range = delta_range
+        self.vega_range = vega_range
+        self.max_strike_deviations = max_strike_deviations
+
+    @staticmethod
+    def is_within(value, value_range):
+        """ Checks a value is within a (lowest, highest) range (either can be None for no limit) """
+        lowest, highest = value_range
+        return (lowest is None or value >= lowest) and (highest is None or value <= highest)
+
+    def check_quotes(self, candidate):
+        """ Checks the constraints found from the quotes and strikes of the legs only """
+        if self.cost_range is not None and not self.is_within(candidate.cost, self.cost_range):
+            return False
+
+        if self.max_strike_deviations is not None:
+            for op in candidate.contracts:
+                standard_deviation = (op.curr_stock_price * to_decimal_volatility(op.current_volatility) *
+                                      math.sqrt(op.annual_time_to_expiration))
+                if abs(op.strike_price - op.curr_stock_price) > self.max_strike_deviations * standard_deviation:
+                    return False
+
+        if self.delta_range is not None or self.vega_range is not None:
+            spread_greeks = candidate.greeks
+            if self.delta_range is not None and not self.is_within(spread_greeks.delta, self.delta_range):
+                return False
+            if self.vega_range is not None and not self.is_within(spread_greeks.vega, self.vega_range):
+                return False
+        return True
+
+    def check_metrics(self, candidate):
+        """ Checks the constraints on the exact expiry metrics of the spread (price range metrics for calendars) """
+        if self.max_loss is None and self.min_max_profit is None:
+            return True
+
+        if candidate.is_calendar:
+            spread = candidate.build()
+            max_profit, max_loss = spread.max_profit, spread.max_loss
+        else:
+            max_profit, max_loss, _, _ = candidate.exact_metrics()
+        if self.max_loss is not None and max_loss < self.max_loss:
+            return False
+        if self.min_max_profit is not None and max_profit < self.min_max_profit:
+            return False
+        return True
+
+    def __call__(self, candidate):
+        return self.check_quotes(candidate) and self.check_metrics(candidate)
@@ -0,0 +1,165 @@
+from PyOptionClasses.OptionChainClass import OptionChain
+from PricingModels import black_scholes_model_option_price_batch, LRUCache
+import numpy as np
+
+
+# Desc: Implied volatility surface (strike x time) of one underlying built from the options data of many
+#       expiration dates. Each expiration is a smile of the implied vols of the out of the money options
+#       (puts below the stock price, calls above). Vols are interpolated linearly in strike within an expiration
+#       and linearly in total variance (vol^2 * time) between expirations: flat in strike outside the strikes of an
+#       expiration, and constant vol before the first / after the last expiration.
+#       The smiles are built once, vol lookups are vectorized and cached (by the strikes and times asked for).
+#       Vols are in percent (18 = 18%) like the rest of the options data.
+class VolatilitySurface:
+    def __init__(self, options_data_list, cache_size=256):
+        assert len(options_data_list) > 0
+
+        self.options_data_list = sorted(options_data_list, key=lambda ops_data: ops_data.annual_time_to_expiration)
+        self.current_stock_price = self.options_data_list[0].current_stock_price
+        self.volatility_cache = LRUCache(max_size=cache_size)
+        self.build_surface()
+
+    def build_surface(self):
+        """ Builds the smile of each expiration from the implied vols of the options data
+            (call again after refreshing the implied vols of the options data) """
+        self.expiration_dates = []
+        self.annual_times_to_expiration = []
+        self.smile_strikes = []
+        self.smile_total_variances = []
+
+        for ops_data in self.options_data_list:
+            strikes, implied_volatilities = self.get_smile(ops_data)
+            if len(strikes) == 0:
+                continue
+            annual_time_to_exp = ops_data.annual_time_to_expiration
+            self.expiration_dates.append(ops_data.expiration_date)
+            self.annual_times_to_expiration.append(annual_time_to_exp)
+            self.smile_strikes.append(strikes)
+            self.smile_total_variances.append((implied_volatilities / 100) ** 2 * annual_time_to_exp)
+
+        assert len(self.annual_times_to_expiration) > 0, 'No implied volatilities to build the surface from'
+        self.annual_times_to_expiration = np.array(self.annual_times_to_expiration, dtype=float)
+        self.volatility_cache.clear()
+        return
+
+    def get_smile(self, ops_data):
+        """ Returns the strikes and implied vols of the smile of an expiration: the out of the money option at
+            each strike (puts below the stock price, calls above), or the other option when it has no implied vol """
+        if isinstance(ops_data, OptionChain):
+            strike_prices, implied_volatilities = ops_data.strike_prices, ops_data.implied_volatilities
+            is_call = ops_data.is_call
+        else:
+            options = ops_data.options_calls + ops_data.options_puts
+            strike_prices = np.array([op.strike_price for op in options], dtype=float)
+            implied_volatilities = np.array([op.implied_volatility for op in options], dtype=float)
+            is_call = np.array([op.option_type == 'call' for op in options])
+
+        valid = np.isfinite(implied_volatilities) & (implied_volatilities > 0) & (ops_data.annual_time_to_expiration > 0)
+        strike_prices, implied_volatilities, is_call = strike_prices[valid], implied_volatilities[valid], is_call[valid]
+
+        # Out of the money options first, so they are kept for strikes with a call and a put
+        out_of_the_money = np.where(is_call, strike_prices >= ops_data.current_stock_price,
+                                    strike_prices < ops_data.current_stock_price)
+        order = np.lexsort((~out_of_the_money, strike_prices))
+        strike_prices, implied_volatilities = strike_prices[order], implied_volatilities[order]
+        strikes, first_of_strike = np.unique(strike_prices, return_index=True)
+        return strikes, implied_volatilities[first_of_strike]
+
+    def get_total_variance(self, strike_prices, annual_times_to_exp):
+        """ Returns the interpolated total variance (decimal vol^2 * time) at each strike and time """
+        strike_prices, annual_times_to_exp = np.broadcast_arrays(np.asarray(strike_prices, dtype=float),
+                                                                 np.asarray(annual_times_to_exp, dtype=float))
+
+        # Total variance of every expiration at the strikes (one row per expiration)
+        expiration_variances = np.array([np.interp(strike_prices, strikes, total_variances)
+                                         for strikes, total_variances in zip(self.smile_strikes,
+                                                                             self.smile_total_variances)])
+        expiration_times = self.annual_times_to_expiration
+
+        # Expirations on each side of the times (the same expiration outside the expirations of the surface)
+        upper = np.clip(np.searchsorted(expiration_times, annual_times_to_exp), 0, len(expiration_times) - 1)
+        lower = np.clip(upper - 1, 0, len(expiration_times) - 1)
+        lower = np.where(annual_times_to_exp <= expiration_times[0], upper, lower)
+        upper = np.where(annual_times_to_exp >= expiration_times[-1], len(expiration_times) - 1, upper)
+        lower = np.where(annual_times_to_exp >= expiration_times[-1], len(expiration_times) - 1, lower)
+
+        lower_variance = np.take_along_axis(expiration_variances, lower[np.newaxis], axis=0)[0]
+        upper_variance = np.take_along_axis(expiration_variances, upper[np.newaxis], axis=0)[0]
+        lower_time, upper_time = expiration_times[lower], expiration_times[upper]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(upper_time > lower_time, (annual_times_to_exp - lower_time) / (upper_time - lower_time), 0)
+            total_variance = lower_variance + weight * (upper_variance - lower_variance)
+            # Constant vol outside the expirations of the surface
+            total_variance = np.where(upper == lower, lower_variance * annual_times_to_exp / lower_time,
+                                      total_variance)
+        return total_variance
+
+    def get_volatility(self, strike_prices, annual_times_to_exp):
+        """ Returns the implied vol (percent) of the surface at each strike and time (arrays or floats).
+            Lookups are cached, so asking for the vols of the same chain again does not interpolate again. """
+        strike_prices = np.asarray(strike_prices, dtype=float)
+        annual_times_to_exp = np.asarray(annual_times_to_exp, dtype=float)
+        key = (strike_prices.shape, strike_prices.tobytes(), annual_times_to_exp.shape, annual_times_to_exp.tobytes())
+
+        volatilities = self.volatility_cache.get_or_compute(key, lambda: self.calculate_volatility(
+            strike_prices, annual_times_to_exp))
+        if volatilities.ndim == 0:
+            return float(volatilities)
+        return volatilities
+
+    def calculate_volatility(self, strike_prices, annual_times_to_exp):
+        """ Interpolates the implied vol (percent) at each strike and time (see get_volatility) """
+        # Expired options use the vols of the first expiration
+        annual_times_to_exp = np.where(annual_times_to_exp > 0, annual_times_to_exp,
+                                       self.annual_times_to_expiration[0])
+        total_variance = self.get_total_variance(strike_prices, annual_times_to_exp)
+        volatilities = np.sqrt(total_variance / annual_times_to_exp) * 100
+        # Cached arrays are shared between lookups
+        volatilities.setflags(write=False)
+        return volatilities
+
+    def price_options(self, strike_prices, annual_times_to_exp, curr_int_rate, is_call, curr_stock_price=None):
+        """ Returns the black-scholes price of options using the vols of the surface (i.e. revaluing options for a
+            new stock price or time with the vols of their strikes) """
+        if curr_stock_price is None:
+            curr_stock_price = self.current_stock_price
+        volatilities = self.get_volatility(strike_prices, annual_times_to_exp)
+        return black_scholes_model_option_price_batch(curr_stock_price, strike_prices, annual_times_to_exp,
+                                                      curr_int_rate, volatilities, is_call)
+
+    def apply_to_options_data(self, ops_data):
+        """ Sets the model vol of every option of the options data to the vol of the surface at its strike and
+            expiration, and prices the options again with it (so spreads, including calendar spreads, use the
+            vols of the smile). The users vol (current_volatility, which also sets the width of the price ranges
+            shared by the options of an expiration) and the implied vols of the options are unchanged.
+            An OptionChain only has its columns updated: option objects are not created for it, the ones created
+            later read the model vols and prices from the columns. """
+        if isinstance(ops_data, OptionChain):
+            volatilities = self.get_volatility(ops_data.strike_prices, ops_data.annual_time_to_expiration)
+            theoretical_prices = black_scholes_model_option_price_batch(ops_data.current_stock_price,
+                                                                        ops_data.strike_prices,
+                                                                        ops_data.annual_time_to_expiration,
+                                                                        ops_data.current_interest_rate, volatilities,
+                                                                        ops_data.is_call)
+            ops_data.model_volatilities = np.round(volatilities, 2)
+            ops_data.theoretical_prices = np.round(theoretical_prices, 2)
+            # Option objects already created (i.e. used by spreads) are updated from the columns
+            ops_data.sync_options()
+            return
+
+        for options in ops_data.get_options():
+            if not options:
+                continue
+            strike_prices = np.array([op.strike_price for op in options], dtype=float)
+            volatilities = self.get_volatility(strike_prices, ops_data.annual_time_to_expiration)
+            theoretical_prices = black_scholes_model_option_price_batch(ops_data.current_stock_price, strike_prices,
+                                                                        ops_data.annual_time_to_expiration,
+                                                                        ops_data.current_interest_rate, volatilities,
+                                                                        options[0].option_type == 'call')
+
+            for op, volatility, theoretical_price in zip(options, np.round(volatilities, 2).tolist(),
+                                                         np.round(theoretical_prices, 2).tolist()):
+                op.theoretical_price = theoretical_price
+                op.model_volatility = volatility
+        return
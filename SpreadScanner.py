@@ -0,0 +1,345 @@
+from FindingSpreads import (iterStraddleCandidates, iterStrangleCandidates, iterButterflyCandidates,
+                            iterCondorCandidates, iterIronCondorCandidates, iterRatioCandidates,
+                            iterChristmasTreeCandidates)
+from PricingModels import expiry_payoff_metrics_batch
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import itertools
+import math
+import numpy as np
+
+# Strategies of one options chain that can be scanned: name -> spread candidates of the chain (see FindingSpreads)
+# Scans are (strategy, arguments after the options data) i.e. ('condor', (inner_range, outer_range))
+SPREAD_STRATEGIES = {
+    'straddle': iterStraddleCandidates,
+    'strangle': iterStrangleCandidates,
+    'butterfly': iterButterflyCandidates,
+    'condor': iterCondorCandidates,
+    'iron_condor': iterIronCondorCandidates,
+    'ratio': iterRatioCandidates,
+    'christmas_tree': iterChristmasTreeCandidates,
+}
+
+# Options data of the scan, set once in each worker process (see init_scan_worker)
+_scan_options_data = None
+
+
+# Desc: Candidates function of a strategy (see SPREAD_STRATEGIES)
+# Input: Strategy name
+# Output: Function of the options data, arguments of the strategy and range of base strikes -> spread candidates
+def get_scan_strategy(strategy):
+    if strategy not in SPREAD_STRATEGIES:
+        raise ValueError(f"Invalid strategy '{strategy}'. Use one of {', '.join(SPREAD_STRATEGIES)}.")
+    return SPREAD_STRATEGIES[strategy]
+
+
+# Desc: Spread candidates of one scan of an options chain
+# Input: Options data, strategy (see SPREAD_STRATEGIES), arguments of the strategy, range of the base strikes to
+#        scan (start, stop) (None for every strike)
+# Output: Generator of spread candidates
+def iter_scan_candidates(ops_data, strategy, strategy_args=(), strike_range=None):
+    return get_scan_strategy(strategy)(ops_data, *strategy_args, strike_range=strike_range)
+
+
+# Desc: Keep the options data of the scan in a worker process (initializer of the process pool), so the chain is
+#       sent to each worker once instead of with every part of the scan. Workers only read the chain.
+# Input: Options data
+# Output: None
+def init_scan_worker(ops_data):
+    global _scan_options_data
+    _scan_options_data = ops_data
+
+
+# Desc: Scan one part of the scan space: the candidates of the base strikes start to stop of a (strategy,
+#       arguments) scan (only the candidates of the part are found)
+# Input: Options data, strategy, arguments of the strategy, first and last (excluded) base strike, filter of the
+#        candidates, function of the built spreads (None to keep the spreads)
+# Output: List of the results of the candidates passing the filter
+def scan_candidates(ops_data, strategy, strategy_args, start, stop, candidate_filter=None, spread_function=None):
+    results = []
+    for candidate in iter_scan_candidates(ops_data, strategy, strategy_args, (start, stop)):
+        if candidate_filter is not None and not candidate_filter(candidate):
+            continue
+        spread = candidate.build()
+        results.append(spread if spread_function is None else spread_function(spread))
+    return results
+
+
+# Desc: Scan one part of the scan space in a worker process (with the options data of init_scan_worker)
+# Input: Part of the scan (scan number, strategy, arguments, first and last base strike), filter, spread function
+# Output: Scan number, first candidate of the part and the results of scan_candidates
+def scan_worker_part(scan_part, candidate_filter, spread_function):
+    scan_number, strategy, strategy_args, start, stop = scan_part
+    return scan_number, start, scan_candidates(_scan_options_data, strategy, strategy_args, start, stop,
+                                               candidate_filter, spread_function)
+
+
+# Desc: Split the scans of an options chain into parts of at most part_size base strikes
+#       (one part per (strategy, arguments, range of strikes)). Candidates are not found here: each part only
+#       finds its own candidates (see scan_candidates), in the order of the whole scan.
+# Input: Options data, scans [(strategy, arguments)], base strikes per part
+# Output: List of parts (scan number, strategy, arguments, first base strike, last base strike (excluded))
+def partition_scans(ops_data, scans, part_size):
+    assert part_size > 0
+    num_strikes = len(ops_data.get_strike_index().strikes)
+    scan_parts = []
+    for scan_number, (strategy, strategy_args) in enumerate(scans):
+        get_scan_strategy(strategy)
+        for start in range(0, num_strikes, part_size):
+            scan_parts.append((scan_number, strategy, tuple(strategy_args), start,
+                               min(start + part_size, num_strikes)))
+    return scan_parts
+
+
+# Desc: Scan the spreads of many strategies and widths of one options chain in parallel: the scans are split by
+#       (strategy, arguments, range of strikes) across a process pool. Each worker gets the options chain once
+#       (read only) and builds the spreads of its parts. Results are merged in the order of the scans and of the
+#       candidates, so they are the same for any number of workers (and the same as the get*Spreads functions).
+#       The candidate filter and spread function are sent to the workers, so they must be picklable
+#       (module level functions or instances of module level classes, not lambdas). Spreads built by the workers
+#       are copies: their legs are copies of the options of the chain (use a spread function to return only the
+#       metrics needed).
+# Input: Options data, scans [(strategy, arguments)] i.e. [('butterfly', (2,)), ('condor', (2, 2))], filter of
+#        the candidates (candidate -> bool), function of the built spreads (i.e. to return metrics instead of the
+#        spreads, None to return the spreads), number of processes (None for every core, 1 to scan in this
+#        process), base strikes per part of the scan
+# Output: List of the results (spreads or spread function results) of every scan
+def scan_spreads_parallel(ops_data, scans, candidate_filter=None, spread_function=None, max_workers=None,
+                          part_size=16):
+    scan_parts = partition_scans(ops_data, scans, part_size)
+
+    if max_workers == 1:
+        part_results = [(scan_number, start, scan_candidates(ops_data, strategy, strategy_args, start, stop,
+                                                             candidate_filter, spread_function))
+                        for scan_number, strategy, strategy_args, start, stop in scan_parts]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_scan_worker,
+                                 initargs=(ops_data,)) as executor:
+            # Parts are returned in the order of scan_parts whichever worker finishes first
+            part_results = list(executor.map(scan_worker_part, scan_parts, itertools.repeat(candidate_filter),
+                                             itertools.repeat(spread_function)))
+
+    return [result for _, _, results in part_results for result in results]
+
+
+# Desc: Metric to rank spreads by (higher scores rank first)
+#       score(candidate, max_profit, max_loss): score of a spread candidate from its exact expiry metrics
+#       (-inf to leave it out of the ranking)
+#       bound(candidate): optimistic score (never below the score) from the quotes and strikes of the legs only,
+#       so candidates that cannot enter the top K are skipped before their metrics are found
+#       uses_metrics: False when the score only needs the quotes (the exact metrics are not found)
+class RankingMetric:
+    def __init__(self, name, score, bound, uses_metrics=True):
+        self.name = name
+        self.score = score
+        self.bound = bound
+        self.uses_metrics = uses_metrics
+
+
+# Desc: Cheap bounds of the expiry metrics of a spread candidate from its strikes and the quotes of its legs:
+#       the payoff at 0 and at the lowest and highest strikes, the slope above the highest strike and the most the
+#       payoff can rise between the lowest and highest strikes (sum of the quantities * strike width)
+#       The bounds are rounded to 2 like the exact metrics (see get_candidate_metrics_batch), so they are never below
+#       the scores found from the rounded metrics (i.e. a max loss of -0.004 is a max loss of 0)
+# Input: Spread candidate
+# Output: Upper bound of the max profit, upper bound of the max loss (-inf when the loss is unbounded)
+def get_candidate_payoff_bounds(candidate):
+    quantities = candidate.get_leg_quantities().tolist()
+    strike_prices = candidate.strike_prices
+    is_call = [op.option_type == 'call' for op in candidate.contracts]
+    net_cost = sum(quantity * op.curr_cost for quantity, op in zip(quantities, candidate.contracts))
+
+    def get_payoff(stock_price):
+        return sum(quantity * (max(stock_price - strike_price, 0) if call else max(strike_price - stock_price, 0))
+                   for quantity, strike_price, call in zip(quantities, strike_prices, is_call)) - net_cost
+
+    lowest_strike, highest_strike = min(strike_prices), max(strike_prices)
+    payoffs = (get_payoff(0), get_payoff(lowest_strike), get_payoff(highest_strike))
+    upper_slope = sum(quantity for quantity, call in zip(quantities, is_call) if call)
+
+    if upper_slope > 0:
+        max_profit_bound = math.inf
+    else:
+        # The payoff is linear below the lowest strike, and changes by at most the sum of the quantities per
+        # dollar between the strikes
+        max_rise = sum(abs(quantity) for quantity in quantities) * (highest_strike - lowest_strike)
+        max_profit_bound = max(max(payoffs), (payoffs[1] + payoffs[2] + max_rise) / 2)
+    max_loss_bound = -math.inf if upper_slope < 0 else min(payoffs)
+    return float(np.round(max_profit_bound, 2)), float(np.round(max_loss_bound, 2))
+
+
+def score_reward_risk(candidate, max_profit, max_loss):
+    if max_loss == -math.inf:
+        return -math.inf
+    if max_loss >= 0:
+        return math.inf
+    return max_profit / -max_loss
+
+
+def bound_reward_risk(candidate):
+    max_profit_bound, max_loss_bound = get_candidate_payoff_bounds(candidate)
+    if max_loss_bound == -math.inf:
+        return -math.inf
+    if max_loss_bound >= 0:
+        return math.inf
+    return max(max_profit_bound, 0) / -max_loss_bound
+
+
+def score_max_loss(candidate, max_profit, max_loss):
+    return max_loss
+
+
+def bound_max_loss(candidate):
+    return get_candidate_payoff_bounds(candidate)[1]
+
+
+def score_cost_per_theta(candidate, max_profit=None, max_loss=None):
+    # Cost paid per unit of theta earned (lower is better), only for spreads earning theta
+    theta = candidate.greeks.theta
+    if theta <= 0:
+        return -math.inf
+    return -candidate.cost / theta
+
+
+# Metrics to rank spreads by: reward / risk (max profit / max loss), max loss (the smallest first) and cost per
+# unit of theta (the cheapest theta first)
+RANKING_METRICS = {
+    'reward_risk': RankingMetric('reward_risk', score_reward_risk, bound_reward_risk),
+    'max_loss': RankingMetric('max_loss', score_max_loss, bound_max_loss),
+    'cost_per_theta': RankingMetric('cost_per_theta', score_cost_per_theta, score_cost_per_theta,
+                                    uses_metrics=False),
+}
+
+
+# Desc: Ranking metric of a name (see RANKING_METRICS) or the ranking metric given
+# Input: Name of the metric or RankingMetric
+# Output: RankingMetric
+def get_ranking_metric(metric):
+    if isinstance(metric, RankingMetric):
+        return metric
+    if metric not in RANKING_METRICS:
+        raise ValueError(f"Invalid ranking metric '{metric}'. Use one of {', '.join(RANKING_METRICS)}.")
+    return RANKING_METRICS[metric]
+
+
+# Desc: Exact expiry max profit and max loss of many spread candidates at once (see expiry_payoff_metrics_batch)
+#       Candidates with fewer legs are padded with legs of quantity 0
+# Input: List of spread candidates
+# Output: Max profit and max loss of each candidate (rounded to 2 like Spread.exact_metrics)
+def get_candidate_metrics_batch(candidates):
+    num_legs = max(len(candidate.contracts) for candidate in candidates)
+    strike_prices = np.zeros((len(candidates), num_legs))
+    quantities = np.zeros((len(candidates), num_legs))
+    is_call = np.zeros((len(candidates), num_legs), dtype=bool)
+    net_costs = np.zeros(len(candidates))
+    for i, candidate in enumerate(candidates):
+        leg_quantities = candidate.get_leg_quantities()
+        num_candidate_legs = len(leg_quantities)
+        strike_prices[i] = candidate.strike_prices[0]
+        strike_prices[i, :num_candidate_legs] = candidate.strike_prices
+        quantities[i, :num_candidate_legs] = leg_quantities
+        is_call[i, :num_candidate_legs] = [op.option_type == 'call' for op in candidate.contracts]
+        net_costs[i] = leg_quantities @ np.asarray([op.curr_cost for op in candidate.contracts], dtype=float)
+
+    max_profit, max_loss, _, _ = expiry_payoff_metrics_batch(strike_prices, quantities, is_call, net_costs)
+    return np.round(max_profit, 2).tolist(), np.round(max_loss, 2).tolist()
+
+
+# Desc: Top K spread candidates by a metric kept in a bounded heap (the worst of the top K first). Candidates are
+#       checked in batches: the filter, then the optimistic bound of the metric against the worst score of the top
+#       K (candidates that cannot enter the top K are skipped), then the exact metrics of the rest in one call.
+#       No spread (price range or payoff profile) is built. Ties keep the candidate found first.
+# Input: Numbered spread candidates [(number, candidate)] in order of their numbers, metric (name or
+#        RankingMetric), number of candidates to keep, filter of the candidates, candidates per batch
+# Output: List of (score, number, candidate), best first
+def rank_candidates(numbered_candidates, metric, top_k, candidate_filter=None, batch_size=256):
+    assert top_k > 0
+    metric = get_ranking_metric(metric)
+    numbered_candidates = iter(numbered_candidates)
+    top_candidates = []
+
+    while True:
+        batch = list(itertools.islice(numbered_candidates, batch_size))
+        if not batch:
+            break
+
+        # Candidates found later lose ties, so only a better bound than the worst of a full top K can enter it
+        worst_top_score = top_candidates[0][0] if len(top_candidates) == top_k else -math.inf
+        batch = [(number, candidate) for number, candidate in batch
+                 if (candidate_filter is None or candidate_filter(candidate))
+                 and metric.bound(candidate) > worst_top_score]
+        if not batch:
+            continue
+
+        if metric.uses_metrics:
+            max_profits, max_losses = get_candidate_metrics_batch([candidate for _, candidate in batch])
+        else:
+            max_profits = max_losses = [None] * len(batch)
+
+        for (number, candidate), max_profit, max_loss in zip(batch, max_profits, max_losses):
+            score = metric.score(candidate, max_profit, max_loss)
+            if score == -math.inf or score != score:
+                continue
+            entry = (score, -number, candidate)
+            if len(top_candidates) < top_k:
+                heapq.heappush(top_candidates, entry)
+            elif entry[:2] > top_candidates[0][:2]:
+                heapq.heapreplace(top_candidates, entry)
+
+    top_candidates.sort(key=lambda entry: entry[:2], reverse=True)
+    return [(score, -negative_number, candidate) for score, negative_number, candidate in top_candidates]
+
+
+# Desc: Rank one part of the scan space in a worker process (with the options data of init_scan_worker)
+# Input: Part of the scan, metric name, top K, filter
+# Output: List of (score, (scan number, first base strike, last base strike, number in the part)) of the top K
+#         candidates of the part (the keys are in the order of the candidates over every scan)
+def rank_worker_part(scan_part, metric, top_k, candidate_filter):
+    scan_number, strategy, strategy_args, start, stop = scan_part
+    numbered_candidates = enumerate(iter_scan_candidates(_scan_options_data, strategy, strategy_args, (start, stop)))
+    return [(score, (scan_number, start, stop, number))
+            for score, number, _ in rank_candidates(numbered_candidates, metric, top_k, candidate_filter)]
+
+
+# Desc: Candidates of every scan of an options chain numbered in order (over every scan)
+# Input: Options data, scans [(strategy, arguments)]
+# Output: Generator of (number, candidate)
+def iter_numbered_candidates(ops_data, scans):
+    return enumerate(itertools.chain.from_iterable(iter_scan_candidates(ops_data, strategy, strategy_args)
+                                                   for strategy, strategy_args in scans))
+
+
+# Desc: Best K spreads of many strategies and widths of an options chain by a metric: 'reward_risk' (max profit /
+#       max loss), 'max_loss' (smallest loss) or 'cost_per_theta' (cheapest theta). Candidates are ranked from
+#       their quotes and exact expiry metrics with a bounded heap (see rank_candidates), and only the spreads of
+#       the top K are built. With more than one worker the scan is split across a process pool like
+#       scan_spreads_parallel, and the top K of each part are merged (the same results for any number of workers).
+# Input: Options data, scans [(strategy, arguments)], metric (name, or RankingMetric with one worker), number of
+#        spreads to keep, filter of the candidates (picklable with more than one worker), number of processes
+#        (None for every core), base strikes per part of the scan
+# Output: List of (score, spread), best first
+def rank_spreads(ops_data, scans, metric='reward_risk', top_k=10, candidate_filter=None, max_workers=1,
+                 part_size=256):
+    if max_workers == 1:
+        top_candidates = rank_candidates(iter_numbered_candidates(ops_data, scans), metric, top_k, candidate_filter)
+        return [(score, candidate.build()) for score, _, candidate in top_candidates]
+
+    get_ranking_metric(metric)
+    scan_parts = partition_scans(ops_data, scans, part_size)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_scan_worker,
+                             initargs=(ops_data,)) as executor:
+        part_rankings = executor.map(rank_worker_part, scan_parts, itertools.repeat(metric),
+                                     itertools.repeat(top_k), itertools.repeat(candidate_filter))
+        # Best score first, ties keep the candidate found first
+        top_ranks = heapq.nsmallest(top_k, itertools.chain.from_iterable(part_rankings),
+                                    key=lambda rank: (-rank[0], rank[1]))
+
+    # Build the spreads of the top K from the candidates of their parts in this process (legs are the options of
+    # ops_data)
+    top_spreads = []
+    for score, (scan_number, start, stop, number) in top_ranks:
+        strategy, strategy_args = scans[scan_number]
+        candidate = next(itertools.islice(iter_scan_candidates(ops_data, strategy, strategy_args, (start, stop)),
+                                          number, None))
+        top_spreads.append((score, candidate.build()))
+    return top_spreads
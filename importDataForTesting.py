@@ -1,7 +1,16 @@
-from yahoo_fin import options as op
+from ChainProviders import YahooChainProvider, CachedChainProvider
 
 ticker = "AAPL"
 
-expirationDates = op.get_expiration_dates(ticker)
 
-print(expirationDates)
\ No newline at end of file
+def main():
+    # Cached on disk so repeated runs do not fetch the data again
+    provider = CachedChainProvider(YahooChainProvider(), cache_directory='.chain_cache')
+
+    expirationDates = provider.get_expiration_dates(ticker)
+
+    print(expirationDates)
+
+
+if __name__ == '__main__':
+    main()